@@ -0,0 +1,211 @@
+import threading
+from collections import OrderedDict
+from app.processing import calculate_distances
+from app.spatial_index import FrequencyGrid
+
+def _normalise_stored_stations(approved_stations, db_planning_stations):
+    """
+    Converts the approved and persisted planning rows into plain dicts, in the order
+    the map has always used: approved first, then persisted planning.
+    Frequency 0 means "no frequency" and never conflicts.
+    """
+    stations = []
+    for s in approved_stations:
+        stations.append({
+            'id': f"approved_{s['id']}",
+            'name': s['name'],
+            'lat': float(s['latitude']),
+            'lon': float(s['longitude']),
+            'rad': float(s['safe_radius_km']),
+            'frequency': int(s['allocated_frequency']) if s['allocated_frequency'] is not None else 0,
+            'raw_frequency': s['allocated_frequency'],
+            'type': 'approved'
+        })
+    for s in db_planning_stations:
+        stations.append({
+            'id': f"db_planning_{s['id']}",
+            'name': s['name'],
+            'lat': float(s['latitude']),
+            'lon': float(s['longitude']),
+            'rad': float(s['safe_radius_km']),
+            'frequency': int(s['allocated_frequency']) if s['allocated_frequency'] is not None else 0,
+            'raw_frequency': s['allocated_frequency'],
+            'type': 'db_planning'
+        })
+    return stations
+
+def _normalise_frontend_stations(frontend_planning_stations):
+    """Converts the planning stations sent by the map UI, applying the UI defaults."""
+    stations = []
+    for s in frontend_planning_stations:
+        stations.append({
+            'id': s.get('id'),
+            'name': s.get('name'),
+            'lat': float(s.get('lat') or 0.0),
+            'lon': float(s.get('lon') or 0.0),
+            'rad': float(s.get('rad') or 12.0),
+            'frequency': int(s.get('frequency') or 1),
+            'type': 'planning'
+        })
+    return stations
+
+def _normalise_map_stations(approved_stations, db_planning_stations, frontend_planning_stations):
+    """All three sources in map order: approved, persisted planning, frontend planning."""
+    return (_normalise_stored_stations(approved_stations, db_planning_stations)
+            + _normalise_frontend_stations(frontend_planning_stations))
+
+def _inter_type_conflict(planning, other, distance, min_distance):
+    """Builds the interTypeConflicts entry for a frontend planning station vs an approved/persisted one."""
+    if other['type'] == 'approved':
+        popup_content = f"CONFLICT (Freq {planning['frequency']}): {planning['name']} & {other['name']} - Dist: {distance:.2f}km < {min_distance:.2f}km required"
+    else:
+        popup_content = f"CONFLICT (Freq {planning['frequency']}): {planning['name']} (Planning) & {other['name']} (Persisted Planning) - Dist: {distance:.2f}km < {min_distance:.2f}km required"
+    return {
+        'planning_name': planning['name'],
+        'planning_freq': planning['frequency'],
+        'approved_name': other['name'], # Persisted planning is treated as "approved" for the conflict message
+        'approved_freq': other['raw_frequency'],
+        'distance': distance,
+        'min_distance': min_distance,
+        'planning_lat': planning['lat'],
+        'planning_lon': planning['lon'],
+        'approved_lat': other['lat'],
+        'approved_lon': other['lon'],
+        'popup_content': popup_content
+    }
+
+def build_conflict_report(stations, conflicting_pairs):
+    """
+    Turns measured (stored_idx, planning_idx, distance, min_distance) pairs into the
+    interTypeConflicts list /api/update_map returns.
+
+    Frontend planning vs approved and frontend planning vs persisted planning pairs are
+    inter-type conflicts, listed approved first, each ordered by planning station then by
+    the other station. A frontend station carrying the id of a persisted planning station
+    is not in conflict with itself.
+
+    Same-frequency overlaps between arbitrary stations are not computed: the map has
+    always received none (see update_map), so they are left to their own change.
+    """
+    approved_conflicts = []
+    db_planning_conflicts = []
+    for stored_idx, planning_idx, distance, min_distance in conflicting_pairs:
+        stored, planning = stations[stored_idx], stations[planning_idx]
+        entry = ((planning_idx, stored_idx), _inter_type_conflict(planning, stored, distance, min_distance))
+        if stored['type'] == 'approved':
+            approved_conflicts.append(entry)
+        elif planning['id'] != stored['id']:
+            db_planning_conflicts.append(entry)
+
+    inter_type_conflicts = [c for _, c in sorted(approved_conflicts, key=lambda c: c[0])]
+    inter_type_conflicts += [c for _, c in sorted(db_planning_conflicts, key=lambda c: c[0])]
+    return inter_type_conflicts
+
+def find_map_conflicts(approved_stations, db_planning_stations, frontend_planning_stations):
+    """
+    Conflict check for the map without any caching: converts the approved and persisted
+    planning rows from the DB plus the frontend planning stations, measures each frontend
+    station against the stored stations on its frequency, and returns the inter-type
+    conflicts (see build_conflict_report).
+    """
+    return ConflictGraph().find_conflicts(approved_stations, db_planning_stations, frontend_planning_stations)
+
+def _geometry(station):
+    """The fields a station's conflict edges depend on; a rename does not change them."""
+    return (station['lat'], station['lon'], station['rad'], station['frequency'])
+
+class ConflictGraph:
+    """
+    Server-side conflict graph for /api/update_map that is updated incrementally.
+
+    The grid index over the stored stations (approved and persisted planning) is rebuilt
+    only when those rows change. A frontend planning station's edges to the stored
+    stations are cached by its geometry (lat, lon, radius, frequency), so a refresh only
+    measures stations that were added, moved or switched frequency since they were last seen.
+    """
+
+    def __init__(self, max_cached_planning: int = 4096):
+        self.max_cached_planning = max_cached_planning
+        self._lock = threading.Lock()
+        self._stored_fingerprint = None
+        self._stored_stations = []
+        self._stored_grid = FrequencyGrid([])
+        # geometry -> [(stored_idx, distance, min_distance)], least recently used first
+        self._planning_edges = OrderedDict()
+        self.stats = {'stored_rebuilds': 0, 'planning_hits': 0, 'planning_misses': 0}
+
+    def _refresh_stored(self, stored_stations):
+        """Rebuilds the stored stations' grid index, only when the stored rows actually changed."""
+        fingerprint = tuple(
+            (s['id'], s['name'], s['lat'], s['lon'], s['rad'], s['raw_frequency']) for s in stored_stations
+        )
+        if fingerprint == self._stored_fingerprint:
+            return
+        self._stored_fingerprint = fingerprint
+        self._stored_stations = stored_stations
+        self._stored_grid = FrequencyGrid([
+            (idx, s['frequency'], s['lat'], s['lon'], s['rad'])
+            for idx, s in enumerate(stored_stations) if s['frequency'] != 0
+        ])
+        # Cached planning edges point into the old stored list
+        self._planning_edges.clear()
+        self.stats['stored_rebuilds'] += 1
+
+    def _edges_to_stored(self, geometries):
+        """Measures new planning geometries against the stored stations in one batch."""
+        candidates = []
+        for geometry in geometries:
+            lat, lon, rad, freq = geometry
+            if freq == 0:
+                continue
+            reach_km = rad + self._stored_grid.max_radius(freq)
+            for stored_idx in self._stored_grid.query(freq, lat, lon, reach_km):
+                candidates.append((geometry, stored_idx))
+
+        edges = {geometry: [] for geometry in geometries}
+        if not candidates:
+            return edges
+        distances = calculate_distances(
+            [g[0] for g, _ in candidates], [g[1] for g, _ in candidates],
+            [self._stored_stations[k]['lat'] for _, k in candidates],
+            [self._stored_stations[k]['lon'] for _, k in candidates]
+        )
+        for (geometry, stored_idx), distance in zip(candidates, distances.tolist()):
+            min_distance = geometry[2] + self._stored_stations[stored_idx]['rad']
+            if distance < min_distance:
+                edges[geometry].append((stored_idx, distance, min_distance))
+        return edges
+
+    def find_conflicts(self, approved_stations, db_planning_stations, frontend_planning_stations):
+        """
+        Same inputs and return value as find_map_conflicts: the inter-type conflicts.
+        """
+        stored_stations = _normalise_stored_stations(approved_stations, db_planning_stations)
+        planning_stations = _normalise_frontend_stations(frontend_planning_stations)
+
+        with self._lock:
+            self._refresh_stored(stored_stations)
+            stored_stations = self._stored_stations
+            offset = len(stored_stations)
+
+            geometries = list(dict.fromkeys(_geometry(s) for s in planning_stations))
+            new_geometries = [g for g in geometries if g not in self._planning_edges]
+            self.stats['planning_hits'] += len(geometries) - len(new_geometries)
+            self.stats['planning_misses'] += len(new_geometries)
+            self._planning_edges.update(self._edges_to_stored(new_geometries))
+            current_edges = {}
+            for geometry in geometries:
+                self._planning_edges.move_to_end(geometry)
+                current_edges[geometry] = self._planning_edges[geometry]
+            while len(self._planning_edges) > self.max_cached_planning:
+                self._planning_edges.popitem(last=False)
+
+            conflicting_pairs = []
+            for p_idx, s in enumerate(planning_stations):
+                for stored_idx, distance, min_distance in current_edges[_geometry(s)]:
+                    conflicting_pairs.append((stored_idx, offset + p_idx, distance, min_distance))
+
+        return build_conflict_report(stored_stations + planning_stations, conflicting_pairs)
+
+# Shared by all map refreshes in this process
+map_conflict_graph = ConflictGraph()
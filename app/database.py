@@ -2,6 +2,8 @@ import sqlite3
 import os
 import sys
 import shutil
+import threading
+import traceback
 from flask import g # Import g for application context, useful for managing connections
 
 # Define the database file name
@@ -35,26 +37,120 @@ def get_db_path():
 # Global variable for the database file path
 DATABASE_FILE = get_db_path()
 
+# Pragmas applied once when a pooled connection is opened. WAL lets the map/allocation
+# readers keep reading while the admin CRUD routes write; NORMAL sync is safe in WAL mode.
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -16000), # negative = KiB, i.e. a 16 MB page cache per connection
+    ("mmap_size", 268435456), # 256 MB memory-mapped reads
+    ("temp_store", "MEMORY")
+)
+SQLITE_BUSY_TIMEOUT_SECONDS = 5.0
+DB_POOL_MAX_IDLE = 8
+
+class ConnectionPool:
+    """
+    Keeps opened, already tuned SQLite connections for reuse instead of connecting per request.
+    A connection is checked out by one thread at a time (acquire/release), so it is opened
+    with check_same_thread=False and can be reused by whichever request thread comes next.
+    At most `max_idle` connections are kept; extra ones are closed on release. After a fork
+    (e.g. a pre-forking server) the inherited connections are dropped and the pool starts over.
+    """
+
+    def __init__(self, database_file: str, max_idle: int = DB_POOL_MAX_IDLE):
+        self.database_file = database_file
+        self.max_idle = max_idle
+        self._idle = [] # LIFO: the most recently used connection has the warmest cache
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._opened = 0
+        self._reused = 0
+        self._closed = 0
+        self._in_use = 0
+
+    def _check_pid(self):
+        # Connections must not be shared across processes; forget (don't close) inherited ones
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._opened = self._reused = self._closed = self._in_use = 0
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database_file, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        conn.row_factory = sqlite3.Row # This allows accessing columns by name (e.g., row['name'])
+        for pragma, value in SQLITE_PRAGMAS:
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            self._check_pid()
+            self._in_use += 1
+            if self._idle:
+                self._reused += 1
+                return self._idle.pop()
+            self._opened += 1
+        try:
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+                self._opened -= 1
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        # Never hand a half-finished transaction (and its write lock) to the next request
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn = None # Unusable (e.g. closed by the caller), don't pool it
+        with self._lock:
+            if self._pid != os.getpid():
+                return # Checked out before a fork; the new pool doesn't count it
+            self._in_use -= 1
+            if conn is not None and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self._closed += 1
+        if conn is not None:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._check_pid()
+            return {
+                'pid': self._pid,
+                'max_idle': self.max_idle,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'opened': self._opened,
+                'reused': self._reused,
+                'closed': self._closed
+            }
+
+db_pool = ConnectionPool(DATABASE_FILE)
+
 def get_db_connection():
     """
     Helper to get a database connection that returns dict-like rows.
-    Uses Flask's 'g' object to store and reuse the connection within a request context.
+    The connection comes from db_pool and is kept in Flask's 'g' for the rest of the
+    request/app context; close_db hands it back to the pool at teardown.
+    Callers must not close it themselves.
     """
     if 'db' not in g:
-        g.db = sqlite3.connect(DATABASE_FILE)
-        g.db.row_factory = sqlite3.Row # This allows accessing columns by name (e.g., row['name'])
-        print("DEBUG: New DB connection opened.") # Debug print
+        g.db = db_pool.acquire()
     return g.db
 
 def close_db(e=None):
     """
-    Closes the database connection at the end of the request.
-    Registered with app.teardown_appcontext in routes.py or main.py.
+    Returns the context's database connection to the pool (rolling back anything left uncommitted).
+    Registered with app.teardown_appcontext in routes.py.
     """
     db = g.pop('db', None) # Get the db connection from g, remove it
     if db is not None:
-        db.close()
-        print("DEBUG: DB connection closed.") # Debug print
+        db_pool.release(db)
 
 def db_init():
     """
@@ -109,8 +205,82 @@ def db_init():
     print("DEBUG: 'planning_stations' table checked/created.")
 
     conn.commit()
+    run_migrations(conn)
     print("DEBUG: Database schema initialization complete.")
 
+# Columns shared by the legacy single 'stations' table and 'approved_stations' (everything but id)
+LEGACY_STATION_COLUMNS = (
+    "name", "Station_Code", "SKac_ID", "latitude", "longitude", "safe_radius_km", "status",
+    "allocated_frequency", "static_slots_req", "onboard_slots_req",
+    "allocated_p1", "allocated_p2", "allocated_p3", "allocated_p4", "allocated_p5", "allocated_p6",
+    "timeslot", "Area_type"
+)
+
+def _migration_add_station_indexes(cursor):
+    """Indexes for the hot queries: per-frequency geo lookups (covering) and status filters."""
+    for table in ("approved_stations", "planning_stations"):
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{table}_freq_geo
+            ON {table} (allocated_frequency, latitude, longitude, safe_radius_km)
+        """)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_status ON {table} (status)")
+
+def _migration_merge_legacy_stations(cursor):
+    """
+    Copies the rows of the pre-split 'stations' table into 'approved_stations' (rows whose
+    name or SKac_ID already exists are left alone), then drops it only if every legacy row
+    now has an identical approved row (all columns compared, NULLs included). Otherwise
+    the table is renamed to 'stations_legacy' so the differing rows stay available for a
+    manual look.
+    """
+    legacy_table = cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='stations'").fetchone()
+    if legacy_table is None:
+        return
+    columns = ", ".join(LEGACY_STATION_COLUMNS)
+    cursor.execute(f"INSERT OR IGNORE INTO approved_stations ({columns}) SELECT {columns} FROM stations ORDER BY id")
+
+    same_row = " AND ".join(f"a.{column} IS s.{column}" for column in LEGACY_STATION_COLUMNS)
+    differing = cursor.execute(
+        f"SELECT COUNT(*) FROM stations s WHERE NOT EXISTS (SELECT 1 FROM approved_stations a WHERE {same_row})"
+    ).fetchone()[0]
+    if not differing:
+        cursor.execute("DROP TABLE stations")
+        print("DEBUG: Dropped the legacy 'stations' table.")
+    elif cursor.execute("SELECT 1 FROM sqlite_master WHERE name='stations_legacy'").fetchone() is None:
+        cursor.execute("ALTER TABLE stations RENAME TO stations_legacy")
+        print(f"WARNING database.py: {differing} legacy station(s) differ from the approved stations; the legacy table was kept as 'stations_legacy'.")
+    else:
+        print(f"WARNING database.py: {differing} legacy station(s) differ from the approved stations; keeping the 'stations' table.")
+
+# (version, description, function(cursor)); append only, never renumber. The version
+# reached is stored in PRAGMA user_version, so each migration runs once per database.
+MIGRATIONS = [
+    (1, "indexes on frequency/geo and status", _migration_add_station_indexes),
+    (2, "merge legacy 'stations' table into 'approved_stations'", _migration_merge_legacy_stations)
+]
+
+def run_migrations(conn):
+    """
+    Applies the migrations newer than the database's PRAGMA user_version, in order, each in
+    its own transaction together with the version bump. BEGIN IMMEDIATE takes the write lock
+    first, so two processes starting at once can't both apply the same migration.
+    """
+    for version, description, migrate in MIGRATIONS:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+            continue
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check under the write lock: another process may have just applied it
+            if cursor.execute("PRAGMA user_version").fetchone()[0] < version:
+                migrate(cursor)
+                cursor.execute(f"PRAGMA user_version = {version}")
+                print(f"DEBUG: Applied database migration {version}: {description}.")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
 def get_approved_stations_from_db():
     """Fetches all stations from the 'approved_stations' table."""
     conn = get_db_connection()
@@ -127,6 +297,99 @@ def get_planning_stations_from_db():
     # The connection is managed by g and will be closed by close_db at end of request
     return stations
 
+# Result keys of the onboard slots per priority, stored in allocated_p1..allocated_p6
+ONBOARD_PRIORITY_RESULT_KEYS = [f"Onboard Slots P{n} Allocated" for n in range(1, 7)]
+
+PLANNING_UPSERT_SQL = """
+    INSERT INTO planning_stations (
+        name, Station_Code, SKac_ID, latitude, longitude, safe_radius_km, status, allocated_frequency,
+        static_slots_req, onboard_slots_req,
+        allocated_p1, allocated_p2, allocated_p3, allocated_p4, allocated_p5, allocated_p6,
+        timeslot, Area_type
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(SKac_ID) DO UPDATE SET
+        name=excluded.name, Station_Code=excluded.Station_Code, latitude=excluded.latitude,
+        longitude=excluded.longitude, safe_radius_km=excluded.safe_radius_km, status=excluded.status,
+        allocated_frequency=excluded.allocated_frequency, static_slots_req=excluded.static_slots_req,
+        onboard_slots_req=excluded.onboard_slots_req,
+        allocated_p1=excluded.allocated_p1, allocated_p2=excluded.allocated_p2, allocated_p3=excluded.allocated_p3,
+        allocated_p4=excluded.allocated_p4, allocated_p5=excluded.allocated_p5, allocated_p6=excluded.allocated_p6,
+        timeslot=excluded.timeslot, Area_type=excluded.Area_type
+"""
+
+def is_allocated_result(station_result) -> bool:
+    """A station got a frequency (failed ones carry "N/A" and an 'Error')."""
+    return isinstance(station_result.get("Frequency"), int) and not station_result.get("Error")
+
+def save_allocated_planning_stations(allocated_planning_results) -> dict:
+    """
+    Persists the allocated results to the 'planning_stations' table in one transaction:
+    a single executemany INSERT ... ON CONFLICT(SKac_ID) DO UPDATE, including the onboard
+    slots per priority (allocated_p1..p6) so a reload doesn't need a re-allocation.
+    Skipped: stations that got no frequency, have no Kavach ID, or whose name already belongs
+    to another Kavach ID (name is UNIQUE too and would abort the whole batch).
+    Returns {'inserted', 'updated', 'skipped'}. Needs an app context (uses get_db_connection).
+    """
+    conn = get_db_connection()
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE") # Nobody can change the rows between the lookup and the upsert
+    try:
+        # SKac_ID is TEXT, so ids are compared as the strings SQLite stores
+        skac_id_of_name = {}
+        name_of_skac_id = {}
+        for name, skac_id in cursor.execute("SELECT name, SKac_ID FROM planning_stations"):
+            skac_id = None if skac_id is None else str(skac_id)
+            skac_id_of_name[name] = skac_id
+            if skac_id is not None:
+                name_of_skac_id[skac_id] = name
+
+        rows = []
+        for station_result in allocated_planning_results:
+            skac_id = station_result.get("Stationary Kavach ID")
+            name = station_result.get("Station")
+            if not is_allocated_result(station_result) or skac_id in (None, ""):
+                counts['skipped'] += 1
+                continue
+            skac_id = str(skac_id)
+            if skac_id_of_name.get(name, skac_id) != skac_id:
+                print(f"WARNING database.py: Not saving planning station {name}: the name is already used by Kavach ID {skac_id_of_name[name]}.")
+                counts['skipped'] += 1
+                continue
+
+            old_name = name_of_skac_id.get(skac_id)
+            counts['inserted' if old_name is None else 'updated'] += 1
+            if old_name is not None and old_name != name:
+                del skac_id_of_name[old_name] # A renamed station frees its old name for the rest of the batch
+            skac_id_of_name[name] = skac_id
+            name_of_skac_id[skac_id] = name
+            rows.append((
+                name,
+                station_result.get("Station Code"),
+                skac_id,
+                station_result.get("Latitude"),
+                station_result.get("Longitude"),
+                station_result.get("SafeRadius"),
+                "Allocated",
+                station_result.get("Frequency"),
+                station_result.get("Stationary Kavach Slots Requested"),
+                station_result.get("Onboard Kavach Slots Requested"),
+                *(station_result.get(key) or None for key in ONBOARD_PRIORITY_RESULT_KEYS),
+                station_result.get("Allocated Timeslot Range"),
+                "Allocated Planning"
+            ))
+
+        cursor.executemany(PLANNING_UPSERT_SQL, rows)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"ERROR database.py: Failed to save allocated planning stations to 'planning_stations' DB: {e}")
+        traceback.print_exc()
+        raise
+
+    print(f"DEBUG database.py: Planning stations persisted: {counts['inserted']} inserted, {counts['updated']} updated, {counts['skipped']} skipped.")
+    return counts
+
 # This block is for direct execution of the script for initial DB setup
 if __name__ == '__main__':
     # When running directly, Flask's app context isn't available,
@@ -0,0 +1,93 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Job states, in the order a job moves through them
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_FINISHED = "finished"
+JOB_FAILED = "failed"
+
+class JobManager:
+    """
+    Runs long tasks (allocation + persistence + Excel) on a bounded pool of background
+    threads so the request that submits them returns straight away with a job id.
+
+    A task is called as `fn(report_progress, *args, **kwargs)`; it can call
+    `report_progress(stage)` to publish which step it is on, and whatever it returns
+    becomes the job result. Only the newest `max_finished_jobs` finished or failed jobs
+    are kept, older ones are forgotten.
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished_jobs: int = 200):
+        self.max_workers = max_workers
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="allocation-job")
+        self._jobs = OrderedDict() # job_id -> job dict, in submission order
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                'id': job_id,
+                'status': JOB_QUEUED,
+                'stage': JOB_QUEUED,
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None
+            }
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        print(f"DEBUG jobs.py: Job {job_id} queued.")
+        return job_id
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _run(self, job_id: str, fn, args, kwargs):
+        self._update(job_id, status=JOB_RUNNING, stage=JOB_RUNNING, started_at=time.time())
+
+        def report_progress(stage: str):
+            self._update(job_id, stage=stage)
+
+        try:
+            result = fn(report_progress, *args, **kwargs)
+        except Exception as e:
+            print(f"ERROR jobs.py: Job {job_id} failed: {e}")
+            traceback.print_exc()
+            self._update(job_id, status=JOB_FAILED, stage=JOB_FAILED, error=str(e), finished_at=time.time())
+        else:
+            self._update(job_id, status=JOB_FINISHED, stage=JOB_FINISHED, result=result, finished_at=time.time())
+            print(f"DEBUG jobs.py: Job {job_id} finished.")
+        self._prune()
+
+    def _prune(self):
+        with self._lock:
+            done_ids = [job_id for job_id, job in self._jobs.items() if job['status'] in (JOB_FINISHED, JOB_FAILED)]
+            for job_id in done_ids[:max(0, len(done_ids) - self.max_finished_jobs)]:
+                del self._jobs[job_id]
+
+    def get(self, job_id: str):
+        """Returns a copy of the job dict, or None for an unknown (or forgotten) job id."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_FINISHED: 0, JOB_FAILED: 0}
+            for job in self._jobs.values():
+                counts[job['status']] += 1
+            return {'max_workers': self.max_workers, **counts}
+
+# Two workers: enough to overlap a big batch with a small one without starving the web workers
+ALLOCATION_JOB_WORKERS = 2
+allocation_jobs = JobManager(max_workers=ALLOCATION_JOB_WORKERS)
@@ -1,13 +1,25 @@
+import csv
+import json
 import os
-from math import ceil, radians, cos, sin, asin, sqrt
+import threading
+from math import ceil
 from datetime import datetime
+from io import BytesIO, TextIOWrapper
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
 now = datetime.now()
+import numpy as np
 import pandas as pd
 import openpyxl
+import xlsxwriter
 from openpyxl.styles import PatternFill, Border, Side, Alignment, Font
 from openpyxl.utils import get_column_letter
-import sqlite3
-from app.database import get_db_connection
+from typing import Iterator, NamedTuple, Optional
+from app.database import get_approved_stations_from_db
+from app.spatial_index import nearby_pairs_by_frequency
+from app.cache import LRUCache, content_hash
 
 
 # Define file paths
@@ -16,20 +28,29 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 OUTPUT_FILE = os.path.join(UPLOAD_FOLDER, "output_kavach_slots_final_layout_v2.xlsx") # Updated output file name
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    from math import radians, cos, sin, asin, sqrt
-    
-    # Convert to radians
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    
-    # Haversine formula
+def calculate_distances(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Haversine distance (Earth radius 6371 km). Arguments broadcast against each other, so
+    one point against arrays gives one-to-many distances and two equal-length arrays
+    give element-wise (pairwise) distances. Returns kilometres as a float64 array.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+
     dlat = lat2 - lat1
     dlon = lon2 - lon1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    km = 6371 * c  # Earth's radius in kilometers
-    
-    return km
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    return 6371 * (2 * np.arcsin(np.sqrt(a)))
+
+def calculate_distance_matrix(lats1, lons1, lats2, lons2) -> np.ndarray:
+    """
+    Many-to-many distances: returns a (len(lats1), len(lats2)) matrix in kilometres
+    where [i, j] is the distance between point i of the first set and point j of the second.
+    """
+    lats1 = np.asarray(lats1, dtype=np.float64).reshape(-1, 1)
+    lons1 = np.asarray(lons1, dtype=np.float64).reshape(-1, 1)
+    lats2 = np.asarray(lats2, dtype=np.float64).reshape(1, -1)
+    lons2 = np.asarray(lons2, dtype=np.float64).reshape(1, -1)
+    return calculate_distances(lats1, lons1, lats2, lons2)
 
 def parse_timeslot_range(timeslot_str: str) -> set[int]:
     """
@@ -74,96 +95,318 @@ def parse_timeslot_range(timeslot_str: str) -> set[int]:
         print(f"DEBUG: Warning: Could not parse timeslot string '{timeslot_str}'. Expected format 'START-END' (e.g., '2-45') or single number ('2'). Returning empty set.")
         return set()
 
-def calculate_all_overlaps(stations_list):
-    overlapping_pair_data = []
-    has_major_conflict = False
-
-    for i in range(len(stations_list)):
-        s1 = stations_list[i]
-        for j in range(i + 1, len(stations_list)):
-            s2 = stations_list[j]
-
-            freq1 = int(s1.get('frequency', s1.get('allocated_frequency', 0)))
-            freq2 = int(s2.get('frequency', s2.get('allocated_frequency', 0)))
-
-            if freq1 == 0 or freq2 == 0 or freq1 != freq2:
+def _bit_indices(mask: int) -> list[int]:
+    """Slot indices of the set bits in `mask`, lowest first."""
+    indices = []
+    while mask:
+        lowest = mask & -mask
+        indices.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return indices
+
+def _bit_count(mask: int) -> int:
+    """Number of occupied slots in `mask` (int.bit_count needs Python 3.10)."""
+    return bin(mask).count("1")
+
+def _lowest_set_bits(mask: int, count: int) -> int:
+    """Keeps only the `count` lowest set bits of `mask`."""
+    kept = 0
+    while count > 0 and mask:
+        lowest = mask & -mask
+        kept |= lowest
+        mask ^= lowest
+        count -= 1
+    return kept
+
+def _adjacent_bits(mask: int, all_slots_mask: int) -> int:
+    """Slots directly above or below any slot in `mask`."""
+    return ((mask << 1) | (mask >> 1)) & all_slots_mask
+
+def build_geo_feasibility_matrix(
+    planning_lats, planning_lons, planning_radii,
+    approved_by_freq: dict,
+    max_frequencies: int,
+    chunk_rows: int = 1024
+):
+    """
+    Precomputes, for every planning station and every frequency, whether the station is
+    clear of all approved stations on that frequency (distance >= sum of safe radii).
+
+    `approved_by_freq` maps frequency -> (stations, lats, lons, radii), the shape of
+    ApprovedSnapshot.by_frequency. All approved stations are measured in one distance matrix per chunk
+    of planning rows, then split by frequency. Returns three (stations x frequencies)
+    arrays, column f-1 for frequency f:
+      feasible        - bool, True when no approved station conflicts
+      first_conflict  - index into approved_by_freq[f][0] of the first conflicting
+                        approved station in DB order, -1 when feasible
+      conflict_dist   - distance to that station in km (NaN when feasible)
+    """
+    planning_lats = np.asarray(planning_lats, dtype=np.float64)
+    planning_lons = np.asarray(planning_lons, dtype=np.float64)
+    planning_radii = np.asarray(planning_radii, dtype=np.float64)
+    n_planning = len(planning_lats)
+
+    feasible = np.ones((n_planning, max_frequencies), dtype=bool)
+    first_conflict = np.full((n_planning, max_frequencies), -1, dtype=np.int64)
+    conflict_dist = np.full((n_planning, max_frequencies), np.nan)
+
+    # Lay every approved station on a frequency out side by side, remembering the column span per frequency
+    freq_spans = {}
+    ap_lats, ap_lons, ap_radii = [], [], []
+    for f_id in range(1, max_frequencies + 1):
+        _, lats, lons, radii = approved_by_freq[f_id]
+        freq_spans[f_id] = (len(ap_lats), len(ap_lats) + len(lats))
+        ap_lats.extend(lats.tolist())
+        ap_lons.extend(lons.tolist())
+        ap_radii.extend(radii.tolist())
+    if n_planning == 0 or not ap_lats:
+        return feasible, first_conflict, conflict_dist
+    ap_radii = np.asarray(ap_radii, dtype=np.float64)
+
+    # Chunk the planning rows so very large batches keep the matrix small
+    for start in range(0, n_planning, chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        distances = calculate_distance_matrix(planning_lats[rows], planning_lons[rows], ap_lats, ap_lons)
+        conflicts = distances < (planning_radii[rows, None] + ap_radii[None, :])
+
+        for f_id, (col_start, col_end) in freq_spans.items():
+            if col_start == col_end:
                 continue
+            freq_conflicts = conflicts[:, col_start:col_end]
+            has_conflict = freq_conflicts.any(axis=1)
+            first_idx = freq_conflicts.argmax(axis=1)
+            feasible[rows, f_id - 1] = ~has_conflict
+            first_conflict[rows, f_id - 1] = np.where(has_conflict, first_idx, -1)
+            conflict_dist[rows, f_id - 1] = np.where(
+                has_conflict, distances[np.arange(len(first_idx)), col_start + first_idx], np.nan
+            )
+
+    return feasible, first_conflict, conflict_dist
+
+class ApprovedStation(NamedTuple):
+    """One approved station as the allocation engine sees it."""
+    name: str
+    latitude: float
+    longitude: float
+    safe_radius_km: float
+    allocated_frequency: int # -1 when the DB has no frequency
+    timeslot: Optional[str]
+    parsed_timeslots: frozenset
+
+class ApprovedSnapshot(NamedTuple):
+    """
+    Immutable, picklable view of the approved stations an allocation run checks against.
+    `by_frequency` maps frequency -> (stations, lats, lons, radii) with NumPy arrays,
+    ready for the feasibility matrix.
+    """
+    stations: tuple
+    by_frequency: dict
+    version: str = "" # Content hash of the rows, see approved_rows_version
+
+def approved_rows_version(approved_rows) -> str:
+    """Version stamp of the approved-station data: a hash over the columns allocation reads."""
+    return content_hash([
+        [row['name'], row['latitude'], row['longitude'], row['safe_radius_km'], row['allocated_frequency'], row['timeslot']]
+        for row in approved_rows
+    ])
+
+def build_approved_snapshot(approved_rows) -> ApprovedSnapshot:
+    """
+    Builds an ApprovedSnapshot from approved-station rows (sqlite3.Row or dicts with the
+    approved_stations columns). Pure: no DB access, so it can run anywhere.
+    """
+    approved_stations_list = []
+    for ap_station_row in approved_rows:
+        ap_station_dict = dict(ap_station_row)
+        # Ensure numeric types are correct from DB
+        ap_station = ApprovedStation(
+            name=ap_station_dict['name'],
+            latitude=float(ap_station_dict['latitude']) if ap_station_dict['latitude'] is not None else 0.0,
+            longitude=float(ap_station_dict['longitude']) if ap_station_dict['longitude'] is not None else 0.0,
+            safe_radius_km=float(ap_station_dict['safe_radius_km']) if ap_station_dict['safe_radius_km'] is not None else 12.0,
+            allocated_frequency=int(ap_station_dict['allocated_frequency']) if ap_station_dict['allocated_frequency'] is not None else -1,
+            timeslot=ap_station_dict.get('timeslot'),
+            # Parsed timeslot range kept for a future rule, not used for blocking slots now.
+            parsed_timeslots=frozenset(parse_timeslot_range(ap_station_dict.get('timeslot', '')))
+        )
+        approved_stations_list.append(ap_station)
+        print(f"DEBUG: Loaded Approved: {ap_station.name} (Freq: {ap_station.allocated_frequency}, Radius: {ap_station.safe_radius_km}km, Timeslot DB: '{ap_station.timeslot}' -> Parsed Indices: {set(ap_station.parsed_timeslots)})")
+
+    # Group approved stations per frequency as arrays for the feasibility matrix.
+    by_frequency = {}
+    for f_id in sorted({ap.allocated_frequency for ap in approved_stations_list if ap.allocated_frequency > 0}):
+        on_freq = tuple(ap for ap in approved_stations_list if ap.allocated_frequency == f_id)
+        by_frequency[f_id] = (
+            on_freq,
+            np.array([ap.latitude for ap in on_freq], dtype=np.float64),
+            np.array([ap.longitude for ap in on_freq], dtype=np.float64),
+            np.array([ap.safe_radius_km for ap in on_freq], dtype=np.float64)
+        )
+    return ApprovedSnapshot(
+        stations=tuple(approved_stations_list),
+        by_frequency=by_frequency,
+        version=approved_rows_version(approved_rows)
+    )
+
+_approved_snapshot_cache = {'snapshot': None}
+
+def load_approved_snapshot() -> ApprovedSnapshot:
+    """
+    Adapter: reads the 'approved_stations' table (the same rows the map draws) once and
+    turns it into an ApprovedSnapshot. The last snapshot is reused while the rows'
+    version stamp is unchanged. Needs an app context for the DB connection.
+    """
+    approved_rows = get_approved_stations_from_db()
+    print(f"DEBUG: Found {len(approved_rows)} approved stations in DB.")
+    version = approved_rows_version(approved_rows)
+    cached_snapshot = _approved_snapshot_cache['snapshot']
+    if cached_snapshot is not None and cached_snapshot.version == version:
+        return cached_snapshot
+    snapshot = build_approved_snapshot(approved_rows)
+    _approved_snapshot_cache['snapshot'] = snapshot
+    return snapshot
+
+# Allocation results keyed by a hash of the planning payload and the approved-data version
+ALLOCATION_CACHE_MAX_ENTRIES = 128
+ALLOCATION_CACHE_TTL_SECONDS = 15 * 60
+allocation_cache = LRUCache(ALLOCATION_CACHE_MAX_ENTRIES, ALLOCATION_CACHE_TTL_SECONDS)
+
+def allocation_cache_key(stations: list[dict], approved_snapshot: ApprovedSnapshot, max_slots: int, max_frequencies: int, mode: str = "sequential") -> str:
+    """Canonical key for an allocation run. Station order matters, the engine is order dependent."""
+    return content_hash({
+        'stations': stations,
+        'approved_version': approved_snapshot.version,
+        'max_slots': max_slots,
+        'max_frequencies': max_frequencies,
+        'mode': mode
+    })
+
+ALLOCATION_MODES = ("sequential", "clustered")
+
+def allocate_slots(
+    stations: list[dict],
+    max_slots: int = 44,
+    max_frequencies: int = 7,
+    approved_snapshot: Optional[ApprovedSnapshot] = None,
+    mode: str = "sequential"
+) -> list[dict]:
+    """
+    Allocates slots for the planning stations. Loads the approved-station snapshot from
+    the DB unless one is passed in, then runs the DB-free engine:
+      mode="sequential" - allocate_slots_with_snapshot, one shared set of slot maps
+      mode="clustered"  - allocate_slots_clustered, independent geographic clusters in parallel
+    Results are cached by payload + approved-data version, so a repeated request
+    skips allocation entirely.
+    """
+    if mode not in ALLOCATION_MODES:
+        raise ValueError(f"Unknown allocation mode '{mode}'. Expected one of: {', '.join(ALLOCATION_MODES)}")
+    if approved_snapshot is None:
+        approved_snapshot = load_approved_snapshot()
+
+    cache_key = allocation_cache_key(stations, approved_snapshot, max_slots, max_frequencies, mode)
+    cached_results = allocation_cache.get(cache_key)
+    if cached_results is None:
+        if mode == "clustered":
+            cached_results = allocate_slots_clustered(stations, approved_snapshot, max_slots, max_frequencies)
+        else:
+            cached_results = allocate_slots_with_snapshot(stations, approved_snapshot, max_slots, max_frequencies)
+        allocation_cache.put(cache_key, cached_results)
+    else:
+        print(f"DEBUG: Allocation cache hit ({cache_key[:12]}), skipping allocation.")
+    # Hand out copies so callers cannot modify the cached rows
+    return [dict(result) for result in cached_results]
 
-            lat1 = float(s1.get('lat', s1.get('latitude', 0.0)))
-            lon1 = float(s1.get('lon', s1.get('longitude', 0.0)))
-            lat2 = float(s2.get('lat', s2.get('latitude', 0.0)))
-            lon2 = float(s2.get('lon', s2.get('longitude', 0.0)))
-
-            rad1 = float(s1.get('radius', s1.get('safe_radius_km', 0.0)))
-            rad2 = float(s2.get('radius', s2.get('safe_radius_km', 0.0)))
+def iter_allocate_slots(
+    stations: list[dict],
+    max_slots: int = 44,
+    max_frequencies: int = 7,
+    approved_snapshot: Optional[ApprovedSnapshot] = None
+) -> Iterator[dict]:
+    """
+    Streaming form of allocate_slots: yields each station's output row as soon as it is
+    committed. A cached result for the same request is replayed; a fresh run is not
+    collected into the cache, so the full result list is never held in memory.
+    """
+    if approved_snapshot is None:
+        approved_snapshot = load_approved_snapshot()
 
-            if any(val is None for val in [lat1, lon1, lat2, lon2, rad1, rad2]):
-                print(f"Skipping overlap check due to missing/invalid coordinates/radius: {s1.get('name')} and {s2.get('name')}")
-                continue
+    cached_results = allocation_cache.get(allocation_cache_key(stations, approved_snapshot, max_slots, max_frequencies))
+    if cached_results is not None:
+        for result in cached_results:
+            yield dict(result)
+        return
+    yield from iter_allocate_slots_with_snapshot(stations, approved_snapshot, max_slots, max_frequencies)
 
-            dist_between_centers = calculate_distance(lat1, lon1, lat2, lon2)
-            sum_of_radii = rad1 + rad2
-
-            if dist_between_centers < sum_of_radii:
-                has_major_conflict = True
-                overlapping_pair_data.append({
-                    's1_id': s1['id'],
-                    's2_id': s2['id'],
-                    's1_name': s1.get('name') or s1.get('stationName'),
-                    's2_name': s2.get('name') or s2.get('stationName'),
-                    'frequency': freq1,
-                    'distance': dist_between_centers,
-                    'min_required': sum_of_radii,
-                    'line_coords': [[lat1, lon1], [lat2, lon2]],
-                    'popup_content': f"FREQ {freq1} OVERLAP: {s1.get('name') or s1.get('stationName')} & {s2.get('name') or s2.get('stationName')} - Dist: {dist_between_centers:.2f}km (Req: {sum_of_radii:.2f}km)"
-                })
-    return overlapping_pair_data, has_major_conflict
-
-def allocate_slots( 
+def iter_allocate_slots_with_snapshot(
     stations: list[dict],
+    approved_snapshot: ApprovedSnapshot,
     max_slots: int = 44,
     max_frequencies: int = 7
-) -> list[dict]:
+) -> Iterator[dict]:
     """
     Allocates stationary and onboard slots using a relational 6-priority system,
     with an added layer of frequency-switching based on conflicts with approved stations'
     geographical coverage and localized timeslot usage.
+
+    Generator: yields one output row per input station, in input order, as soon as
+    that station is committed. Everything it needs comes from `stations` and
+    `approved_snapshot`, so it can be benchmarked, cached or run in a worker process.
     """
-    allocations_output: list[dict] = []
-    
-    # This `frequency_slot_maps` tracks slots occupied by *planning stations*
-    # `0` means free, `station_name` means occupied by that planning station.
+    # This `frequency_slot_maps` tracks slots occupied by *planning stations*.
+    # Occupancy is a bitmask (bit i set = slot i taken); the owner lists hold the
+    # name of the planning station that took each slot.
     frequency_slot_maps = {
         f_id: {
-            'station_alloc': [0] * max_slots, # `0` for free, station_name for occupied
-            'onboard_alloc': [0] * max_slots  # `0` for free, station_name for occupied
+            'station_alloc': 0,
+            'onboard_alloc': 0,
+            'station_owner': [None] * max_slots,
+            'onboard_owner': [None] * max_slots
         }
         for f_id in range(1, max_frequencies + 1)
     }
+    all_slots_mask = (1 << max_slots) - 1
 
     print("DEBUG: Starting allocate_slots function.")
-    # --- Fetch Approved Stations (only once) ---
-    conn = get_db_connection()
-    approved_stations = conn.execute("SELECT * FROM stations WHERE status = 'approved'").fetchall()
-
-    approved_stations_list = []
-    print(f"DEBUG: Found {len(approved_stations)} approved stations in DB.")
-    for ap_station_row in approved_stations:
-        ap_station_dict = dict(ap_station_row)
-        # Ensure numeric types are correct from DB
-        ap_station_dict['allocated_frequency'] = int(ap_station_dict['allocated_frequency']) if ap_station_dict['allocated_frequency'] is not None else -1
-        ap_station_dict['safe_radius_km'] = float(ap_station_dict['safe_radius_km']) if ap_station_dict['safe_radius_km'] is not None else 12.0
-        ap_station_dict['latitude'] = float(ap_station_dict['latitude']) if ap_station_dict['latitude'] is not None else 0.0
-        ap_station_dict['longitude'] = float(ap_station_dict['longitude']) if ap_station_dict['longitude'] is not None else 0.0
-        
-        # Parse timeslot range for approved stations if needed for future rule, though not directly used for blocking slots globally now.
-        ap_station_dict['parsed_timeslots'] = parse_timeslot_range(ap_station_dict.get('timeslot', ''))
-
-        approved_stations_list.append(ap_station_dict)
-        print(f"DEBUG: Loaded Approved: {ap_station_dict['name']} (Freq: {ap_station_dict['allocated_frequency']}, Radius: {ap_station_dict['safe_radius_km']}km, Timeslot DB: '{ap_station_dict.get('timeslot', 'N/A')}' -> Parsed Indices: {ap_station_dict['parsed_timeslots']})")
-
+    no_approved = ((), np.empty(0), np.empty(0), np.empty(0))
+    approved_by_freq = {
+        f_id: approved_snapshot.by_frequency.get(f_id, no_approved)
+        for f_id in range(1, max_frequencies + 1)
+    }
     
+    # --- Validate and convert planning inputs up front ---
+    # Each entry is either the converted numeric values or the error to report.
+    planning_inputs = []
     for station_data in stations:
+        latitude = station_data["Latitude"]
+        longitude = station_data["Longitude"]
+        # Assuming safe_radius_km is also part of planning station input, or use default
+        safe_radius_km = station_data.get("SafeRadius", 12.0) # Use .get() for optional, with a default
+        optimum_static_param = station_data["Static"]
+        requested_onboard_slots = station_data["onboardSlots"]
+
+        # Input Type Checking / Validation
+        if not all(isinstance(val, (int, float)) for val in [latitude, longitude, safe_radius_km, optimum_static_param, requested_onboard_slots]):
+            planning_inputs.append(("invalid_type", None))
+            continue
+        try:
+            planning_inputs.append(("ok", (
+                float(latitude), float(longitude), float(safe_radius_km),
+                float(optimum_static_param), int(requested_onboard_slots)
+            )))
+        except (ValueError, TypeError) as e:
+            planning_inputs.append(("conversion_error", e))
+
+    # --- Precompute the geo feasibility of every (valid station, frequency) in one pass ---
+    valid_rows = [idx for idx, (state, _) in enumerate(planning_inputs) if state == "ok"]
+    matrix_row_of = {idx: row for row, idx in enumerate(valid_rows)}
+    geo_feasible, geo_first_conflict, geo_conflict_dist = build_geo_feasibility_matrix(
+        [planning_inputs[idx][1][0] for idx in valid_rows],
+        [planning_inputs[idx][1][1] for idx in valid_rows],
+        [planning_inputs[idx][1][2] for idx in valid_rows],
+        approved_by_freq, max_frequencies
+    )
+
+    for station_idx, station_data in enumerate(stations):
         # --- Station Data Initialization (Using keys from your original code snippet) ---
         station_name = station_data["name"]
         optimum_static_param = station_data["Static"]
@@ -172,35 +415,30 @@ def allocate_slots(
         skavach_id = station_data["KavachID"]
         latitude = station_data["Latitude"]
         longitude = station_data["Longitude"]
-        # Assuming safe_radius_km is also part of planning station input, or use default
-        safe_radius_km = station_data.get("SafeRadius", 12.0) # Use .get() for optional, with a default
+        safe_radius_km = station_data.get("SafeRadius", 12.0)
 
         print(f"\nDEBUG: --- Processing Planning Station: {station_name} ---")
         print(f"DEBUG: Input Data for {station_name} - Lat: {latitude}, Lon: {longitude}, SafeRadius: {safe_radius_km}km, StaticParam: {optimum_static_param}, RequestedOnboard: {requested_onboard_slots}")
 
-        # Input Type Checking / Validation
-        if not all(isinstance(val, (int, float)) for val in [latitude, longitude, safe_radius_km, optimum_static_param, requested_onboard_slots]):
+        input_state, input_values = planning_inputs[station_idx]
+        if input_state == "invalid_type":
             print(f"DEBUG: Error for {station_name}: Invalid type for numeric input data. Lat:{type(latitude)}, Lon:{type(longitude)}, etc.")
-            allocations_output.append({
+            yield {
                 "Station": station_name, "Frequency": "N/A",
                 "Error": "Invalid numeric input data types for calculation."
-            })
+            }
             continue
-
-        try:
-            latitude = float(latitude)
-            longitude = float(longitude)
-            safe_radius_km = float(safe_radius_km)
-            optimum_static_param = float(optimum_static_param)
-            requested_onboard_slots = int(requested_onboard_slots)
-        except (ValueError, TypeError) as e:
-            print(f"DEBUG: Error for {station_name}: Type conversion failed for station data: {e}. Skipping.")
-            allocations_output.append({
+        if input_state == "conversion_error":
+            print(f"DEBUG: Error for {station_name}: Type conversion failed for station data: {input_values}. Skipping.")
+            yield {
                 "Station": station_name, "Frequency": "N/A",
-                "Error": f"Type conversion failed for station data: {e}"
-            })
+                "Error": f"Type conversion failed for station data: {input_values}"
+            }
             continue # Skip to next station
 
+        latitude, longitude, safe_radius_km, optimum_static_param, requested_onboard_slots = input_values
+        matrix_row = matrix_row_of[station_idx]
+
         val_for_roundup = ((optimum_static_param * 120) + (requested_onboard_slots - optimum_static_param) * 40 + 100) / 66
         calculated_station_slots_needed = ceil(val_for_roundup) if val_for_roundup > 0 else 1 # Ensure at least 1 slot if needed
         print(f"DEBUG: Calculated Stationary Slots Needed for {station_name}: {calculated_station_slots_needed}")
@@ -211,26 +449,26 @@ def allocate_slots(
         for current_freq_id_attempt in range(1, max_frequencies + 1):
             print(f"DEBUG: Attempting Frequency: {current_freq_id_attempt} for {station_name}")
             
-            station_alloc_map = list(frequency_slot_maps[current_freq_id_attempt]['station_alloc']) # Use a copy for current checks
-            onboard_alloc_map = list(frequency_slot_maps[current_freq_id_attempt]['onboard_alloc']) # Use a copy for current checks
+            # Bitmasks are immutable ints, so reading them is already a snapshot for this attempt
+            station_free_mask = all_slots_mask & ~frequency_slot_maps[current_freq_id_attempt]['station_alloc']
+            onboard_free_mask = all_slots_mask & ~frequency_slot_maps[current_freq_id_attempt]['onboard_alloc']
 
             # --- 1. Geographical Conflict Check with Approved Stations on this frequency ---
             has_geo_conflict_with_approved = False 
             conflicting_approved_stations = [] 
 
-            for ap_station in approved_stations_list:
-                ap_freq = ap_station.get('allocated_frequency')
-                
-                # Only check if the approved station is on the current frequency attempt
-                if ap_freq == current_freq_id_attempt:
-                    distance = calculate_distance(latitude, longitude, ap_station['latitude'], ap_station['longitude'])
-                    min_distance_sum = (safe_radius_km + ap_station['safe_radius_km'])
-                    
-                    if distance < min_distance_sum:
-                        has_geo_conflict_with_approved = True
-                        conflicting_approved_stations.append(f"{ap_station['name']} (Dist: {distance:.2f}km, MinReq: {min_distance_sum:.2f}km, AppFreq: {ap_freq})")
-                        print(f"DEBUG:   -- Geo Conflict Detected: {station_name} (Planning) vs {ap_station['name']} (Approved) on Freq {current_freq_id_attempt}. Distance: {distance:.2f}km, Min Required: {min_distance_sum:.2f}km.")
-                        break # Found one, this frequency is unsuitable based on your rule.
+            # Only approved stations on the current frequency attempt matter; looked up from the precomputed matrix
+            if not geo_feasible[matrix_row, current_freq_id_attempt - 1]:
+                ap_on_freq, _, _, ap_radii = approved_by_freq[current_freq_id_attempt]
+                # Report the first conflict in DB order, as the rule only needs one.
+                k = int(geo_first_conflict[matrix_row, current_freq_id_attempt - 1])
+                ap_station = ap_on_freq[k]
+                ap_freq = ap_station.allocated_frequency
+                distance = float(geo_conflict_dist[matrix_row, current_freq_id_attempt - 1])
+                min_distance_sum = float(safe_radius_km + ap_radii[k])
+                has_geo_conflict_with_approved = True
+                conflicting_approved_stations.append(f"{ap_station.name} (Dist: {distance:.2f}km, MinReq: {min_distance_sum:.2f}km, AppFreq: {ap_freq})")
+                print(f"DEBUG:   -- Geo Conflict Detected: {station_name} (Planning) vs {ap_station.name} (Approved) on Freq {current_freq_id_attempt}. Distance: {distance:.2f}km, Min Required: {min_distance_sum:.2f}km.")
 
             if has_geo_conflict_with_approved:
                 print(f"DEBUG: Freq {current_freq_id_attempt} is unsuitable for {station_name} due to geographical conflict with approved stations: {', '.join(conflicting_approved_stations)}. Trying next frequency.")
@@ -239,14 +477,9 @@ def allocate_slots(
             print(f"DEBUG: Freq {current_freq_id_attempt} is geographically clear for {station_name} with all approved stations.")
 
             # --- 2. Find Prospective Stationary Slots (considering *only* previously allocated planning stations) ---
-            # This logic remains the same as your original, operating on station_alloc_map which tracks PLANNING stations.
-            prospective_station_slots_indices: list[int] = []
-            
-            for i in range(max_slots):
-                if len(prospective_station_slots_indices) < calculated_station_slots_needed:
-                    if station_alloc_map[i] == 0: # Check if slot is free (0) for planning stations
-                        prospective_station_slots_indices.append(i)
-                else: break # Enough slots found
+            # The lowest free slots in this frequency's planning-station map.
+            prospective_mask = _lowest_set_bits(station_free_mask, calculated_station_slots_needed)
+            prospective_station_slots_indices = _bit_indices(prospective_mask)
             
             if len(prospective_station_slots_indices) < calculated_station_slots_needed:
                 print(f"DEBUG: Not enough free stationary slots ({len(prospective_station_slots_indices)}/{calculated_station_slots_needed}) in Freq {current_freq_id_attempt} for {station_name} (taken by other planning stations). Trying next frequency.")
@@ -256,57 +489,41 @@ def allocate_slots(
 
 
             # --- Step 2 (cont.): Plan-Then-Reclassify Onboard Slots ---
-            # This part of the logic remains largely the same as your original code,
-            # using the `station_alloc_map` and `onboard_alloc_map` which
-            # reflect commitments from *other planning stations*.
+            # Every P-category is a bitmask over the slots; the onboard free mask
+            # reflects commitments from *other planning stations*.
             
             # Non-Stationary Planning (Proto-P1 and P3)
-            planned_proto_p1: list[int] = []
-            planned_p3: list[int] = []
-            set_prospective_station_slots = set(prospective_station_slots_indices)
+            proto_p1_mask = 0
+            p3_mask = 0
+            off_stationary_free = onboard_free_mask & ~prospective_mask
 
             if requested_onboard_slots > 0:
-                idx = 0
-                while len(planned_proto_p1) < requested_onboard_slots and idx < max_slots:
-                    if (onboard_alloc_map[idx] == 0 and idx not in set_prospective_station_slots):
-                        is_adjacent_to_this_planning_stationary = (idx > 0 and idx - 1 in set_prospective_station_slots) or \
-                                                            (idx < max_slots - 1 and idx + 1 in set_prospective_station_slots)
-                        
-                        if not is_adjacent_to_this_planning_stationary:
-                            planned_proto_p1.append(idx)
-                            idx += 2 
-                        else:
-                            idx += 1 
-                    else:
-                        idx += 1 
+                # Proto-P1: free, off this station's stationary slots and not next to them.
+                # Taking a slot skips its upper neighbour, so P1 slots are never adjacent.
+                p1_candidates = off_stationary_free & ~_adjacent_bits(prospective_mask, all_slots_mask)
+                proto_p1_count = 0
+                while proto_p1_count < requested_onboard_slots and p1_candidates:
+                    lowest = p1_candidates & -p1_candidates
+                    proto_p1_mask |= lowest
+                    proto_p1_count += 1
+                    p1_candidates &= ~((lowest << 2) - 1) # Drop this slot and the one above it
                 
-            onboard_to_place_p3 = requested_onboard_slots - len(planned_proto_p1)
+            onboard_to_place_p3 = requested_onboard_slots - _bit_count(proto_p1_mask)
             if onboard_to_place_p3 > 0:
-                for i in range(max_slots):
-                    if len(planned_p3) < onboard_to_place_p3:
-                        if (onboard_alloc_map[i] == 0 and i not in set_prospective_station_slots and i not in planned_proto_p1):
-                            planned_p3.append(i)
-                    else: break
+                p3_mask = _lowest_set_bits(off_stationary_free & ~proto_p1_mask, onboard_to_place_p3)
             
             # Re-classify Proto-P1 into final P1 and P2
-            planned_p1: list[int] = []
-            planned_p2: list[int] = []
-            set_p3 = set(planned_p3)
-            for slot in planned_proto_p1:
-                is_adjacent_to_p3 = (slot - 1 in set_p3) or (slot + 1 in set_p3)
-                if is_adjacent_to_p3:
-                    planned_p2.append(slot)
-                else:
-                    planned_p1.append(slot)
+            next_to_p3 = _adjacent_bits(p3_mask, all_slots_mask)
+            p2_mask = proto_p1_mask & next_to_p3
+            p1_mask = proto_p1_mask & ~next_to_p3
             
             # On-Stationary Planning (Proto-P4 and P6)
-            planned_proto_p4: list[int] = []
-            planned_p6: list[int] = []
-            # Filter candidates: must be one of the *current planning station's* prospective stationary slots,
-            # and free for onboard within the temporary map.
-            on_stationary_candidates = [idx for idx in prospective_station_slots_indices 
-                                        if onboard_alloc_map[idx] == 0 
-                                        and idx not in (planned_p1 + planned_p2 + planned_p3)] # Ensure it's not already designated as non-stationary onboard
+            proto_p4_mask = 0
+            p6_mask = 0
+            # Candidates: the *current planning station's* prospective stationary slots that are
+            # free for onboard and not already designated as non-stationary onboard.
+            on_stationary_candidates = _bit_indices(prospective_mask & onboard_free_mask & ~(p1_mask | p2_mask | p3_mask))
+            planned_count = _bit_count(p1_mask | p2_mask | p3_mask)
 
             if on_stationary_candidates:
                 bottom_most_candidate = on_stationary_candidates[0]
@@ -314,57 +531,49 @@ def allocate_slots(
                 
                 # P4a: Alternating
                 for i in range(0, len(main_p4_candidates), 2):
-                    if len(planned_p1) + len(planned_p2) + len(planned_p3) + len(planned_proto_p4) >= requested_onboard_slots: break
-                    planned_proto_p4.append(main_p4_candidates[i])
+                    if planned_count >= requested_onboard_slots: break
+                    proto_p4_mask |= 1 << main_p4_candidates[i]
+                    planned_count += 1
                 
                 # P4b: Take bottom-most
-                if len(planned_p1) + len(planned_p2) + len(planned_p3) + len(planned_proto_p4) < requested_onboard_slots:
-                    if bottom_most_candidate not in planned_proto_p4:
-                        planned_proto_p4.append(bottom_most_candidate)
+                if planned_count < requested_onboard_slots:
+                    proto_p4_mask |= 1 << bottom_most_candidate
+                    planned_count += 1
                 
                 # Plan P6 (Continuous fill of on-stationary gaps)
-                p6_candidates = [c for c in on_stationary_candidates if c not in planned_proto_p4]
-                for c in p6_candidates:
-                    if len(planned_p1) + len(planned_p2) + len(planned_p3) + len(planned_proto_p4) + len(planned_p6) >= requested_onboard_slots: break
-                    planned_p6.append(c)
+                for c in on_stationary_candidates:
+                    if planned_count >= requested_onboard_slots: break
+                    if not proto_p4_mask >> c & 1:
+                        p6_mask |= 1 << c
+                        planned_count += 1
 
             # Re-classify Proto-P4 into final P4 and P5
-            planned_p4: list[int] = []
-            planned_p5: list[int] = []
-            set_p6 = set(planned_p6)
-            for slot in planned_proto_p4:
-                is_adjacent_to_p6 = (slot - 1 in set_p6) or (slot + 1 in set_p6)
-                if is_adjacent_to_p6:
-                    planned_p5.append(slot)
-                else:
-                    planned_p4.append(slot)
-
-            slot_p45_idx = 43
-            all_lists = {
-                'p1': planned_p1, 'p2': planned_p2, 'p4': planned_p4, 
-                'p5': planned_p5, 'p6': planned_p6
-            }
-            for key, p_list in all_lists.items():
-                if slot_p45_idx in p_list:
-                    p_list.remove(slot_p45_idx)
-                    if slot_p45_idx not in planned_p3:
-                        planned_p3.append(slot_p45_idx)
-                    print(f"DEBUG: P45 (slot {slot_p45_idx+2}) moved from {key} to P3 for {station_name}.")
+            next_to_p6 = _adjacent_bits(p6_mask, all_slots_mask)
+            p5_mask = proto_p4_mask & next_to_p6
+            p4_mask = proto_p4_mask & ~next_to_p6
+
+            # P45 is always a P3 slot: move it from the first category holding it
+            slot_p45_bit = 1 << 43
+            category_masks = {'p1': p1_mask, 'p2': p2_mask, 'p4': p4_mask, 'p5': p5_mask, 'p6': p6_mask}
+            for key, p_mask in category_masks.items():
+                if p_mask & slot_p45_bit:
+                    category_masks[key] = p_mask & ~slot_p45_bit
+                    p3_mask |= slot_p45_bit
+                    print(f"DEBUG: P45 (slot {43+2}) moved from {key} to P3 for {station_name}.")
                     break
+            p1_mask, p2_mask, p4_mask, p5_mask, p6_mask = (category_masks[k] for k in ('p1', 'p2', 'p4', 'p5', 'p6'))
             
             # --- Finalize Plan for this Frequency Attempt ---
-            total_onboard_planned = len(planned_p1) + len(planned_p2) + len(planned_p3) + len(planned_p4) + len(planned_p5) + len(planned_p6)
+            total_onboard_planned = sum(_bit_count(m) for m in (p1_mask, p2_mask, p3_mask, p4_mask, p5_mask, p6_mask))
             all_onboard_met = (total_onboard_planned >= requested_onboard_slots)
 
             if all_onboard_met: 
                 committed_plan_details_for_station = {
                     "station_name": station_name, "frequency": current_freq_id_attempt,
                     "calculated_station_slots": calculated_station_slots_needed,
-                    "prospective_station_slots_indices": list(prospective_station_slots_indices),
+                    "prospective_station_slots_indices": prospective_station_slots_indices,
                     "requested_onboard_slots": requested_onboard_slots,
-                    "onboard_indices_p1": list(planned_p1), "onboard_indices_p2": list(planned_p2),
-                    "onboard_indices_p3": list(planned_p3), "onboard_indices_p4": list(planned_p4),
-                    "onboard_indices_p5": list(planned_p5), "onboard_indices_p6": list(planned_p6),
+                    "onboard_masks": (p1_mask, p2_mask, p3_mask, p4_mask, p5_mask, p6_mask),
                     "Static": optimum_static_param, "StationCode": station_code, 
                     "KavachID": skavach_id, "Latitude": latitude, "Longitude": longitude,
                     "SafeRadius": safe_radius_km # Add SafeRadius to committed plan
@@ -380,37 +589,32 @@ def allocate_slots(
             s_name_commit = committed_plan_details_for_station["station_name"]
 
             stat_p_nums_allocated: list[str] = []
+            slot_map = frequency_slot_maps[chosen_freq]
             # Mark stationary slots as occupied by this planning station in the *global* map
             for slot_idx in committed_plan_details_for_station["prospective_station_slots_indices"]:
-                frequency_slot_maps[chosen_freq]['station_alloc'][slot_idx] = s_name_commit
+                slot_map['station_alloc'] |= 1 << slot_idx
+                slot_map['station_owner'][slot_idx] = s_name_commit
                 stat_p_nums_allocated.append(f"P{slot_idx+2}")
 
             onboard_p_nums_overall: list[str] = []
-            onboard_p1_nums, onboard_p2_nums, onboard_p3_nums, onboard_p4_nums, onboard_p5_nums, onboard_p6_nums = [], [], [], [], [], []
-            
-            all_planned_indices_tuples = [
-                (onboard_p1_nums, committed_plan_details_for_station["onboard_indices_p1"]),
-                (onboard_p2_nums, committed_plan_details_for_station["onboard_indices_p2"]),
-                (onboard_p3_nums, committed_plan_details_for_station["onboard_indices_p3"]),
-                (onboard_p4_nums, committed_plan_details_for_station["onboard_indices_p4"]),
-                (onboard_p5_nums, committed_plan_details_for_station["onboard_indices_p5"]),
-                (onboard_p6_nums, committed_plan_details_for_station["onboard_indices_p6"])
-            ]
+            onboard_p_nums_by_priority: list[list[str]] = [[], [], [], [], [], []] # P1..P6
 
             current_onboard_placed_count = 0
-            for p_num_list, p_indices_list in all_planned_indices_tuples:
-                for slot_idx in sorted(list(set(p_indices_list))): # Use set to remove duplicates before sorting
+            for p_num_list, p_mask in zip(onboard_p_nums_by_priority, committed_plan_details_for_station["onboard_masks"]):
+                for slot_idx in _bit_indices(p_mask):
                     if current_onboard_placed_count < committed_plan_details_for_station["requested_onboard_slots"]:
-                        # Check if slot is truly free (0) in the global map for onboard allocations
-                        if frequency_slot_maps[chosen_freq]['onboard_alloc'][slot_idx] == 0: 
-                            frequency_slot_maps[chosen_freq]['onboard_alloc'][slot_idx] = s_name_commit
+                        # Check if slot is truly free in the global map for onboard allocations
+                        if not slot_map['onboard_alloc'] >> slot_idx & 1:
+                            slot_map['onboard_alloc'] |= 1 << slot_idx
+                            slot_map['onboard_owner'][slot_idx] = s_name_commit
                             p_num = f"P{slot_idx+2}"
                             p_num_list.append(p_num)
                             onboard_p_nums_overall.append(p_num)
                             current_onboard_placed_count += 1
                         else:
-                            print(f"DEBUG: Warning: Onboard slot P{slot_idx+2} in Freq {chosen_freq} already occupied by {frequency_slot_maps[chosen_freq]['onboard_alloc'][slot_idx]} (another planning station) when placing {s_name_commit}'s onboard slots. Skipping this slot for {s_name_commit}.")
+                            print(f"DEBUG: Warning: Onboard slot P{slot_idx+2} in Freq {chosen_freq} already occupied by {slot_map['onboard_owner'][slot_idx]} (another planning station) when placing {s_name_commit}'s onboard slots. Skipping this slot for {s_name_commit}.")
                     else: break
+            onboard_p1_nums, onboard_p2_nums, onboard_p3_nums, onboard_p4_nums, onboard_p5_nums, onboard_p6_nums = onboard_p_nums_by_priority
             
             # Determine the allocated timeslot for this planning station
             allocated_stationary_indices_sorted = sorted(committed_plan_details_for_station["prospective_station_slots_indices"])
@@ -422,7 +626,7 @@ def allocate_slots(
 
             print(f"DEBUG: {s_name_commit} successfully allocated on Frequency {chosen_freq}. Stationary Slots: {', '.join(sorted(stat_p_nums_allocated, key=lambda x: int(x[1:])))}. Onboard Slots: {', '.join(sorted(onboard_p_nums_overall, key=lambda x: int(x[1:])))}. Allocated Timeslot Range: {allocated_timeslot_str}")
 
-            allocations_output.append({
+            yield {
                 "Station": s_name_commit, "Frequency": chosen_freq,
                 "Stationary Kavach ID": committed_plan_details_for_station["KavachID"],
                 "Station Code": committed_plan_details_for_station["StationCode"],
@@ -443,10 +647,10 @@ def allocate_slots(
                 "Onboard Slots P5 Allocated": ", ".join(sorted(onboard_p5_nums, key=lambda x: int(x[1:]))),
                 "Onboard Slots P6 Allocated": ", ".join(sorted(onboard_p6_nums, key=lambda x: int(x[1:]))),
                 "Allocated Timeslot Range": allocated_timeslot_str
-            })
+            }
         else:
             print(f"DEBUG: Failed to find any suitable frequency for {station_name} after checking all {max_frequencies} frequencies. Marking as N/A.")
-            allocations_output.append({
+            yield {
                 "Station": station_name, "Frequency": "N/A",
                 "Stationary Kavach ID": skavach_id, "Station Code": station_code,
                 "Latitude": latitude, "Longitude": longitude, "Static": optimum_static_param,
@@ -458,37 +662,445 @@ def allocate_slots(
                 "Onboard Slots P3 Allocated": "", "Onboard Slots P4 Allocated": "",
                 "Onboard Slots P5 Allocated": "", "Onboard Slots P6 Allocated": "",
                 "Error": "No suitable frequency found due to geographical conflict with approved stations or insufficient available slots for planning."
-            })
+            }
             
     print("DEBUG: allocate_slots function finished.")
+
+def allocate_slots_with_snapshot(
+    stations: list[dict],
+    approved_snapshot: ApprovedSnapshot,
+    max_slots: int = 44,
+    max_frequencies: int = 7
+) -> list[dict]:
+    """List form of iter_allocate_slots_with_snapshot: all output rows, in input order."""
+    return list(iter_allocate_slots_with_snapshot(stations, approved_snapshot, max_slots, max_frequencies))
+
+# Below this many stations the clustered mode stays in-process; starting workers costs more than it saves
+CLUSTER_PARALLEL_MIN_STATIONS = 64
+
+# Worker processes for clustered allocation, created once per process instead of per request.
+# They are started with "spawn": forking a threaded web worker could copy a lock that another
+# thread (db_pool, the caches, the job pool) held at that moment into the child, which then
+# hangs on it. Frozen builds need multiprocessing.freeze_support() in main.py for this.
+ALLOCATION_POOL_MAX_WORKERS = max(1, min(4, os.cpu_count() or 1))
+_allocation_pool = {'executor': None, 'pid': None}
+_allocation_pool_lock = threading.Lock()
+
+def allocation_process_pool() -> ProcessPoolExecutor:
+    """The shared allocation worker pool, started on first use (again after a fork)."""
+    with _allocation_pool_lock:
+        if _allocation_pool['executor'] is None or _allocation_pool['pid'] != os.getpid():
+            _allocation_pool['executor'] = ProcessPoolExecutor(
+                max_workers=ALLOCATION_POOL_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            _allocation_pool['pid'] = os.getpid()
+        return _allocation_pool['executor']
+
+def _discard_allocation_pool(executor: ProcessPoolExecutor):
+    """Drops a broken pool so the next call starts a fresh one."""
+    with _allocation_pool_lock:
+        if _allocation_pool['executor'] is executor:
+            _allocation_pool['executor'] = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def partition_planning_clusters(stations: list[dict], interaction_radius_km: Optional[float] = None) -> list[list[int]]:
+    """
+    Splits planning stations into connected components. Two stations are connected when
+    they are closer than the sum of their safe radii (their coverage could meet), or
+    closer than `interaction_radius_km` when that is given. Stations with non-numeric
+    coordinates form their own component so the engine can report them as usual.
+
+    Returns lists of input indices; each list is in input order and the components are
+    ordered by their first index, so the partition is deterministic.
+    """
+    parent = list(range(len(stations)))
+
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    entries = []
+    for idx, station_data in enumerate(stations):
+        latitude = station_data.get("Latitude")
+        longitude = station_data.get("Longitude")
+        safe_radius_km = station_data.get("SafeRadius", 12.0)
+        if not all(isinstance(val, (int, float)) for val in [latitude, longitude, safe_radius_km]):
+            continue
+        reach_km = interaction_radius_km / 2 if interaction_radius_km is not None else float(safe_radius_km)
+        # A single pseudo-frequency: clusters are geographic, whatever frequency ends up used
+        entries.append((idx, 1, float(latitude), float(longitude), reach_km))
+
+    entries_by_idx = {e[0]: e for e in entries}
+    candidate_pairs = nearby_pairs_by_frequency(entries)
+    if candidate_pairs:
+        pair_distances = calculate_distances(
+            [entries_by_idx[i][2] for i, _ in candidate_pairs], [entries_by_idx[i][3] for i, _ in candidate_pairs],
+            [entries_by_idx[j][2] for _, j in candidate_pairs], [entries_by_idx[j][3] for _, j in candidate_pairs]
+        )
+        for (i, j), distance in zip(candidate_pairs, pair_distances.tolist()):
+            if distance < entries_by_idx[i][4] + entries_by_idx[j][4]:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parent[max(root_i, root_j)] = min(root_i, root_j) # Lowest index stays the root
+
+    components = {}
+    for idx in range(len(stations)):
+        components.setdefault(find(idx), []).append(idx)
+    return list(components.values())
+
+def allocate_slots_clustered(
+    stations: list[dict],
+    approved_snapshot: ApprovedSnapshot,
+    max_slots: int = 44,
+    max_frequencies: int = 7,
+    interaction_radius_km: Optional[float] = None,
+    parallel: bool = True
+) -> list[dict]:
+    """
+    Allocation mode for large, spread-out batches. Stations are partitioned into
+    geographic clusters (partition_planning_clusters) and each cluster is allocated with
+    its own frequency slot maps on the shared allocation_process_pool, so far-apart
+    clusters may reuse the same slots. Results come back in input order whatever order
+    the workers finish in. Small batches, single-CPU hosts and parallel=False run in-process.
+    """
+    components = partition_planning_clusters(stations, interaction_radius_km)
+    print(f"DEBUG: Clustered allocation: {len(stations)} stations in {len(components)} independent clusters.")
+    cluster_inputs = [[stations[idx] for idx in component] for component in components]
+
+    cluster_results = None
+    if (parallel and len(components) > 1 and len(stations) >= CLUSTER_PARALLEL_MIN_STATIONS
+            and ALLOCATION_POOL_MAX_WORKERS > 1):
+        executor = allocation_process_pool()
+        try:
+            cluster_results = list(executor.map(
+                allocate_slots_with_snapshot,
+                cluster_inputs,
+                repeat(approved_snapshot),
+                repeat(max_slots),
+                repeat(max_frequencies)
+            ))
+        except BrokenProcessPool as e:
+            print(f"WARNING processing.py: Allocation worker pool broke ({e}); allocating the clusters in-process.")
+            _discard_allocation_pool(executor)
+    if cluster_results is None:
+        cluster_results = [
+            allocate_slots_with_snapshot(cluster, approved_snapshot, max_slots, max_frequencies)
+            for cluster in cluster_inputs
+        ]
+
+    # The engine returns exactly one row per input station, in order
+    allocations_output: list[dict] = [None] * len(stations)
+    for component, results in zip(components, cluster_results):
+        for idx, result in zip(component, results):
+            allocations_output[idx] = result
     return allocations_output
 
-def generate_excel(alloc_results):
-    print("DEBUG processing.py: \n Generating Excel file with new styling logic...")
+# --- Layout shared by the Excel renderers (apply_color_scheme / apply_color_scheme_xlsxwriter) ---
+# Background colour of each frequency (stationary slots and the frequency row)
+FREQUENCY_COLORS = {
+    1: "F0F005", 2: "8FCA1D", 3: "F39D1B", 4: "3197EA",
+    5: "90918F", 6: "F53B3D", 7: "CC6CE7"
+}
+# Column A labels of the header rows 7-16, top to bottom
+MATRIX_HEADER_LABELS = [
+    "Stationary Kavach ID",
+    "Station Name",
+    "Station code",
+    "Stationary Unit Tower Latitude",
+    "Stationary Unit Tower Longitude",
+    "Optimum no. of Simultaneous Exclusive Static Profile Transfer",
+    "Proposed Frequency Pair",
+    "Number of Stationary Kavach Tx slots",
+    "Stationary Kavach (TCAS) Tx Window Commence - End",
+    "Peak nos. of Onboard Kavach Units in Stn Unit Jurisdiction"
+]
+LEGEND_HEADERS = ["Legend: Onboard Tx Slot Priorities", "Example"]
+LEGEND_DATA = [
+    ["Priority 1 Green", "007220", "P2, P4, P6"],
+    ["Priority 2 Blue Bold", "0000FF", "P8, P10, P12"],
+    ["Priority 3 Red", "E4080A", "P9, P11, P13"],
+    ["Prority 4 Black Bold", "000000", "P20, P22, P24"],
+    ["Priority 5 Black Underlined Bold", "000000", "P26, P28, P30"],
+    ["Priority 6 White Bold", "FFFFFF", "P27, P29, P31"]
+]
+
+def matrix_titles(now: datetime) -> list[str]:
+    """The four title lines (rows 2-5) of the allocation matrix sheet."""
+    return [
+        "Kavach (TCAS) : Application-cum-Approval: mComm Frequency Channels & Timeslots",
+        "Stationary Kavach Unit-wise Frequency Channels - Timeslot Details",
+        f"Application Number: Kavach/mComm/Appl/NCR-to-CoE/003/{now.hour:02d}",
+        f"Station - Station (Excl): When in Category-C (Radio Packet Structure as well as Tag Data Foramt as per V4.0 with SRS 4.0d3 Annex-C Amdt-7 wef {now.strftime('%d-%m-%Y')})"
+    ]
 
+# --- Slot categories: one small int per (station, slot), parsed once per station ---
+SLOT_NAMES = [f"P{i}" for i in range(2, 46)] # Matrix rows P2..P45
+SLOT_CATEGORY_FREE = 0
+SLOT_CATEGORY_ONBOARD_MASK = 0b0111 # Onboard priority 1-6 (P1..P6), 0 = no onboard slot
+SLOT_CATEGORY_STATIONARY = 0b1000   # Flag: slot is one of the station's stationary slots
+ONBOARD_CATEGORY_COLUMNS = [f"Onboard Slots P{n} Allocated" for n in range(1, 7)]
+_SLOT_ROW_OF = {slot_name: row for row, slot_name in enumerate(SLOT_NAMES)}
+
+def parse_slot_list(value) -> list[int]:
+    """Row indices (P2 -> 0) of the slots in an allocation string like "P2, P5, P7"; anything else is ignored."""
+    indices = []
+    for token in str(value).split(','):
+        slot_row = _SLOT_ROW_OF.get(token.strip())
+        if slot_row is not None:
+            indices.append(slot_row)
+    return indices
+
+def build_slot_category_matrix(station_records: list[dict]) -> np.ndarray:
+    """
+    (stations x slots) uint8 matrix of slot categories, built from each station's
+    allocation strings once. The low bits hold the onboard priority (1-6; when a slot is
+    listed under several priorities the first one wins), SLOT_CATEGORY_STATIONARY marks
+    the station's stationary slots.
+    """
+    categories = np.zeros((len(station_records), len(SLOT_NAMES)), dtype=np.uint8)
+    for station_idx, station in enumerate(station_records):
+        station_row = categories[station_idx]
+        for priority, column in enumerate(ONBOARD_CATEGORY_COLUMNS, start=1):
+            for slot_row in parse_slot_list(station.get(column, "")):
+                if not station_row[slot_row] & SLOT_CATEGORY_ONBOARD_MASK:
+                    station_row[slot_row] |= priority
+        for slot_row in parse_slot_list(station.get("Stationary Kavach Slots Allocated", "")):
+            station_row[slot_row] |= SLOT_CATEGORY_STATIONARY
+    return categories
+
+def frequency_fill_color(frequency_val) -> Optional[str]:
+    """Hex fill colour for a station's frequency, or None when it has no valid frequency."""
+    if pd.notna(frequency_val) and frequency_val != "N/A":
+        try:
+            return FREQUENCY_COLORS.get(int(frequency_val), "FFFFFF")
+        except ValueError:
+            pass
+    return None
+
+# --- Raw allocation exports (no workbook styling) ---
+# format name -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "parquet": ("application/vnd.apache.parquet", "parquet")
+}
+
+def parquet_available() -> bool:
+    """Parquet export needs pyarrow, which is optional."""
     try:
-        df = pd.DataFrame(alloc_results)
-        expected_cols = [
-            "Station", "Static", "Frequency",
-            "Stationary Kavach Slots Requested", "Stationary Kavach Slots Allocated", "Num Stationary Allocated",
-            "Onboard Kavach Slots Requested", "Onboard Kavach Slots Allocated", "Num Onboard Allocated",
-            "Onboard Slots P1 Allocated", "Onboard Slots P2 Allocated", "Onboard Slots P3 Allocated", "Onboard Slots P4 Allocated", 
-            "Onboard Slots P5 Allocated", "Onboard Slots P6 Allocated",
-            "Debug_IsIdeal", "Debug_Congested", "Debug_ExcessiveP3", "Error"
-        ]
-        for col in expected_cols:
-            if col not in df.columns:
-                df[col] = ""
-        
-        apply_color_scheme(df) # Pass the full DataFrame
+        import pyarrow # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _export_columns(alloc_results) -> list[str]:
+    """Union of the result keys in first-seen order (error rows carry fewer keys)."""
+    columns = {}
+    for result in alloc_results:
+        for key in result:
+            columns.setdefault(key, None)
+    return list(columns)
+
+def export_allocations(alloc_results, export_format: str) -> BytesIO:
+    """
+    Writes the allocate_slots rows, one record per station, as CSV, JSON Lines or
+    Parquet into a BytesIO (positioned at the start). Raises ValueError for an unknown
+    format and RuntimeError when Parquet is asked for without pyarrow installed.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{export_format}'. Expected one of: {', '.join(EXPORT_FORMATS)}")
+    columns = _export_columns(alloc_results)
+    buffer = BytesIO()
+
+    if export_format == "csv":
+        text_buffer = TextIOWrapper(buffer, encoding="utf-8", newline="")
+        writer = csv.DictWriter(text_buffer, fieldnames=columns, restval="")
+        writer.writeheader()
+        writer.writerows(alloc_results)
+        text_buffer.detach() # Keep `buffer` open
+    elif export_format == "jsonl":
+        for result in alloc_results:
+            buffer.write(json.dumps(result, default=str).encode("utf-8"))
+            buffer.write(b"\n")
+    else:
+        if not parquet_available():
+            raise RuntimeError("Parquet export needs the optional 'pyarrow' package (pip install pyarrow).")
+        df = pd.DataFrame(alloc_results, columns=columns)
+        for column in df.columns:
+            # Columns like Frequency mix ints and "N/A"; Parquet needs one type per column
+            if df[column].dtype == object and df[column].dropna().map(type).nunique() > 1:
+                df[column] = df[column].map(lambda value: None if value is None or value != value else str(value))
+        df.to_parquet(buffer, index=False)
+
+    buffer.seek(0)
+    return buffer
+
+# Renderers for the allocation workbook. xlsxwriter (constant memory) is the default on
+# purpose: tests/test_parity.py checks that both render the same cells, styles and merges
+# as the original openpyxl workbook. openpyxl stays available as the fallback.
+EXCEL_BACKENDS = ("xlsxwriter", "openpyxl")
+DEFAULT_EXCEL_BACKEND = "xlsxwriter"
+
+# Matrix sheet layouts: one sheet with every station, or paginated across sheets
+# by frequency / by a fixed column budget (xlsxwriter backend only).
+MATRIX_LAYOUTS = ("single", "by_frequency", "by_columns")
+MATRIX_SHEET_NAME = "Slot Allocation Matrix"
+PAGINATED_SHEET_MAX_COLUMNS = 100 # Stations per paginated sheet
+
+# Generated workbooks are named by content, kavach_slots_<hash>.xlsx, and kept in
+# UPLOAD_FOLDER as a cache: the newest EXCEL_CACHE_MAX_FILES are kept, none older than the TTL.
+GENERATED_EXCEL_PREFIX = "kavach_slots_"
+EXCEL_CACHE_MAX_FILES = 64
+EXCEL_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+def excel_output_path(alloc_results, backend: str, generated_at: datetime, layout: str = "single", max_columns: int = PAGINATED_SHEET_MAX_COLUMNS) -> str:
+    """
+    Unique output path for a workbook. The name hashes the allocation results, the
+    rendering options and the date/hour shown in the titles, so identical requests map
+    to the same file and different ones never overwrite each other.
+    """
+    digest = content_hash({
+        'results': alloc_results,
+        'backend': backend,
+        'layout': layout,
+        'max_columns': max_columns if layout != "single" else None,
+        'title_hour': generated_at.strftime('%Y-%m-%d %H')
+    })
+    return os.path.join(UPLOAD_FOLDER, f"{GENERATED_EXCEL_PREFIX}{digest[:32]}.xlsx")
+
+def prune_generated_excel_files(keep_path: Optional[str] = None):
+    """
+    Evicts generated workbooks from UPLOAD_FOLDER: files past the TTL first, then the
+    least recently used (by mtime, which reuse refreshes) beyond EXCEL_CACHE_MAX_FILES.
+    Only files with GENERATED_EXCEL_PREFIX are touched; `keep_path` is never removed.
+    """
+    now_ts = datetime.now().timestamp()
+    generated_files = []
+    for entry in os.scandir(UPLOAD_FOLDER):
+        if entry.is_file() and entry.name.startswith(GENERATED_EXCEL_PREFIX) and entry.name.endswith(".xlsx"):
+            try:
+                generated_files.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue # Removed by a concurrent prune
+    generated_files.sort(reverse=True) # Most recently used first
+
+    for rank, (mtime, path) in enumerate(generated_files):
+        if path == keep_path:
+            continue
+        if rank >= EXCEL_CACHE_MAX_FILES or now_ts - mtime > EXCEL_CACHE_TTL_SECONDS:
+            try:
+                os.remove(path)
+                print(f"DEBUG processing.py: Evicted cached Excel file {os.path.basename(path)}")
+            except FileNotFoundError:
+                pass
+
+def write_generated_excel(output_path: str, write) -> bool:
+    """
+    Puts a generated file at its content-addressed `output_path`: `write(temp_path)` renders
+    it under a private temp name, which is renamed into place only if `write` returned True,
+    so a concurrent request for the same results never sees a half-written file and a failed
+    render never enters the cache (the temp file is removed, also when `write` raises).
+    Prunes the cache after a successful write. Returns whether the file was written.
+    """
+    temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    written = False
+    try:
+        written = bool(write(temp_path))
+        if written:
+            os.replace(temp_path, output_path)
+    finally:
+        if not written and os.path.exists(temp_path):
+            os.remove(temp_path)
+    if written:
+        prune_generated_excel_files(keep_path=output_path)
+    return written
+
+def allocation_results_frame(alloc_results) -> pd.DataFrame:
+    """Allocation results as the DataFrame the renderers expect, with every expected column present."""
+    df = pd.DataFrame(alloc_results)
+    expected_cols = [
+        "Station", "Static", "Frequency",
+        "Stationary Kavach Slots Requested", "Stationary Kavach Slots Allocated", "Num Stationary Allocated",
+        "Onboard Kavach Slots Requested", "Onboard Kavach Slots Allocated", "Num Onboard Allocated",
+        "Onboard Slots P1 Allocated", "Onboard Slots P2 Allocated", "Onboard Slots P3 Allocated", "Onboard Slots P4 Allocated", 
+        "Onboard Slots P5 Allocated", "Onboard Slots P6 Allocated",
+        "Debug_IsIdeal", "Debug_Congested", "Debug_ExcessiveP3", "Error"
+    ]
+    for col in expected_cols:
+        if col not in df.columns:
+            df[col] = ""
+    return df
+
+def render_workbook(df: pd.DataFrame, backend: str, output, layout: str = "single", max_columns: int = PAGINATED_SHEET_MAX_COLUMNS):
+    """
+    Renders the allocation workbook with `backend` to `output`, a file path or a binary
+    file object. Returns True only if the renderer reported the workbook as saved.
+    """
+    if backend == "openpyxl":
+        return apply_color_scheme(df, output) # Pass the full DataFrame
+    return apply_color_scheme_xlsxwriter(df, output, layout=layout, max_columns=max_columns)
+
+def generate_excel(
+    alloc_results,
+    backend: str = DEFAULT_EXCEL_BACKEND,
+    in_memory: bool = False,
+    layout: str = "single",
+    max_columns: int = PAGINATED_SHEET_MAX_COLUMNS
+):
+    """
+    Renders the allocation workbook. By default it is written to a content-addressed
+    file in UPLOAD_FOLDER and the path is returned; with `in_memory=True` it is rendered
+    into a BytesIO (positioned at the start) that is returned instead, nothing touches
+    the disk. `layout`/`max_columns` paginate the matrix over several sheets
+    (see paginate_matrix_stations). Returns None if generation failed.
+    """
+    print("DEBUG processing.py: \n Generating Excel file with new styling logic...")
 
-        if os.path.exists(OUTPUT_FILE):
-            print(f"Excel file saved successfully: {OUTPUT_FILE}")
-            return OUTPUT_FILE
+    try:
+        if backend not in EXCEL_BACKENDS:
+            raise ValueError(f"Unknown Excel backend '{backend}'. Expected one of: {', '.join(EXCEL_BACKENDS)}")
+        if layout not in MATRIX_LAYOUTS:
+            raise ValueError(f"Unknown matrix layout '{layout}'. Expected one of: {', '.join(MATRIX_LAYOUTS)}")
+        if layout != "single" and backend != "xlsxwriter":
+            raise ValueError("Paginated matrix layouts are only supported by the xlsxwriter backend.")
+
+        if in_memory:
+            workbook_buffer = BytesIO()
+            rendered = render_workbook(allocation_results_frame(alloc_results), backend, workbook_buffer, layout, max_columns)
+            if not rendered or not workbook_buffer.getbuffer().nbytes:
+                print("Warning: In-memory Excel workbook was not rendered.")
+                return None
+            workbook_buffer.seek(0)
+            print(f"Excel workbook rendered in memory ({workbook_buffer.getbuffer().nbytes} bytes).")
+            return workbook_buffer
+
+        generated_at = datetime.now()
+        output_path = excel_output_path(alloc_results, backend, generated_at, layout, max_columns)
+        if os.path.exists(output_path):
+            os.utime(output_path) # Mark as recently used for pruning
+            print(f"Reusing existing Excel file for identical results: {output_path}")
+            return output_path
+
+        df = allocation_results_frame(alloc_results)
+
+        # Only a workbook the renderer reports as saved may enter the content-addressed cache
+        if write_generated_excel(output_path, lambda path: render_workbook(df, backend, path, layout, max_columns)):
+            print(f"Excel file saved successfully: {output_path}")
+            return output_path
         else:
-            print(f"Warning: {OUTPUT_FILE} was not created.")
-            # Fallback to save uncolored if coloring somehow fails to save
-            df.to_excel(os.path.join(UPLOAD_FOLDER,"fallback_uncolored_results.xlsx"), index=False)
+            print(f"Warning: {output_path} was not created.")
+            # Fallback to save uncolored if coloring somehow fails to save. It is named by content
+            # like the styled workbooks, so concurrent jobs don't overwrite it and pruning evicts it.
+            def write_uncolored(path):
+                with open(path, "wb") as f: # A file object, as pandas rejects the temp name's extension
+                    df.to_excel(f, index=False, engine="openpyxl")
+                return True
+            fallback_path = excel_output_path(alloc_results, "uncolored", generated_at)
+            if write_generated_excel(fallback_path, write_uncolored):
+                print(f"Uncolored results saved to: {fallback_path}")
             return None
 
     except Exception as e:
@@ -497,17 +1109,33 @@ def generate_excel(alloc_results):
         traceback.print_exc()
         return None
 
-def  apply_color_scheme(results_df: pd.DataFrame): # Using user's function name
+def details_sheet_data(results_df: pd.DataFrame):
+    """
+    Contents of the "Allocation Details" sheet: (headers, rows, column widths). Every
+    value is written as text, missing ones as empty strings. Widths (longest text + 2)
+    come from vectorised string lengths on the DataFrame, so the written sheet never
+    has to be scanned again.
+    """
+    detail_headers = [str(column) for column in results_df.columns]
+    # astype(str) alone keeps NaN as NaN on pandas 3, so blank out missing values first
+    text_df = results_df.astype(object).where(results_df.notna(), "").astype(str)
+    text_columns = [text_df.iloc[:, col_idx] for col_idx in range(text_df.shape[1])]
+    detail_widths = [
+        max(len(header), int(column.str.len().max()) if len(column) else 0) + 2
+        for header, column in zip(detail_headers, text_columns)
+    ]
+    detail_rows = zip(*(column.tolist() for column in text_columns))
+    return detail_headers, detail_rows, detail_widths
+
+def  apply_color_scheme(results_df: pd.DataFrame, output_path=OUTPUT_FILE): # Using user's function name; output_path may be a file object
+    """Renders the styled allocation workbook with openpyxl. Returns True only if it was saved."""
     if results_df.empty:
         print("Error: Input DataFrame for coloring is empty.")
-        return
+        return False
 
     now = datetime.now() # For use in titles
 
-    color_map = {
-        1: "F0F005", 2: "8FCA1D", 3: "F39D1B", 4: "3197EA",
-        5: "90918F", 6: "F53B3D", 7: "CC6CE7"
-    }
+    color_map = FREQUENCY_COLORS
     # Corrected font colors to ARGB format
     FONT_P1_STYLE = Font(color="FF007220")  # Green
     FONT_P2_STYLE = Font(bold=True, color="FF0000FF")  # Blue Bold
@@ -547,18 +1175,13 @@ def  apply_color_scheme(results_df: pd.DataFrame): # Using user's function name
     onboard_count_row = 16    
     data_start_row = 17       # Px data (P2, P3...) starts in Col A
 
-    all_slots = [f"P{i}" for i in range(2, 46)] 
-    all_stations = results_df["Station"].unique()
-    max_excel_col = len(all_stations) + 1 
+    all_slots = SLOT_NAMES
+    station_records = results_df.drop_duplicates(subset="Station", keep="first").to_dict("records")
+    max_excel_col = len(station_records) + 1 
     max_slot_idx_for_adj_check = len(all_slots) - 1 # Renamed from max_slot_index for clarity
 
     # --- Write Titles (Rows 2-5) ---
-    titles_config = [
-        (title_row1, "Kavach (TCAS) : Application-cum-Approval: mComm Frequency Channels & Timeslots"),
-        (title_row2, "Stationary Kavach Unit-wise Frequency Channels - Timeslot Details"),
-        (title_row3, f"Application Number: Kavach/mComm/Appl/NCR-to-CoE/003/{now.hour:02d}"),
-        (title_row4, f"Station - Station (Excl): When in Category-C (Radio Packet Structure as well as Tag Data Foramt as per V4.0 with SRS 4.0d3 Annex-C Amdt-7 wef {now.strftime('%d-%m-%Y')})")
-    ]
+    titles_config = list(zip([title_row1, title_row2, title_row3, title_row4], matrix_titles(now)))
     for r_num, text in titles_config:
         cell = ws.cell(row=r_num, column=1)
         cell.value = text
@@ -569,15 +1192,8 @@ def  apply_color_scheme(results_df: pd.DataFrame): # Using user's function name
     legend_col = 1
     legend_start_row = 61
 
-    headers = ["Legend: Onboard Tx Slot Priorities", "Example"]
-    legend_data = [
-        ["Priority 1 Green", "007220", "P2, P4, P6"],
-        ["Priority 2 Blue Bold", "0000FF", "P8, P10, P12"],
-        ["Priority 3 Red", "E4080A", "P9, P11, P13"],
-        ["Prority 4 Black Bold", "000000", "P20, P22, P24"],
-        ["Priority 5 Black Underlined Bold", "000000", "P26, P28, P30"],
-        ["Priority 6 White Bold", "FFFFFF", "P27, P29, P31"]
-    ]
+    headers = LEGEND_HEADERS
+    legend_data = LEGEND_DATA
     # Define border style
     border_style = Border(left=Side(style="thin"), right=Side(style="thin"), top=Side(style="thin"), bottom=Side(style="thin"))
     # Apply headers with border
@@ -608,18 +1224,7 @@ def  apply_color_scheme(results_df: pd.DataFrame): # Using user's function name
     ws.column_dimensions[ws.cell(row=legend_start_row, column=legend_col + 1).column_letter].width = 10
 
     # --- Write Static Labels in Column A ---
-    static_labels_col1 = {
-        label_stationary_kavach_id_row: "Stationary Kavach ID",
-        header_excel_row: "Station Name", 
-        label_station_code_row: "Station code",
-        label_lat_row: "Stationary Unit Tower Latitude",
-        label_long_row: "Stationary Unit Tower Longitude",
-        data_optimum_static_row: "Optimum no. of Simultaneous Exclusive Static Profile Transfer",
-        label_freq_pair_row: "Proposed Frequency Pair",
-        stationary_count_row: "Number of Stationary Kavach Tx slots",
-        label_tx_window_row: "Stationary Kavach (TCAS) Tx Window Commence - End",
-        onboard_count_row: "Peak nos. of Onboard Kavach Units in Stn Unit Jurisdiction"
-    }
+    static_labels_col1 = dict(zip(range(label_stationary_kavach_id_row, onboard_count_row + 1), MATRIX_HEADER_LABELS))
     for r_num, text in static_labels_col1.items():
         cell = ws.cell(row=r_num, column=1)
         cell.value = text
@@ -630,11 +1235,9 @@ def  apply_color_scheme(results_df: pd.DataFrame): # Using user's function name
             cell.alignment = center_align_v_center
 
     # --- Populate Data for Specific Rows (Columns B onwards) ---
-    for c_idx_df, station_name in enumerate(all_stations):
+    for c_idx_df, station_data_row in enumerate(station_records):
         excel_data_col = c_idx_df + 2 
-        station_specific_data_rows = results_df[results_df["Station"] == station_name]
-        if station_specific_data_rows.empty: continue
-        station_data_row = station_specific_data_rows.iloc[0]
+        station_name = station_data_row["Station"]
 
         # Row 7: Stationary Kavach ID
         cell_id_r7 = ws.cell(row=label_stationary_kavach_id_row, column=excel_data_col)
@@ -730,86 +1333,28 @@ def  apply_color_scheme(results_df: pd.DataFrame): # Using user's function name
 
 
     # --- Apply Styles, Colors, and Text to Matrix Data Cells (P-slot area) ---
+    slot_categories = build_slot_category_matrix(station_records)
+    stationary_fills = [frequency_fill_color(station.get("Frequency")) for station in station_records]
+    onboard_fonts = [None, FONT_P1_STYLE, FONT_P2_STYLE, FONT_P3_STYLE, FONT_P4_STYLE, FONT_P5_STYLE, FONT_P6_STYLE]
+
     for r_idx_data_matrix, slot_in_current_row in enumerate(all_slots):
         current_excel_data_row = data_start_row + r_idx_data_matrix
-        current_slot_0index = int(slot_in_current_row[1:]) - 2 # User's variable name
 
-        for c_idx_df, station_name_for_coloring in enumerate(all_stations):
+        for c_idx_df, slot_category in enumerate(slot_categories[:, r_idx_data_matrix].tolist()):
             excel_col_for_station = c_idx_df + 2
             cell_to_format = ws.cell(row=current_excel_data_row, column=excel_col_for_station)
             cell_to_format.value = "" 
             cell_to_format.font = Font() 
             cell_to_format.alignment = center_align_v_center
 
-            station_data_rows_matrix = results_df[results_df["Station"] == station_name_for_coloring]
-            if station_data_rows_matrix.empty: continue
-            station_data_matrix_row = station_data_rows_matrix.iloc[0]
-
-            s_slots_str_m = str(station_data_matrix_row.get("Stationary Kavach Slots Allocated", ""))
-            o_p1_slots_str_m = str(station_data_matrix_row.get("Onboard Slots P1 Allocated", ""))
-            o_p2_slots_str_m = str(station_data_matrix_row.get("Onboard Slots P2 Allocated", ""))
-            o_p3_slots_str_m = str(station_data_matrix_row.get("Onboard Slots P3 Allocated", ""))
-            o_p4_slots_str_m = str(station_data_matrix_row.get("Onboard Slots P4 Allocated", ""))
-            o_p5_slots_str_m = str(station_data_matrix_row.get("Onboard Slots P5 Allocated", ""))
-            o_p6_slots_str_m = str(station_data_matrix_row.get("Onboard Slots P6 Allocated", ""))
-
-
-            set_stationary = {s.strip() for s in s_slots_str_m.split(',') if s.strip() and s.strip().lower() != 'nan'}
-            set_onboard_p1 = {s.strip() for s in o_p1_slots_str_m.split(',') if s.strip() and s.strip().lower() != 'nan'}
-            set_onboard_p2 = {s.strip() for s in o_p2_slots_str_m.split(',') if s.strip() and s.strip().lower() != 'nan'}
-            set_onboard_p3 = {s.strip() for s in o_p3_slots_str_m.split(',') if s.strip() and s.strip().lower() != 'nan'}
-            set_onboard_p4 = {s.strip() for s in o_p4_slots_str_m.split(',') if s.strip() and s.strip().lower() != 'nan'}
-            set_onboard_p5 = {s.strip() for s in o_p5_slots_str_m.split(',') if s.strip() and s.strip().lower() != 'nan'}
-            set_onboard_p6 = {s.strip() for s in o_p6_slots_str_m.split(',') if s.strip() and s.strip().lower() != 'nan'}
-
+            if slot_category & SLOT_CATEGORY_STATIONARY and stationary_fills[c_idx_df]:
+                bg_color_code_m = stationary_fills[c_idx_df]
+                cell_to_format.fill = PatternFill(start_color=bg_color_code_m, end_color=bg_color_code_m, fill_type="solid")
 
-
-            is_stationary = slot_in_current_row in set_stationary
-            is_onboard_p1 = slot_in_current_row in set_onboard_p1
-            is_onboard_p2 = slot_in_current_row in set_onboard_p2
-            is_onboard_p3 = slot_in_current_row in set_onboard_p3
-            is_onboard_p4 = slot_in_current_row in set_onboard_p4
-            is_onboard_p5 = slot_in_current_row in set_onboard_p5
-            is_onboard_p6 = slot_in_current_row in set_onboard_p6
-
-            
-            if is_stationary:
-                frequency_val_m = station_data_matrix_row.get("Frequency")
-                if pd.notna(frequency_val_m) and frequency_val_m != "N/A":
-                    try:
-                        frequency_m = int(frequency_val_m)
-                        bg_color_code_m = color_map.get(frequency_m, "FFFFFF")
-                        cell_to_format.fill = PatternFill(start_color=bg_color_code_m, end_color=bg_color_code_m, fill_type="solid")
-                    except ValueError: pass 
-            
-            if is_onboard_p1:
-                cell_to_format.font = FONT_P1_STYLE
-                cell_to_format.value = slot_in_current_row
-
-            elif is_onboard_p2:
-                cell_to_format.font = FONT_P2_STYLE
-                cell_to_format.value = slot_in_current_row
-
-            elif is_onboard_p3:
-                cell_to_format.font = FONT_P3_STYLE
-                cell_to_format.value = slot_in_current_row
-   
-            elif is_onboard_p4:
-                cell_to_format.font = FONT_P4_STYLE
-                cell_to_format.value = slot_in_current_row
-  
-            elif is_onboard_p5:
-                cell_to_format.font = FONT_P5_STYLE
-                cell_to_format.value = slot_in_current_row
-  
-            elif is_onboard_p6:
-                cell_to_format.font = FONT_P6_STYLE
+            onboard_priority = slot_category & SLOT_CATEGORY_ONBOARD_MASK
+            if onboard_priority:
+                cell_to_format.font = onboard_fonts[onboard_priority]
                 cell_to_format.value = slot_in_current_row
-   
-
-            elif is_stationary: 
-                cell_to_format.value = ""
-            
 
     # --- Apply Borders to the Main Content Block ---
     # User's code: for r in range(7, max_excel_row):
@@ -826,31 +1371,288 @@ def  apply_color_scheme(results_df: pd.DataFrame): # Using user's function name
     # --- Add Allocation Details Sheet ---
     ws_details = wb.create_sheet(title="Allocation Details")
     if not results_df.empty:
-        detail_headers = list(results_df.columns)
+        detail_headers, detail_rows, detail_widths = details_sheet_data(results_df)
         ws_details.append(detail_headers)
-        for _, row_data_obj_detail in results_df.iterrows():
-            try:
-                ws_details.append(list(row_data_obj_detail.astype(str))) 
-            except Exception as e_row_detail:
-                print(f"Warning: Could not append row to details sheet: {row_data_obj_detail.get('Station', 'Unknown_Station')}, Error: {e_row_detail}")
-        
-        for column_cells_detail in ws_details.columns:
-            try:
-                length = max(len(str(cell.value) if cell.value is not None else "") for cell in column_cells_detail)
-                ws_details.column_dimensions[get_column_letter(column_cells_detail[0].column)].width = length + 2
-            except Exception as e_col_size_detail:
-                print(f"Warning: Could not resize column {get_column_letter(column_cells_detail[0].column)}, Error: {e_col_size_detail}")
+        for row_values in detail_rows:
+            ws_details.append(row_values)
+        for col, width in enumerate(detail_widths, start=1):
+            ws_details.column_dimensions[get_column_letter(col)].width = width
     else:
         ws_details.append(["No allocation details to display."])
 
+    output_name = output_path if isinstance(output_path, str) else "in-memory buffer"
+    try:
+        wb.save(output_path)
+        print(f"Formatted and styled Excel file saved to: {output_name}")
+        return True
+    except PermissionError:
+        print(f"Critical Error: Permission denied. Failed to save Excel to {output_name}.")
+        print("Ensure the file is not open and you have write permissions.")
+    except Exception as e_save:
+        print(f"Critical Error: Failed to save Excel to {output_name}. Error: {e_save}")
+    return False
+
+class XlsxFormatRegistry:
+    """
+    Hands out one xlsxwriter Format per distinct set of properties, so a matrix of
+    thousands of cells shares a handful of formats instead of creating one per cell.
+    """
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._formats = {}
+
+    def get(self, **properties):
+        return self.get_by_key(format_key(properties))
+
+    def get_by_key(self, key: tuple):
+        """Format for a format_key() tuple; plans carry these so writing needs no dict work per cell."""
+        cell_format = self._formats.get(key)
+        if cell_format is None:
+            cell_format = self._formats[key] = self.workbook.add_format(dict(key))
+        return cell_format
+
+def format_key(properties: dict) -> tuple:
+    """Hashable, order-independent key for a set of xlsxwriter format properties."""
+    return tuple(sorted(properties.items()))
+
+def _xlsx_cell_value(value):
+    """Cell value as xlsxwriter can write it: missing/NaN becomes an empty cell, numpy scalars plain Python."""
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+_XLSX_CENTERED = {'align': 'center', 'valign': 'vcenter'}
+_XLSX_ROTATED = {'rotation': 90, 'align': 'center', 'valign': 'vcenter'}
+_XLSX_BORDERED = {'border': 1}
+_XLSX_ONBOARD_FONTS = [
+    {},                                                       # No onboard slot
+    {'font_color': '#007220'},                                # P1 Green
+    {'bold': True, 'font_color': '#0000FF'},                  # P2 Blue Bold
+    {'font_color': '#E4080A'},                                # P3 Red
+    {'bold': True, 'font_color': '#000000'},                  # P4 Black Bold
+    {'bold': True, 'font_color': '#000000', 'underline': 1},  # P5 Black Bold Underlined
+    {'font_color': '#FFFFFF', 'bold': True}                   # P6 White Bold
+]
+
+def _xlsx_frequency_fill(frequency_val) -> dict:
+    """Fill properties for a frequency cell/slot, or {} when there is no valid frequency."""
+    fill_color = frequency_fill_color(frequency_val)
+    return {'bg_color': f"#{fill_color}", 'pattern': 1} if fill_color else {}
+
+def plan_matrix_sheet(station_records: list[dict], now: datetime) -> Iterator[tuple[int, list[tuple]]]:
+    """
+    Lays out one allocation matrix sheet (titles, header rows, slot matrix, legend) for
+    `station_records`, one column each, as plain data: yields (row, ops) in row order
+    with 0-based rows, where an op is ('write', col, value, format key) or
+    ('merge', first_col, last_col, value, format key), format keys from format_key().
+    Rows are produced as write_sheet_plan consumes them, so only one row's ops exist at a time.
+    """
+    # Same 1-based row layout as apply_color_scheme; plan rows/cols are 0-based
+    title_start_row = 2
+    header_start_row = 7      # Rows 7-16: MATRIX_HEADER_LABELS
+    data_start_row = 17       # Px data (P2, P3...) starts in Col A
+    legend_start_row = 61
+
+    max_excel_col = len(station_records) + 1
+    centered_bordered = format_key(dict(_XLSX_CENTERED, **_XLSX_BORDERED))
+    rotated_bordered = format_key(dict(_XLSX_ROTATED, **_XLSX_BORDERED))
+
+    # --- Titles (Rows 2-5), merged across the matrix width ---
+    title_properties = format_key(dict(_XLSX_CENTERED, text_wrap=True))
+    for offset, text in enumerate(matrix_titles(now)):
+        if max_excel_col > 1:
+            yield (title_start_row + offset - 1, [('merge', 0, max_excel_col - 1, text, title_properties)])
+        else:
+            yield (title_start_row + offset - 1, [('write', 0, text, title_properties)])
+
+    # --- Header rows 7-16: column A label, then one column per station ---
+    for offset, label in enumerate(MATRIX_HEADER_LABELS):
+        ops = [('write', 0, label, centered_bordered)]
+        for col, station in enumerate(station_records, start=1):
+            properties = centered_bordered
+            if offset == 0:   # Stationary Kavach ID
+                value = station.get("Stationary Kavach ID", "")
+                properties = rotated_bordered
+            elif offset == 1: # Rotated station names
+                value = station["Station"]
+                properties = rotated_bordered
+            elif offset == 2: # Station code
+                value = station.get("Station Code", "")
+                properties = rotated_bordered
+            elif offset == 3: # Latitude
+                value = station.get("Latitude", "")
+                properties = rotated_bordered
+            elif offset == 4: # Longitude
+                value = station.get("Longitude", "")
+                properties = rotated_bordered
+            elif offset == 5: # Optimum static
+                value = station.get("Static")
+                if value is None:
+                    value = station.get("Optimum Static Param", "")
+            elif offset == 6: # Proposed frequency pair, number and colour
+                frequency_val = station.get("Frequency")
+                value = "N/A"
+                if pd.notna(frequency_val) and frequency_val != "N/A":
+                    try:
+                        value = int(frequency_val)
+                    except ValueError:
+                        value = str(frequency_val)
+                properties = format_key(dict(_XLSX_CENTERED, **_XLSX_BORDERED, **_xlsx_frequency_fill(frequency_val)))
+            elif offset == 7: # Number of stationary slots
+                value = station.get("Num Stationary Allocated", 0)
+            elif offset == 8: # Tx window, computed exactly as apply_color_scheme does
+                s_slots_str = str(station.get("Stationary Kavach Slots Allocated", ""))
+                slot_numbers = sorted(int(p.strip()[1:]) for p in s_slots_str.split(',') if p.strip() and p.strip().lower() != 'nan' and p.startswith('P'))
+                stationary_count = station.get("Num Stationary Allocated", 0)
+                value = ""
+                if slot_numbers:
+                    value = f"P{slot_numbers[0]}-P{slot_numbers[-1] + stationary_count - 1}" if len(slot_numbers) > 1 else f"P{slot_numbers[0]}-P{slot_numbers[0] + stationary_count - 1}"
+                properties = rotated_bordered
+            else:             # Onboard count
+                value = station.get("Num Onboard Allocated", 0)
+            ops.append(('write', col, _xlsx_cell_value(value), properties))
+        yield (header_start_row + offset - 1, ops)
+
+    # --- Slot matrix (rows 17-60): slot name in column A, one cell per station ---
+    slot_categories = build_slot_category_matrix(station_records)
+    stationary_fill_colors = [frequency_fill_color(station.get("Frequency")) for station in station_records]
+    cell_keys = {} # (fill colour or None, slot category) -> format key
+
+    def matrix_cell_key(fill_color, slot_category):
+        key = cell_keys.get((fill_color, slot_category))
+        if key is None:
+            properties = dict(_XLSX_CENTERED, **_XLSX_BORDERED)
+            if slot_category & SLOT_CATEGORY_STATIONARY and fill_color:
+                properties.update({'bg_color': f"#{fill_color}", 'pattern': 1})
+            properties.update(_XLSX_ONBOARD_FONTS[slot_category & SLOT_CATEGORY_ONBOARD_MASK])
+            key = cell_keys[(fill_color, slot_category)] = format_key(properties)
+        return key
+
+    for r_idx, slot_name in enumerate(SLOT_NAMES):
+        ops = [('write', 0, slot_name, centered_bordered)]
+        for col, slot_category in enumerate(slot_categories[:, r_idx].tolist(), start=1):
+            onboard_priority = slot_category & SLOT_CATEGORY_ONBOARD_MASK
+            ops.append(('write', col, slot_name if onboard_priority else "", matrix_cell_key(stationary_fill_colors[col - 1], slot_category)))
+        yield (data_start_row + r_idx - 1, ops)
+
+    # --- Legend (row 61 onwards) ---
+    legend_row = legend_start_row - 1
+    yield (legend_row, [('write', i, header, format_key(dict(bold=True, **_XLSX_BORDERED))) for i, header in enumerate(LEGEND_HEADERS)])
+    for row_offset, (label, hex_color, example) in enumerate(LEGEND_DATA, start=1):
+        bold = label.endswith("Bold")
+        underlined = label.endswith("Underlined Bold")
+        grey_fill = {'bg_color': '#A7A7A7', 'pattern': 1} if int(label.split()[1]) >= 4 else {}
+        label_properties = {'bold': bold, 'font_color': f"#{hex_color}", **grey_fill, **_XLSX_BORDERED}
+        example_properties = {'bold': bold, 'font_color': f"#{hex_color}", **grey_fill, **_XLSX_BORDERED}
+        if underlined:
+            label_properties['underline'] = 1
+        if 'Priority 5' in label:
+            example_properties['underline'] = 1
+        yield (legend_row + row_offset, [('write', 0, label, format_key(label_properties)), ('write', 1, example, format_key(example_properties))])
+
+
+def write_sheet_plan(ws, formats: "XlsxFormatRegistry", plan):
+    """Writes the rows of a plan_matrix_sheet plan to an xlsxwriter worksheet as they come (they are in order)."""
+    for row, ops in plan:
+        for op in ops:
+            if op[0] == 'merge':
+                _, first_col, last_col, value, key = op
+                ws.merge_range(row, first_col, row, last_col, value, formats.get_by_key(key))
+            else:
+                _, col, value, key = op
+                ws.write(row, col, value, formats.get_by_key(key))
+    ws.set_column(0, 0, 36)
+    ws.set_column(1, 1, 10)
+
+def paginate_matrix_stations(station_records: list[dict], layout: str = "single", max_columns: int = PAGINATED_SHEET_MAX_COLUMNS) -> list[tuple[str, list[dict]]]:
+    """
+    Splits the matrix stations into (sheet name, stations) pages, keeping input order:
+      single       - one MATRIX_SHEET_NAME sheet with every station
+      by_frequency - one sheet per frequency ("Freq 1", ...; "No Frequency" last), each
+                     split further into `max_columns`-wide sheets when it is larger
+      by_columns   - consecutive `max_columns`-wide sheets ("Matrix 1", "Matrix 2", ...)
+    """
+    if layout == "single":
+        return [(MATRIX_SHEET_NAME, station_records)]
+    max_columns = max(1, int(max_columns))
+
+    def chunks(records):
+        return [records[start:start + max_columns] for start in range(0, len(records), max_columns)] or [[]]
+
+    if layout == "by_columns":
+        return [(f"Matrix {page}", page_records) for page, page_records in enumerate(chunks(station_records), start=1)]
+
+    stations_by_frequency = {}
+    for station in station_records:
+        frequency_val = station.get("Frequency")
+        try:
+            frequency = int(frequency_val) if pd.notna(frequency_val) and frequency_val != "N/A" else None
+        except ValueError:
+            frequency = None
+        stations_by_frequency.setdefault(frequency, []).append(station)
+
+    pages = []
+    for frequency in sorted(stations_by_frequency, key=lambda f: (f is None, f or 0)):
+        base_name = f"Freq {frequency}" if frequency is not None else "No Frequency"
+        for page, page_records in enumerate(chunks(stations_by_frequency[frequency]), start=1):
+            pages.append((base_name if page == 1 else f"{base_name} ({page})", page_records))
+    return pages
+
+def apply_color_scheme_xlsxwriter(
+    results_df: pd.DataFrame,
+    output_path=OUTPUT_FILE,
+    layout: str = "single",
+    max_columns: int = PAGINATED_SHEET_MAX_COLUMNS
+):
+    """
+    Same sheet layout as apply_color_scheme, written with xlsxwriter in constant_memory
+    mode: every row is written once, top to bottom, with its final format (borders
+    included) and flushed to the file. Each matrix row is laid out just before it is
+    written (plan_matrix_sheet is a generator), so besides the results themselves only
+    one row's cells are held at a time, however many stations or sheets there are.
+
+    With a paginated `layout` (see paginate_matrix_stations) the stations are spread over
+    several matrix sheets, each with its own titles and legend, written one after another.
+    Sheets are not rendered in parallel workers: xlsxwriter writes a workbook from one
+    thread, sheet by sheet, so workers could only build plans, which would then have to be
+    held in full and shipped back (the memory this streaming avoids) for a small gain.
+    Returns True only if the workbook was saved.
+    """
+    if results_df.empty:
+        print("Error: Input DataFrame for coloring is empty.")
+        return False
+
+    now = datetime.now() # For use in titles
+    station_records = results_df.drop_duplicates(subset="Station", keep="first").to_dict("records")
+
+    workbook = xlsxwriter.Workbook(output_path, {'constant_memory': True})
+    formats = XlsxFormatRegistry(workbook)
+    for sheet_name, page_records in paginate_matrix_stations(station_records, layout, max_columns):
+        write_sheet_plan(workbook.add_worksheet(sheet_name), formats, plan_matrix_sheet(page_records, now))
+
+    # --- Allocation Details Sheet ---
+    ws_details = workbook.add_worksheet("Allocation Details")
+    detail_headers, detail_rows, detail_widths = details_sheet_data(results_df)
+    ws_details.write_row(0, 0, detail_headers)
+    for row_num, row_values in enumerate(detail_rows, start=1):
+        ws_details.write_row(row_num, 0, row_values)
+    for col, width in enumerate(detail_widths):
+        ws_details.set_column(col, col, width)
+
+    output_name = output_path if isinstance(output_path, str) else "in-memory buffer"
     try:
-        wb.save(OUTPUT_FILE)
-        print(f"Formatted and styled Excel file saved to: {OUTPUT_FILE}")
+        workbook.close()
+        print(f"Formatted and styled Excel file saved to: {output_name}")
+        return True
     except PermissionError:
-        print(f"Critical Error: Permission denied. Failed to save Excel to {OUTPUT_FILE}.")
+        print(f"Critical Error: Permission denied. Failed to save Excel to {output_name}.")
         print("Ensure the file is not open and you have write permissions.")
     except Exception as e_save:
-        print(f"Critical Error: Failed to save Excel to {OUTPUT_FILE}. Error: {e_save}")
+        print(f"Critical Error: Failed to save Excel to {output_name}. Error: {e_save}")
+    return False
 
 if __name__ == '__main__':
     stations = [
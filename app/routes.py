@@ -1,15 +1,17 @@
-from flask import Flask, render_template, request, jsonify, send_file, session, url_for, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_file, url_for, send_from_directory, redirect, Response, stream_with_context
 import os
 import re
-import threading
-import pandas as pd
 from datetime import datetime
 import json
 # Import only necessary functions. allocate_slots will be used in submit_data_for_excel_generation
-from app.processing import calculate_distance, calculate_all_overlaps, generate_excel, allocate_slots
+from app.processing import generate_excel, allocate_slots, iter_allocate_slots, load_approved_snapshot, allocation_cache, ALLOCATION_MODES, MATRIX_LAYOUTS
+from app.processing import export_allocations, parquet_available, EXPORT_FORMATS
+from app.conflicts import map_conflict_graph
 import sqlite3
 # Import db_init from app.database, and also get_db_connection, get_approved_stations_from_db, get_planning_stations_from_db
-from app.database import get_db_connection, get_approved_stations_from_db, db_init, get_planning_stations_from_db, close_db
+from app.database import get_db_connection, get_approved_stations_from_db, db_init, get_planning_stations_from_db, close_db, save_allocated_planning_stations, db_pool
+from app.jobs import allocation_jobs, JOB_FINISHED, JOB_FAILED
+from app.upload_parser import parse_station_upload, planning_stations_from_upload
 import traceback
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
@@ -20,14 +22,17 @@ UPLOAD_FOLDER = os.path.join(os.getcwd(), "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
-# --- FIX: Call db_init() within the application context here ---
-with app.app_context():
-    db_init()
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
 # --- REGISTER close_db WITH THE APPLICATION CONTEXT TEARDOWN ---
-# This ensures that the database connection is automatically closed at the end of each request.
+# This ensures that the database connection is returned to the pool at the end of each request
+# (registered before db_init so the init connection is returned too).
 app.teardown_appcontext(close_db)
 
+# --- FIX: Call db_init() within the application context here ---
+with app.app_context():
+    db_init()
+
 FREQ_COLORS = {
     1: {'outline': "#F3EF18E2", 'fill': '#FFFACD'},
     2: {'outline': "#10E610B2", 'fill': '#90EE90'},
@@ -172,130 +177,101 @@ def update_map():
         center_location = [20.5937, 78.9629]
         zoom_level = 6
 
-    inter_type_conflicts = []
-    # Check conflicts between frontend planning stations and approved stations
-    # We need to explicitly convert approved['latitude'] and approved['longitude'] to float
-    # for calculate_distance if they are coming directly from sqlite3.Row without prior conversion.
-    for p_station in frontend_planning_stations:
-        p_lat = float(p_station.get('lat') or 0.0)
-        p_lon = float(p_station.get('lon') or 0.0)
-        p_rad = float(p_station.get('rad') or 12.0)
-        p_freq = int(p_station.get('frequency') or 1)
-
-        for approved in approved_stations_raw: # Use raw approved stations for conflict check
-            approved_freq = approved['allocated_frequency']
-            if approved_freq is None:
-                continue
-
-            if p_freq == approved_freq:
-                distance = calculate_distance(
-                    p_lat, p_lon,
-                    float(approved['latitude']), float(approved['longitude'])
-                )
-                min_distance = (p_rad + float(approved['safe_radius_km']))
-
-                if distance < min_distance:
-                    inter_type_conflicts.append({
-                        'planning_name': p_station.get('name'),
-                        'planning_freq': p_freq,
-                        'approved_name': approved['name'],
-                        'approved_freq': approved_freq,
-                        'distance': distance,
-                        'min_distance': min_distance,
-                        'planning_lat': p_lat,
-                        'planning_lon': p_lon,
-                        'approved_lat': float(approved['latitude']),
-                        'approved_lon': float(approved['longitude']),
-                        'popup_content': f"CONFLICT (Freq {p_freq}): {p_station.get('name')} & {approved['name']} - Dist: {distance:.2f}km < {min_distance:.2f}km required"
-                    })
-    # Also check conflicts between frontend planning stations and *persisted* planning stations
-    for p_station_frontend in frontend_planning_stations:
-        p_lat_fe = float(p_station_frontend.get('lat') or 0.0)
-        p_lon_fe = float(p_station_frontend.get('lon') or 0.0)
-        p_rad_fe = float(p_station_frontend.get('rad') or 12.0)
-        p_freq_fe = int(p_station_frontend.get('frequency') or 1)
-
-        for p_station_db in planning_stations_from_db_raw: # Use raw planning stations from DB
-            p_db_freq = p_station_db['allocated_frequency']
-            if p_db_freq is None:
-                continue
-
-            if p_freq_fe == p_db_freq and p_station_frontend.get('id') != f"db_planning_{p_station_db['id']}": # Avoid self-conflict if ID matches
-                distance = calculate_distance(
-                    p_lat_fe, p_lon_fe,
-                    float(p_station_db['latitude']), float(p_station_db['longitude'])
-                )
-                min_distance = (p_rad_fe + float(p_station_db['safe_radius_km']))
-
-                if distance < min_distance:
-                    inter_type_conflicts.append({
-                        'planning_name': p_station_frontend.get('name'),
-                        'planning_freq': p_freq_fe,
-                        'approved_name': p_station_db['name'], # Treat persisted planning as "approved" for conflict message
-                        'approved_freq': p_db_freq,
-                        'distance': distance,
-                        'min_distance': min_distance,
-                        'planning_lat': p_lat_fe,
-                        'planning_lon': p_lon_fe,
-                        'approved_lat': float(p_station_db['latitude']),
-                        'approved_lon': float(p_station_db['longitude']),
-                        'popup_content': f"CONFLICT (Freq {p_freq_fe}): {p_station_frontend.get('name')} (Planning) & {p_station_db['name']} (Persisted Planning) - Dist: {distance:.2f}km < {min_distance:.2f}km required"
-                    })
-
+    # Frontend planning stations against the approved and persisted planning stations.
+    # The graph keeps edges between stored stations and unchanged planning stations between refreshes.
+    inter_type_conflicts = map_conflict_graph.find_conflicts(
+        approved_stations_raw, planning_stations_from_db_raw, frontend_planning_stations
+    )
     print(f"Inter-type conflicts: {inter_type_conflicts}")
 
-    # calculate_all_overlaps should consider all stations on the map, including DB planning stations
-    # For this, we need to pass a combined list of all stations that have lat/lon and radius for overlap calculation
-    all_map_stations_for_overlap_check = []
-    # Add approved stations
-    for s in approved_stations_raw:
-        all_map_stations_for_overlap_check.append({
-            'id': f"approved_{s['id']}",
-            'name': s['name'],
-            'lat': float(s['latitude']),
-            'lon': float(s['longitude']),
-            'rad': float(s['safe_radius_km']),
-            'frequency': int(s['allocated_frequency']) if s['allocated_frequency'] is not None else 0,
-            'type': 'approved'
-        })
-    # Add persisted planning stations
-    for s in planning_stations_from_db_raw:
-        all_map_stations_for_overlap_check.append({
-            'id': f"db_planning_{s['id']}",
-            'name': s['name'],
-            'lat': float(s['latitude']),
-            'lon': float(s['longitude']),
-            'rad': float(s['safe_radius_km']),
-            'frequency': int(s['allocated_frequency']) if s['allocated_frequency'] is not None else 0,
-            'type': 'db_planning'
-        })
-    # Add frontend planning stations
-    for s in frontend_planning_stations:
-        all_map_stations_for_overlap_check.append({
-            'id': s.get('id'),
-            'name': s.get('name'),
-            'lat': float(s.get('lat') or 0.0),
-            'lon': float(s.get('lon') or 0.0),
-            'rad': float(s.get('rad') or 12.0),
-            'frequency': int(s.get('frequency') or 1),
-            'type': 'planning'
-        })
-
-
-    overlapping_pair_data, has_major_conflict = calculate_all_overlaps(all_map_stations_for_overlap_check)
-    print(f"Overlapping pair data: {overlapping_pair_data}")
-
-    overall_has_conflict = has_major_conflict or bool(inter_type_conflicts)
+    # Not computed: the old overlap check read the radius from keys the map's station dicts
+    # don't carry, so the map has always received no overlapping pairs and hasConflict only
+    # from the inter-type conflicts. Reporting real overlaps is a separate change (it alters
+    # what the map highlights and warns about).
+    overlapping_pair_data = []
 
     return jsonify({
         'allStationData': all_stations_for_map_drawing,
         'overlappingPairData': overlapping_pair_data,
         'interTypeConflicts': inter_type_conflicts,
-        'hasConflict': overall_has_conflict,
+        'hasConflict': bool(inter_type_conflicts),
         'center_location': center_location,
         'zoom_level': zoom_level
     })
 
+def excel_options_from_request():
+    """
+    Workbook layout options from the query string: ?layout=single|by_frequency|by_columns
+    and ?columns=<stations per sheet>. Returns (options, error message).
+    """
+    layout = request.args.get('layout', 'single')
+    if layout not in MATRIX_LAYOUTS:
+        return None, f"Invalid layout '{layout}'. Expected one of: {', '.join(MATRIX_LAYOUTS)}"
+    options = {'layout': layout}
+    if 'columns' in request.args:
+        try:
+            options['max_columns'] = int(request.args['columns'])
+        except ValueError:
+            return None, "columns must be an integer"
+        if options['max_columns'] < 1:
+            return None, "columns must be at least 1"
+    return options, None
+
+def run_allocation_pipeline(planning_stations, allocation_mode="sequential", report_progress=None, in_memory=False, excel_options=None):
+    """
+    Allocation -> persistence to 'planning_stations' -> Excel generation.
+    Shared by the synchronous endpoint and the background jobs; needs an app context.
+    `excel_options` are passed on to generate_excel (layout, max_columns).
+    Returns (workbook, persistence): the generated Excel file path (a BytesIO with `in_memory`),
+    or None if generation failed, and the persistence report. A failed save doesn't stop the
+    workbook from being generated; it is reported as {'saved': False, 'error': ...} instead of
+    {'saved': True, 'inserted': .., 'updated': .., 'skipped': ..}.
+    """
+    report_progress = report_progress or (lambda stage: None)
+
+    # --- STEP 1: Run Allocation Logic ---
+    report_progress("allocating")
+    allocated_planning_results = allocate_slots(planning_stations, mode=allocation_mode)
+    print(f"DEBUG routes.py: Allocation results from processing.py: {allocated_planning_results}")
+
+    # --- STEP 2: Persist Allocated Planning Stations to 'planning_stations' Database Table ---
+    report_progress("persisting")
+    try:
+        persistence = {'saved': True, **save_allocated_planning_stations(allocated_planning_results)}
+    except Exception as e:
+        print(f"ERROR routes.py: Allocated planning stations were not persisted: {e}")
+        persistence = {'saved': False, 'error': str(e)}
+
+    # --- STEP 3: Generate the Excel file using the allocated data ---
+    report_progress("generating_excel")
+    return generate_excel(allocated_planning_results, in_memory=in_memory, **(excel_options or {})), persistence
+
+def allocation_message(persistence):
+    """Response message for a generated workbook, saying whether the stations reached the DB."""
+    if persistence['saved']:
+        return "Excel file generated successfully and stations persisted to DB."
+    return "Excel file generated successfully, but the allocated stations could not be persisted to DB."
+
+def send_workbook(workbook_buffer, persistence):
+    """Sends an in-memory workbook as a download; a failed save is reported in the X-Persistence-Error header."""
+    response = send_file(
+        workbook_buffer,
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=f"kavach_slots_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    )
+    if not persistence['saved']:
+        response.headers['X-Persistence-Error'] = " ".join(persistence['error'].split())
+    return response
+
+def _allocation_job(report_progress, planning_stations, allocation_mode, excel_options=None):
+    """Background job body: the pipeline inside its own app context (and DB connection)."""
+    with app.app_context():
+        output_filepath, persistence = run_allocation_pipeline(planning_stations, allocation_mode, report_progress, excel_options=excel_options)
+    if not output_filepath:
+        raise RuntimeError("Failed to generate Excel file after allocation.")
+    return {'filename': os.path.basename(output_filepath), 'stationCount': len(planning_stations), 'persistence': persistence}
+
 @app.route('/allocate_slots_endpoint', methods=['POST'])
 def submit_data_for_excel_generation():
     """
@@ -309,80 +285,30 @@ def submit_data_for_excel_generation():
         if not planning_stations_data_from_frontend or not isinstance(planning_stations_data_from_frontend, list):
             return jsonify({"error": "Invalid station data received for allocation"}), 400
 
-        # --- STEP 1: Run Allocation Logic ---
-        allocated_planning_results = allocate_slots(planning_stations_data_from_frontend)
-        print(f"DEBUG routes.py: Allocation results from processing.py: {allocated_planning_results}")
+        # ?mode=clustered allocates independent geographic clusters in parallel
+        allocation_mode = request.args.get('mode', 'sequential')
+        if allocation_mode not in ALLOCATION_MODES:
+            return jsonify({"error": f"Invalid allocation mode '{allocation_mode}'. Expected one of: {', '.join(ALLOCATION_MODES)}"}), 400
 
-        # --- STEP 2: Persist Allocated Planning Stations to 'planning_stations' Database Table ---
-        conn = get_db_connection() # Get the connection managed by Flask's 'g'
-        cursor = conn.cursor()
-        
-        for station_result in allocated_planning_results:
-            if station_result.get('Status') == 'Allocated':
-                try:
-                    skac_id = station_result.get("Stationary Kavach ID")
-                    
-                    existing_station_query = cursor.execute("SELECT id FROM planning_stations WHERE SKac_ID = ?", (skac_id,)).fetchone()
-                    
-                    if existing_station_query:
-                        station_id_to_update = existing_station_query[0]
-                        cursor.execute(
-                            """UPDATE planning_stations SET
-                                name=?, Station_Code=?, SKac_ID=?, latitude=?, longitude=?, safe_radius_km=?, status=?, allocated_frequency=?, timeslot=?, Area_type=?
-                                WHERE id = ?""",
-                            (
-                                station_result.get("Station"),
-                                station_result.get("Station Code"),
-                                skac_id,
-                                station_result.get("Latitude"),
-                                station_result.get("Longitude"),
-                                station_result.get("SafeRadius"),
-                                station_result.get("Status"),
-                                station_result.get("Frequency"),
-                                station_result.get("Allocated Timeslot Range"),
-                                "Allocated Planning",
-                                station_id_to_update
-                            )
-                        )
-                        print(f"DEBUG routes.py: Updated existing planning station {station_result.get('Station')} (ID: {station_id_to_update}) in 'planning_stations' DB.")
-                    else:
-                        cursor.execute(
-                            """INSERT INTO planning_stations (name, Station_Code, SKac_ID, latitude, longitude, safe_radius_km, status, allocated_frequency, timeslot, Area_type)
-                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                            (
-                                station_result.get("Station"),
-                                station_result.get("Station Code"),
-                                skac_id,
-                                station_result.get("Latitude"),
-                                station_result.get("Longitude"),
-                                station_result.get("SafeRadius"),
-                                station_result.get("Status"),
-                                station_result.get("Frequency"),
-                                station_result.get("Allocated Timeslot Range"),
-                                "Allocated Planning"
-                            )
-                        )
-                        print(f"DEBUG routes.py: Inserted new planning station {station_result.get('Station')} into 'planning_stations' DB.")
-                except sqlite3.IntegrityError as e:
-                    print(f"WARNING routes.py: Could not save/update station {station_result.get('Station')} to 'planning_stations' due to integrity error (e.g., duplicate SKac_ID): {e}")
-                except Exception as e:
-                    print(f"ERROR routes.py: Failed to save allocated station {station_result.get('Station')} to 'planning_stations' DB: {e}")
-                    import traceback
-                    traceback.print_exc()
-
-        conn.commit() # Commit changes to the database
-        # REMOVE THIS LINE: conn.close() # <--- THIS IS THE PROBLEM!
-        print("DEBUG routes.py: All allocated planning stations processed for DB persistence in 'planning_stations'.")
-
-        # --- STEP 3: Generate the Excel file using the allocated data ---
-        # Pass the `allocated_planning_results` to generate_excel
-         # Ensure this import is correct
-        output_filepath = generate_excel(allocated_planning_results)
+        # ?layout=by_frequency|by_columns (&columns=N) paginates the matrix over several sheets
+        excel_options, options_error = excel_options_from_request()
+        if options_error:
+            return jsonify({"error": options_error}), 400
+
+        # ?download=1 sends the workbook back in this response instead of a fileUrl to fetch
+        if request.args.get('download', '').lower() in ('1', 'true', 'yes'):
+            workbook_buffer, persistence = run_allocation_pipeline(planning_stations_data_from_frontend, allocation_mode, in_memory=True, excel_options=excel_options)
+            if workbook_buffer is None:
+                return jsonify({"error": "Failed to generate Excel file after allocation.", "persistence": persistence}), 500
+            return send_workbook(workbook_buffer, persistence)
+
+        output_filepath, persistence = run_allocation_pipeline(planning_stations_data_from_frontend, allocation_mode, excel_options=excel_options)
         
         if output_filepath:
             filename = os.path.basename(output_filepath)
             return jsonify({
-                "message": "Excel file generated successfully and stations persisted to DB.",
+                "message": allocation_message(persistence),
+                "persistence": persistence,
                 "fileUrl": url_for('download_generated_file', filename=filename, _external=True)
             })
         else:
@@ -394,6 +320,160 @@ def submit_data_for_excel_generation():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/allocate_slots_stream', methods=['POST'])
+def stream_allocation_results():
+    """
+    Runs the allocation and streams the results as NDJSON, one line per planning station
+    as soon as it is committed: {"index": i, "result": {...}}. The last line is
+    {"done": true, "count": n}, or {"error": "..."} if the allocation failed part way.
+    Nothing is persisted and no Excel file is generated.
+    """
+    planning_stations_data_from_frontend = request.json
+    if not planning_stations_data_from_frontend or not isinstance(planning_stations_data_from_frontend, list):
+        return jsonify({"error": "Invalid station data received for allocation"}), 400
+
+    # Load the approved snapshot up front so a DB problem is still a normal error response
+    approved_snapshot = load_approved_snapshot()
+
+    def generate_lines():
+        count = 0
+        try:
+            for result in iter_allocate_slots(planning_stations_data_from_frontend, approved_snapshot=approved_snapshot):
+                yield json.dumps({"index": count, "result": result}, default=str) + "\n"
+                count += 1
+        except Exception as e:
+            print(f"Error in stream_allocation_results: {e}")
+            traceback.print_exc()
+            yield json.dumps({"error": str(e), "count": count}) + "\n"
+            return
+        yield json.dumps({"done": True, "count": count}) + "\n"
+
+    return Response(stream_with_context(generate_lines()), mimetype='application/x-ndjson')
+
+# Accept header values understood by /api/allocation_export, mapped to export formats
+EXPORT_ACCEPT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "jsonl",
+    "application/jsonl": "jsonl",
+    "application/json-lines": "jsonl",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet"
+}
+
+@app.route('/api/allocation_export', methods=['POST'])
+def export_allocation_results():
+    """
+    Runs the allocation and returns the raw result rows as CSV, JSON Lines or Parquet,
+    chosen by ?format=csv|jsonl|parquet or else the Accept header (CSV by default).
+    No workbook is rendered and nothing is persisted. Accepts ?mode= like /allocate_slots_endpoint.
+    """
+    planning_stations_data_from_frontend = request.json
+    if not planning_stations_data_from_frontend or not isinstance(planning_stations_data_from_frontend, list):
+        return jsonify({"error": "Invalid station data received for allocation"}), 400
+
+    export_format = request.args.get('format')
+    if export_format is None:
+        export_format = EXPORT_ACCEPT_TYPES.get(request.accept_mimetypes.best_match(list(EXPORT_ACCEPT_TYPES)), "csv")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Invalid export format '{export_format}'. Expected one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    if export_format == "parquet" and not parquet_available():
+        return jsonify({"error": "Parquet export is not available on this server: the optional 'pyarrow' package is not installed."}), 501
+
+    allocation_mode = request.args.get('mode', 'sequential')
+    if allocation_mode not in ALLOCATION_MODES:
+        return jsonify({"error": f"Invalid allocation mode '{allocation_mode}'. Expected one of: {', '.join(ALLOCATION_MODES)}"}), 400
+
+    try:
+        allocated_planning_results = allocate_slots(planning_stations_data_from_frontend, mode=allocation_mode)
+        export_buffer = export_allocations(allocated_planning_results, export_format)
+    except Exception as e:
+        print(f"Error in export_allocation_results: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return send_file(
+        export_buffer,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=f"kavach_allocation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    )
+
+@app.route('/api/allocation_jobs', methods=['POST'])
+def submit_allocation_job():
+    """
+    Queues allocation + persistence + Excel generation as a background job and returns
+    straight away with its id. Poll /api/allocation_jobs/<job_id> for progress.
+    Accepts the same body, ?mode= and ?layout=/?columns= as /allocate_slots_endpoint.
+    """
+    planning_stations_data_from_frontend = request.json
+    if not planning_stations_data_from_frontend or not isinstance(planning_stations_data_from_frontend, list):
+        return jsonify({"error": "Invalid station data received for allocation"}), 400
+
+    allocation_mode = request.args.get('mode', 'sequential')
+    if allocation_mode not in ALLOCATION_MODES:
+        return jsonify({"error": f"Invalid allocation mode '{allocation_mode}'. Expected one of: {', '.join(ALLOCATION_MODES)}"}), 400
+
+    excel_options, options_error = excel_options_from_request()
+    if options_error:
+        return jsonify({"error": options_error}), 400
+
+    job_id = allocation_jobs.submit(_allocation_job, planning_stations_data_from_frontend, allocation_mode, excel_options)
+    return jsonify({
+        "jobId": job_id,
+        "statusUrl": url_for('allocation_job_status', job_id=job_id, _external=True)
+    }), 202
+
+@app.route('/api/allocation_jobs/<job_id>', methods=['GET'])
+def allocation_job_status(job_id):
+    """Status of a background allocation job; includes fileUrl and the persistence report once it has finished."""
+    job = allocation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job id '{job_id}'"}), 404
+
+    response = {
+        "jobId": job['id'],
+        "status": job['status'],
+        "stage": job['stage'],
+        "submittedAt": job['submitted_at'],
+        "startedAt": job['started_at'],
+        "finishedAt": job['finished_at']
+    }
+    if job['status'] == JOB_FINISHED:
+        response["fileUrl"] = url_for('download_generated_file', filename=job['result']['filename'], _external=True)
+        response["stationCount"] = job['result']['stationCount']
+        response["persistence"] = job['result']['persistence']
+    elif job['status'] == JOB_FAILED:
+        response["error"] = job['error']
+    return jsonify(response)
+
+@app.route('/api/allocation_jobs/<job_id>/result', methods=['GET'])
+def allocation_job_result(job_id):
+    """Redirects to the generated Excel file of a finished job (409 while it is still running)."""
+    job = allocation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job id '{job_id}'"}), 404
+    if job['status'] == JOB_FAILED:
+        return jsonify({"error": job['error']}), 500
+    if job['status'] != JOB_FINISHED:
+        return jsonify({"error": "Job has not finished yet", "status": job['status'], "stage": job['stage']}), 409
+    return redirect(url_for('download_generated_file', filename=job['result']['filename']))
+
+@app.route('/api/allocation_job_stats', methods=['GET'])
+def allocation_job_stats():
+    """Number of background allocation jobs per status."""
+    return jsonify(allocation_jobs.stats())
+
+@app.route('/api/db_pool_stats', methods=['GET'])
+def db_pool_stats():
+    """Open/reused/idle counters of the SQLite connection pool."""
+    return jsonify(db_pool.stats())
+
+@app.route('/api/allocation_cache_stats', methods=['GET'])
+def allocation_cache_stats():
+    """Hit/miss statistics of the allocate_slots result cache."""
+    return jsonify(allocation_cache.stats())
+
 @app.route('/static/downloads/<filename>')
 def download_generated_file(filename):
     full_path_to_downloads = os.path.join(app.root_path, app.config["UPLOAD_FOLDER"])
@@ -427,6 +507,107 @@ def validate_timeslot(timeslot_str):
         
     return True, "Valid"
 
+STATION_TABLES = ['approved_stations', 'planning_stations']
+
+def _integer(value):
+    """int() that refuses to truncate a fractional number (2.7 would silently become 2)."""
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"{value} is not a whole number")
+    return int(value)
+
+# Columns an add/update may set -> cast matching the column's type in the stations tables
+UPDATABLE_STATION_COLUMNS = {
+    'name': str, 'latitude': float, 'longitude': float, 'safe_radius_km': float, 'status': str,
+    'allocated_frequency': _integer, 'timeslot': str, 'Area_type': str, 'SKac_ID': str, 'Station_Code': str
+}
+
+def station_column_value(column, value):
+    """
+    Casts a JSON value for a station column to the column's type. Returns (value, None), or
+    (None, error message) for a list/object, a boolean in a numeric column or an unparsable value.
+    """
+    cast = UPDATABLE_STATION_COLUMNS[column]
+    if not isinstance(value, (str, int, float)) or (isinstance(value, bool) and cast is not str):
+        return None, f"Invalid value for '{column}': expected a single {'text' if cast is str else 'numeric'} value."
+    try:
+        return cast(value), None
+    except (ValueError, TypeError, OverflowError) as e:
+        return None, f"Invalid value for '{column}'. Error: {e}"
+
+def station_add_statement(data):
+    """
+    Validates an add-station request. Returns (sql, params, None), or (None, None, error message).
+    New stations always go into 'approved_stations'.
+    """
+    required_fields = ['name', 'Station_Code', 'SKac_ID', 'latitude', 'longitude', 'safe_radius_km', 'status', 'timeslot', 'Area_type']
+    if not all(k in data and data[k] not in [None, ''] for k in required_fields):
+        return None, None, "All fields are required and cannot be empty."
+
+    is_valid, message = validate_timeslot(data.get('timeslot'))
+    if not is_valid:
+        return None, None, f"Timeslot Error: {message}"
+
+    params = []
+    for column in ['name', 'Station_Code', 'SKac_ID', 'latitude', 'longitude', 'safe_radius_km', 'status', 'allocated_frequency', 'timeslot', 'Area_type']:
+        value = data.get(column)
+        if column == 'allocated_frequency' and not value:
+            params.append(None)
+            continue
+        value, error = station_column_value(column, value)
+        if error:
+            return None, None, f"Invalid data format. {error}"
+        params.append(value)
+
+    sql = """INSERT INTO approved_stations (name, Station_Code, SKac_ID, latitude, longitude, safe_radius_km, status, allocated_frequency, timeslot, Area_type)
+             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+    return sql, tuple(params), None
+
+def station_update_statement(data):
+    """Validates an update-station request ('id', optional 'target_table', the fields to set). Same return as station_add_statement."""
+    if 'id' not in data:
+        return None, None, "Invalid request data, missing 'id'."
+    target_table = data.get('target_table', 'approved_stations')
+    if target_table not in STATION_TABLES:
+        return None, None, "Invalid target table for update."
+
+    if 'timeslot' in data and data['timeslot']:
+        is_valid, message = validate_timeslot(data['timeslot'])
+        if not is_valid:
+            return None, None, f"Timeslot Error: {message}"
+
+    try:
+        station_id = int(data['id'])
+    except (ValueError, TypeError):
+        return None, None, "Invalid request data, 'id' must be an integer."
+
+    update_fields = []
+    update_values = []
+    for key, value in data.items():
+        if key in UPDATABLE_STATION_COLUMNS and value not in [None, '']:
+            value, error = station_column_value(key, value)
+            if error:
+                return None, None, error
+            update_fields.append(f"{key} = ?")
+            update_values.append(value)
+    if not update_fields:
+        return None, None, "No valid fields provided for update."
+
+    update_values.append(station_id)
+    return f"UPDATE {target_table} SET {', '.join(update_fields)} WHERE id = ?", tuple(update_values), None
+
+def station_delete_statement(data):
+    """Validates a delete-station request ('id', optional 'target_table'). Same return as station_add_statement."""
+    if 'id' not in data:
+        return None, None, "Invalid request data, missing 'id'."
+    target_table = data.get('target_table', 'approved_stations')
+    if target_table not in STATION_TABLES:
+        return None, None, "Invalid target table for delete."
+    try:
+        station_id = int(data['id'])
+    except (ValueError, TypeError):
+        return None, None, "Invalid request data, 'id' must be an integer."
+    return f"DELETE FROM {target_table} WHERE id = ?", (station_id,), None
+
 @app.route('/api/add_station', methods=['POST'])
 def add_station():
     try:
@@ -434,38 +615,13 @@ def add_station():
         if not data:
             return jsonify(success=False, message="Request body must be JSON."), 400
 
-        required_fields = ['name', 'Station_Code', 'SKac_ID', 'latitude', 'longitude', 'safe_radius_km', 'status', 'timeslot', 'Area_type']
-        if not all(k in data and data[k] not in [None, ''] for k in required_fields):
-            return jsonify(success=False, message="All fields are required and cannot be empty."), 400
-        
-        timeslot = data.get('timeslot')
-        is_valid, message = validate_timeslot(timeslot)
-        if not is_valid:
-            return jsonify(success=False, message=f"Timeslot Error: {message}"), 400
-
-        try:
-            name = data['name']
-            station_code = data['Station_Code']
-            skac_id = data['SKac_ID']
-            lat = float(data['latitude'])
-            lon = float(data['longitude'])
-            radius = float(data['safe_radius_km'])
-            status = data['status']
-            area_type = data['Area_type']
-            freq = data.get('allocated_frequency')
-            freq = int(freq) if freq else None
-
-        except (ValueError, TypeError) as e:
-            return jsonify(success=False, message=f"Invalid data format. Error: {e}"), 400
+        sql, params, error = station_add_statement(data)
+        if error:
+            return jsonify(success=False, message=error), 400
 
         conn = get_db_connection()
-        conn.execute(
-            """INSERT INTO approved_stations (name, Station_Code, SKac_ID, latitude, longitude, safe_radius_km, status, allocated_frequency, timeslot, Area_type)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (name, station_code, skac_id, lat, lon, radius, status, freq, timeslot, area_type)
-        )
+        conn.execute(sql, params)
         conn.commit()
-        conn.close()
         return jsonify(success=True, message="Station added successfully!")
 
     except sqlite3.IntegrityError:
@@ -474,11 +630,78 @@ def add_station():
         traceback.print_exc()
         return jsonify(success=False, message=f"An internal server error occurred: {e}"), 500
 
+# Query parameters of /api/get_stations that filter on a column by equality
+STATION_EQUALITY_FILTERS = {'frequency': ('allocated_frequency', int), 'status': ('status', str), 'area_type': ('Area_type', str)}
+MAX_STATIONS_PAGE_LIMIT = 5000
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def stations_query_from_request(table_name, table_columns):
+    """
+    Builds the SELECT for /api/get_stations from the query string.
+    Returns (sql, params, limit, error message).
+    """
+    # ?fields=name,latitude,... ; id is always included, it is the pagination key
+    columns = ['*']
+    if request.args.get('fields'):
+        requested = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+        unknown = [field for field in requested if field not in table_columns]
+        if unknown:
+            return None, None, None, f"Unknown field(s): {', '.join(unknown)}"
+        columns = ['id'] + [field for field in dict.fromkeys(requested) if field != 'id']
+
+    conditions, params = [], []
+    for arg, (column, cast) in STATION_EQUALITY_FILTERS.items():
+        if arg in request.args:
+            try:
+                params.append(cast(request.args[arg]))
+            except ValueError:
+                return None, None, None, f"{arg} must be an integer"
+            conditions.append(f"{column} = ?")
+    if request.args.get('name_prefix'):
+        conditions.append("name LIKE ? ESCAPE '\\'")
+        params.append(_escape_like(request.args['name_prefix']) + '%')
+    if 'bbox' in request.args:
+        # bbox=min_lat,min_lon,max_lat,max_lon
+        try:
+            min_lat, min_lon, max_lat, max_lon = (float(v) for v in request.args['bbox'].split(','))
+        except ValueError:
+            return None, None, None, "bbox must be min_lat,min_lon,max_lat,max_lon"
+        conditions.append("latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?")
+        params += [min_lat, max_lat, min_lon, max_lon]
+
+    # Keyset pagination: ?after_id=<last id of the previous page>&limit=N
+    limit = None
+    try:
+        if 'after_id' in request.args:
+            conditions.append("id > ?")
+            params.append(int(request.args['after_id']))
+        if 'limit' in request.args:
+            limit = int(request.args['limit'])
+    except ValueError:
+        return None, None, None, "after_id and limit must be integers"
+    if limit is not None and not 1 <= limit <= MAX_STATIONS_PAGE_LIMIT:
+        return None, None, None, f"limit must be between 1 and {MAX_STATIONS_PAGE_LIMIT}"
+
+    sql = f"SELECT {', '.join(columns)} FROM {table_name}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit + 1) # One extra row tells whether there is a next page
+    return sql, params, limit, None
+
 @app.route('/api/get_stations', methods=['GET'])
 def get_stations():
     """
     Fetches stations from either 'approved_stations' or 'planning_stations' table
     based on the 'table' query parameter. Defaults to 'approved_stations'.
+    Optional: filters ?frequency=, ?status=, ?area_type=, ?name_prefix=, ?bbox=min_lat,min_lon,max_lat,max_lon;
+    projection ?fields=a,b,c; keyset pagination ?limit=N&after_id=<nextAfterId of the previous page>.
+    Without them all rows and columns are returned, as before. Responses carry an ETag
+    and answer a matching If-None-Match with 304.
     """
     table_name = request.args.get('table', 'approved_stations')
     
@@ -487,9 +710,21 @@ def get_stations():
 
     conn = get_db_connection()
     try:
-        stations_cursor = conn.execute(f"SELECT * FROM {table_name} ORDER BY id").fetchall()
-        stations = [dict(row) for row in stations_cursor]
-        return jsonify(stations=stations)
+        table_columns = {row['name'] for row in conn.execute(f"PRAGMA table_info({table_name})")}
+        sql, params, limit, query_error = stations_query_from_request(table_name, table_columns)
+        if query_error:
+            return jsonify(stations=[], error=query_error), 400
+
+        stations = [dict(row) for row in conn.execute(sql, params)]
+        payload = {'stations': stations}
+        if limit is not None:
+            has_more = len(stations) > limit
+            del stations[limit:]
+            payload['nextAfterId'] = stations[-1]['id'] if has_more else None
+
+        response = jsonify(payload)
+        response.add_etag()
+        return response.make_conditional(request)
     except sqlite3.OperationalError as e:
         print(f"Error fetching from table {table_name}: {e}")
         return jsonify(stations=[], error=f"Error fetching data: {e}"), 500
@@ -506,45 +741,16 @@ def update_station():
     """
     try:
         data = request.get_json()
-        if not data or 'id' not in data:
+        if not data:
             return jsonify(success=False, message="Invalid request data, missing 'id'."), 400
-        
-        target_table = data.get('target_table', 'approved_stations')
-        if target_table not in ['approved_stations', 'planning_stations']:
-            return jsonify(success=False, message="Invalid target table for update."), 400
 
-        if 'timeslot' in data and data['timeslot']:
-            is_valid, message = validate_timeslot(data['timeslot'])
-            if not is_valid:
-                return jsonify(success=False, message=f"Timeslot Error: {message}"), 400
+        sql, params, error = station_update_statement(data)
+        if error:
+            return jsonify(success=False, message=error), 400
 
-        station_id = int(data['id'])
-        
         conn = get_db_connection()
-        
-        allowed_columns = [
-            'name', 'latitude', 'longitude', 'safe_radius_km', 'status', 
-            'allocated_frequency', 'timeslot', 'Area_type', 'SKac_ID', 'Station_Code'
-        ]
-
-        update_fields = []
-        update_values = []
-        
-        for key, value in data.items():
-            if key in allowed_columns and value not in [None, '']:
-                    update_fields.append(f"{key} = ?")
-                    update_values.append(value)
-        
-        if not update_fields:
-            return jsonify(success=False, message="No valid fields provided for update."), 400
-        
-        update_values.append(station_id)
-        
-        query = f"UPDATE {target_table} SET {', '.join(update_fields)} WHERE id = ?"
-
-        conn.execute(query, tuple(update_values))
+        conn.execute(sql, params)
         conn.commit()
-        # conn.close() # Connection managed by g
         
         return jsonify(success=True, message="Station updated successfully!")
     
@@ -563,25 +769,106 @@ def delete_station():
     """
     try:
         data = request.get_json()
-        if not data or 'id' not in data:
+        if not data:
             return jsonify(success=False, message="Invalid request data, missing 'id'."), 400
 
-        target_table = data.get('target_table', 'approved_stations')
-        if target_table not in ['approved_stations', 'planning_stations']:
-            return jsonify(success=False, message="Invalid target table for delete."), 400
-
-        station_id = int(data['id'])
+        sql, params, error = station_delete_statement(data)
+        if error:
+            return jsonify(success=False, message=error), 400
 
         conn = get_db_connection()
-        conn.execute(f"DELETE FROM {target_table} WHERE id = ?", (station_id,))
+        conn.execute(sql, params)
         conn.commit()
-        # conn.close() # Connection managed by g
         
         return jsonify(success=True, message="Station deleted successfully!")
     
     except Exception as e:
         traceback.print_exc()
         return jsonify(success=False, message=f"An internal server error: {e}"), 500
+
+# op -> (statement builder, success message) for /api/stations_batch
+STATION_BATCH_OPERATIONS = {
+    'add': (station_add_statement, "Station added successfully!"),
+    'update': (station_update_statement, "Station updated successfully!"),
+    'delete': (station_delete_statement, "Station deleted successfully!")
+}
+MAX_STATION_BATCH_OPERATIONS = 1000
+
+@app.route('/api/stations_batch', methods=['POST'])
+def stations_batch():
+    """
+    Applies many add/update/delete operations in one transaction (one commit instead of one per row).
+    Body: {"operations": [{"op": "add"|"update"|"delete", ...same fields as the single endpoints}],
+           "atomic": false}
+    Every operation is validated like its single endpoint and runs under its own savepoint, so a
+    failing one (constraint violation or any other database error) is undone on its own and reported; with "atomic": true any failure rolls back the
+    whole batch. Returns one result per operation, in order.
+    """
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify(success=False, message="Request body must be JSON with a non-empty 'operations' list."), 400
+    if len(operations) > MAX_STATION_BATCH_OPERATIONS:
+        return jsonify(success=False, message=f"At most {MAX_STATION_BATCH_OPERATIONS} operations per batch."), 400
+    atomic = data.get('atomic', False)
+    if not isinstance(atomic, bool):
+        return jsonify(success=False, message="'atomic' must be true or false."), 400
+
+    conn = get_db_connection()
+    results = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for index, operation in enumerate(operations):
+            op = operation.get('op') if isinstance(operation, dict) else None
+            if op not in STATION_BATCH_OPERATIONS:
+                results.append({'index': index, 'op': op, 'success': False, 'message': f"Unknown op. Expected one of: {', '.join(STATION_BATCH_OPERATIONS)}"})
+                continue
+            build_statement, success_message = STATION_BATCH_OPERATIONS[op]
+            sql, params, error = build_statement(operation)
+            if error:
+                results.append({'index': index, 'op': op, 'success': False, 'message': error})
+                continue
+
+            conn.execute("SAVEPOINT station_operation")
+            try:
+                cursor = conn.execute(sql, params)
+            except sqlite3.Error as e:
+                conn.execute("ROLLBACK TO station_operation")
+                conn.execute("RELEASE station_operation")
+                if isinstance(e, sqlite3.IntegrityError):
+                    message = f"Duplicate name or SKac_ID: {e}"
+                else:
+                    message = f"Database error: {e}"
+                results.append({'index': index, 'op': op, 'success': False, 'message': message})
+                continue
+            conn.execute("RELEASE station_operation")
+
+            result = {'index': index, 'op': op, 'success': True, 'message': success_message}
+            if op == 'add':
+                result['id'] = cursor.lastrowid
+            elif cursor.rowcount == 0:
+                result.update(success=False, message=f"No station with id {params[-1]}.")
+            results.append(result)
+
+        failed = sum(1 for result in results if not result['success'])
+        committed = not (atomic and failed)
+        if committed:
+            conn.commit()
+        else:
+            conn.rollback()
+    except sqlite3.Error as db_error:
+        conn.rollback()
+        traceback.print_exc()
+        return jsonify(success=False, message=f"Database error: {db_error}"), 500
+
+    print(f"DEBUG routes.py: Station batch of {len(operations)} operations, {failed} failed, {'committed' if committed else 'rolled back'}.")
+    return jsonify(
+        success=failed == 0,
+        committed=committed,
+        succeeded=len(results) - failed,
+        failed=failed,
+        results=results
+    )
      
 @app.route("/upload_excel", methods=["POST"])
 def upload_excel():
@@ -593,45 +880,79 @@ def upload_excel():
     if not file.filename.endswith((".xls", ".xlsx")):
         return jsonify({"error": "Invalid file format"}), 400
 
-    file_path = os.path.join(app.config["UPLOAD_FOLDER"], file.filename)
-    
     try:
-        file.save(file_path)
-        print(f"✅ File saved at: {file_path}")
-
-        df = pd.read_excel(file_path, header=None)
-
-        print("🔍 First few rows of Excel file:")
-        print(df.head())
-
-        first_row_value = str(df.iloc[0, 0]).strip()
-        try:
-            station_count = int(first_row_value.split()[-1]) 
-        except ValueError:
-            print(f"⚠️ Couldn't extract number from '{first_row_value}', falling back on column count.")
-            station_count = df.shape[1] - 1  # fallback: all columns except column 0
-
-        print(f"🔢 Extracted Station Count: {station_count}")
-
-        df = df.iloc[2:].T
-        df.columns = df.iloc[0]  
-        df = df[1:]
-
-        df.rename(columns={df.columns[0]: "Station Name", 
-                           df.columns[1]: "Static", 
-                           df.columns[2]: "Onboard Slots"}, inplace=True)
+        # Parsed straight from the upload stream; the file is never saved to disk
+        station_data = parse_station_upload(file.stream, file.filename)
+        station_count = len(station_data)
+        print(f"📊 Parsed {station_count} stations from {file.filename}")
 
-        df.reset_index(drop=True, inplace=True)
+        return jsonify({"station_count": station_count, "data": station_data})
 
-        station_data = df.to_dict(orient="records")
+    except Exception as e:
+        print(f"❌ Error processing file: {str(e)}")
+        return jsonify({"error": f"File processing error: {str(e)}"}), 500
 
-        station_count = len(station_data)
+@app.route("/api/upload_allocate", methods=["POST"])
+def upload_and_allocate():
+    """
+    One-shot pipeline: parses the uploaded station sheet (form field 'file'), maps it to
+    planning stations and runs allocation -> persistence -> Excel on the server, so the
+    station list no longer travels to the browser and back.
+    Accepts ?mode=, ?layout=/?columns= and ?download=1 like /allocate_slots_endpoint;
+    ?async=1 queues the work as a background job instead (202 with jobId and statusUrl).
+    """
+    if "file" not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+    file = request.files["file"]
+    if file.filename == "":
+        return jsonify({"error": "No file selected"}), 400
+    if not file.filename.endswith((".xls", ".xlsx")):
+        return jsonify({"error": "Invalid file format"}), 400
 
-        print(f"📊 Parsed Data: {station_data} \n {35*'---'}")
+    allocation_mode = request.args.get('mode', 'sequential')
+    if allocation_mode not in ALLOCATION_MODES:
+        return jsonify({"error": f"Invalid allocation mode '{allocation_mode}'. Expected one of: {', '.join(ALLOCATION_MODES)}"}), 400
 
-        return jsonify({"station_count": station_count, "data": station_data})
+    excel_options, options_error = excel_options_from_request()
+    if options_error:
+        return jsonify({"error": options_error}), 400
 
+    try:
+        # The upload has to be parsed within the request, even for a background job
+        planning_stations = planning_stations_from_upload(parse_station_upload(file.stream, file.filename))
     except Exception as e:
         print(f"❌ Error processing file: {str(e)}")
-        return jsonify({"error": f"File processing error: {str(e)}"}), 500
+        return jsonify({"error": f"File processing error: {str(e)}"}), 400
+    if not planning_stations:
+        return jsonify({"error": "No stations found in the uploaded file"}), 400
+    print(f"DEBUG routes.py: Parsed {len(planning_stations)} planning stations from {file.filename} for allocation.")
+
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        job_id = allocation_jobs.submit(_allocation_job, planning_stations, allocation_mode, excel_options)
+        return jsonify({
+            "jobId": job_id,
+            "stationCount": len(planning_stations),
+            "statusUrl": url_for('allocation_job_status', job_id=job_id, _external=True)
+        }), 202
+
+    try:
+        if request.args.get('download', '').lower() in ('1', 'true', 'yes'):
+            workbook_buffer, persistence = run_allocation_pipeline(planning_stations, allocation_mode, in_memory=True, excel_options=excel_options)
+            if workbook_buffer is None:
+                return jsonify({"error": "Failed to generate Excel file after allocation.", "persistence": persistence}), 500
+            return send_workbook(workbook_buffer, persistence)
+
+        output_filepath, persistence = run_allocation_pipeline(planning_stations, allocation_mode, excel_options=excel_options)
+        if not output_filepath:
+            return jsonify({"error": "Failed to generate Excel file after allocation.", "persistence": persistence}), 500
+        return jsonify({
+            "message": allocation_message(persistence),
+            "persistence": persistence,
+            "stationCount": len(planning_stations),
+            "fileUrl": url_for('download_generated_file', filename=os.path.basename(output_filepath), _external=True)
+        })
+    except Exception as e:
+        print(f"Error in upload_and_allocate: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
 
@@ -0,0 +1,154 @@
+from math import asin, cos, degrees, floor, pi, radians, sin
+from collections import defaultdict
+
+EARTH_RADIUS_KM = 6371  # Same radius calculate_distances uses
+
+# Cells are padded by this factor so floating point rounding at a cell edge can never
+# push a genuinely close pair two cells apart.
+CELL_PADDING = 1.000001
+
+def reach_in_degrees(distance_km: float, max_abs_lat: float) -> tuple[float, float]:
+    """
+    Returns the largest (|dlat|, |dlon|) in degrees two points can differ by while
+    being closer than `distance_km` (haversine), given neither point is further from
+    the equator than `max_abs_lat`.
+
+    Latitude: the great-circle distance is never shorter than the meridian arc, so
+    |dlat| <= d / R.
+    Longitude: sin^2(d/2R) >= cos(lat1) * cos(lat2) * sin^2(dlon/2), so
+    |dlon| <= 2 * asin(sin(d/2R) / cos(max_lat)).
+    """
+    lat_reach = degrees(distance_km / EARTH_RADIUS_KM)
+    if distance_km >= pi * EARTH_RADIUS_KM:
+        return lat_reach, 360.0 # Half the circumference or more: any two points are within reach
+
+    cos_max_lat = cos(radians(min(abs(max_abs_lat), 90.0)))
+    if cos_max_lat <= 0:
+        return lat_reach, 360.0
+    ratio = sin(distance_km / (2 * EARTH_RADIUS_KM)) / cos_max_lat
+    if ratio >= 1:
+        return lat_reach, 360.0 # Every longitude can be within reach
+    return lat_reach, degrees(2 * asin(ratio))
+
+def grid_cell_size(max_distance_km: float, max_abs_lat: float) -> tuple[float, float]:
+    """
+    Returns (lat_step, lon_step) in degrees for a uniform grid in which any two points
+    closer than `max_distance_km` are guaranteed to fall into the same or adjacent cells.
+    """
+    lat_reach, lon_reach = reach_in_degrees(max_distance_km, max_abs_lat)
+    if lon_reach >= 360.0:
+        return lat_reach * CELL_PADDING, 360.0 # Use a single column
+    return lat_reach * CELL_PADDING, lon_reach * CELL_PADDING
+
+def nearby_pairs_by_frequency(entries) -> list[tuple[int, int]]:
+    """
+    Finds candidate station pairs that share a frequency and are close enough that
+    their safe radii could overlap.
+
+    `entries` is an iterable of (index, frequency, lat, lon, radius_km) tuples. Each
+    frequency gets its own grid whose cell size is the largest possible sum of two radii
+    on that frequency, so only the 3x3 block of neighbouring cells has to be searched.
+    Returns (i, j) index pairs with i < j, sorted, which is the same order a nested
+    `for i / for j` scan would visit them in. Callers still have to check the real
+    distance; this only prunes pairs that cannot overlap.
+
+    Longitudes are not wrapped at the antimeridian (all stations are within India).
+    """
+    entries_by_freq = defaultdict(list)
+    for entry in entries:
+        entries_by_freq[entry[1]].append(entry)
+
+    pairs: list[tuple[int, int]] = []
+    for freq_entries in entries_by_freq.values():
+        if len(freq_entries) < 2:
+            continue
+
+        max_distance_km = 2 * max(e[4] for e in freq_entries)
+        if max_distance_km <= 0:
+            continue # Nothing can be closer than a zero radius sum
+
+        max_abs_lat = max(abs(e[2]) for e in freq_entries)
+        lat_step, lon_step = grid_cell_size(max_distance_km, max_abs_lat)
+
+        cells = defaultdict(list)
+        for idx, _freq, lat, lon, _rad in freq_entries:
+            cell_row = floor(lat / lat_step)
+            cell_col = floor(lon / lon_step)
+            # Pair with everything already placed in the surrounding 3x3 block, so
+            # each pair is produced exactly once.
+            for d_row in (-1, 0, 1):
+                for d_col in (-1, 0, 1):
+                    for other_idx in cells.get((cell_row + d_row, cell_col + d_col), ()):
+                        pairs.append((other_idx, idx) if other_idx < idx else (idx, other_idx))
+            cells[(cell_row, cell_col)].append(idx)
+
+    pairs.sort()
+    return pairs
+
+class FrequencyGrid:
+    """
+    Per-frequency grid over a fixed set of stations that can be queried with any
+    reach, e.g. to find which stored stations a single planning station could overlap.
+    `entries` has the same (index, frequency, lat, lon, radius_km) shape as
+    nearby_pairs_by_frequency takes.
+    """
+
+    def __init__(self, entries):
+        entries_by_freq = defaultdict(list)
+        for entry in entries:
+            entries_by_freq[entry[1]].append(entry)
+
+        self.grids = {}
+        for freq, freq_entries in entries_by_freq.items():
+            max_radius_km = max(e[4] for e in freq_entries)
+            max_abs_lat = max(abs(e[2]) for e in freq_entries)
+            # Cells are sized for two of the largest stored radii, the usual query reach.
+            lat_step, lon_step = grid_cell_size(max(2 * max_radius_km, 1.0), max_abs_lat)
+            cells = defaultdict(list)
+            for idx, _freq, lat, lon, _rad in freq_entries:
+                cells[(floor(lat / lat_step), floor(lon / lon_step))].append(idx)
+            self.grids[freq] = {
+                'max_radius_km': max_radius_km,
+                'max_abs_lat': max_abs_lat,
+                'lat_step': lat_step,
+                'lon_step': lon_step,
+                'cells': cells
+            }
+
+    def max_radius(self, freq) -> float:
+        """Largest stored radius on `freq`, 0.0 when nothing is stored on it."""
+        grid = self.grids.get(freq)
+        return grid['max_radius_km'] if grid else 0.0
+
+    def query(self, freq, lat: float, lon: float, reach_km: float) -> list[int]:
+        """
+        Returns the sorted indices of stations on `freq` that could be closer than
+        `reach_km` to (lat, lon). Callers still have to check the real distance.
+        """
+        grid = self.grids.get(freq)
+        if grid is None or reach_km <= 0:
+            return []
+
+        lat_reach, lon_reach = reach_in_degrees(reach_km, max(grid['max_abs_lat'], abs(lat)))
+        lat_reach *= CELL_PADDING
+        lat_step, lon_step, cells = grid['lat_step'], grid['lon_step'], grid['cells']
+        row_range = (floor((lat - lat_reach) / lat_step), floor((lat + lat_reach) / lat_step))
+        if lon_reach >= 360.0:
+            col_range = None # Every column
+        else:
+            lon_reach *= CELL_PADDING
+            col_range = (floor((lon - lon_reach) / lon_step), floor((lon + lon_reach) / lon_step))
+
+        found = []
+        box_size = (row_range[1] - row_range[0] + 1) * ((col_range[1] - col_range[0] + 1) if col_range else len(cells))
+        if col_range is None or box_size > len(cells):
+            # The search box is larger than the occupied part of the grid, walk the cells instead
+            for (cell_row, cell_col), idxs in cells.items():
+                if row_range[0] <= cell_row <= row_range[1] and (col_range is None or col_range[0] <= cell_col <= col_range[1]):
+                    found.extend(idxs)
+        else:
+            for cell_row in range(row_range[0], row_range[1] + 1):
+                for cell_col in range(col_range[0], col_range[1] + 1):
+                    found.extend(cells.get((cell_row, cell_col), ()))
+        found.sort()
+        return found
@@ -9,59 +9,81 @@ document.addEventListener('DOMContentLoaded', function() {
 
     let currentTable = tableSelect.value; // Track the currently selected table
 
-    // Function to fetch and display stations
+    const STATIONS_PAGE_SIZE = 500; // Rows per /api/get_stations request
+    let loadGeneration = 0; // Bumped by every load, so pages of a superseded load are dropped
+
+    const renderStationRow = (station) => {
+        const row = document.createElement('tr');
+        row.innerHTML = `
+            <td>${station.id}</td>
+            <td>${station.name}</td>
+            <td>${station.Station_Code || 'N/A'}</td>
+            <td>${station.SKac_ID || 'N/A'}</td>
+            <td>${station.latitude.toFixed(4)},<br>${station.longitude.toFixed(4)}</td>
+            <td>${station.safe_radius_km || 'N/A'}</td>
+            <td>${station.allocated_frequency || 'N/A'}</td>
+            <td>${station.timeslot || 'N/A'}</td>
+            <td>${station.Area_type || 'N/A'}</td>
+            <td><span class="badge ${station.status === 'approved' ? 'bg-success' : (station.status === 'Allocated Planning' ? 'bg-info' : 'bg-warning')}">${station.status || 'N/A'}</span></td>
+            <td>
+                <button class="btn btn-sm btn-info update-btn"
+                    data-id="${station.id}"
+                    data-name="${station.name}"
+                    data-station_code="${station.Station_Code || ''}"
+                    data-skac_id="${station.SKac_ID || ''}"
+                    data-latitude="${station.latitude}"
+                    data-longitude="${station.longitude}"
+                    data-safe_radius_km="${station.safe_radius_km || ''}"
+                    data-allocated_frequency="${station.allocated_frequency || ''}"
+                    data-timeslot="${station.timeslot || ''}"
+                    data-area_type="${station.Area_type || ''}"
+                    data-status="${station.status || ''}">
+                    <i class="fas fa-edit"></i>
+                </button>
+                <button class="btn btn-sm btn-danger delete-btn" data-id="${station.id}">
+                    <i class="fas fa-trash-alt"></i>
+                </button>
+            </td>
+        `;
+        attachEventListeners(row);
+        stationList.appendChild(row);
+    };
+
+    // Function to fetch and display stations, one page (keyset pagination on id) at a time
     const loadStations = () => {
-        // Fetch from the currently selected table
-        fetch(`/api/get_stations?table=${currentTable}`)
-            .then(response => {
-                if (!response.ok) {
-                    return response.json().then(err => { throw new Error(err.error || 'Failed to fetch stations'); });
-                }
-                return response.json();
-            })
-            .then(data => {
-                stationList.innerHTML = ''; // Clear existing list
-                if (data.stations && data.stations.length > 0) {
-                    data.stations.forEach(station => {
-                        const row = document.createElement('tr');
-                        row.innerHTML = `
-                            <td>${station.id}</td>
-                            <td>${station.name}</td>
-                            <td>${station.Station_Code || 'N/A'}</td>
-                            <td>${station.SKac_ID || 'N/A'}</td>
-                            <td>${station.latitude.toFixed(4)},<br>${station.longitude.toFixed(4)}</td>
-                            <td>${station.safe_radius_km || 'N/A'}</td>
-                            <td>${station.allocated_frequency || 'N/A'}</td>
-                            <td>${station.timeslot || 'N/A'}</td>
-                            <td>${station.Area_type || 'N/A'}</td>
-                            <td><span class="badge ${station.status === 'approved' ? 'bg-success' : (station.status === 'Allocated Planning' ? 'bg-info' : 'bg-warning')}">${station.status || 'N/A'}</span></td>
-                            <td>
-                                <button class="btn btn-sm btn-info update-btn"
-                                    data-id="${station.id}"
-                                    data-name="${station.name}"
-                                    data-station_code="${station.Station_Code || ''}"
-                                    data-skac_id="${station.SKac_ID || ''}"
-                                    data-latitude="${station.latitude}"
-                                    data-longitude="${station.longitude}"
-                                    data-safe_radius_km="${station.safe_radius_km || ''}"
-                                    data-allocated_frequency="${station.allocated_frequency || ''}"
-                                    data-timeslot="${station.timeslot || ''}"
-                                    data-area_type="${station.Area_type || ''}"
-                                    data-status="${station.status || ''}">
-                                    <i class="fas fa-edit"></i>
-                                </button>
-                                <button class="btn btn-sm btn-danger delete-btn" data-id="${station.id}">
-                                    <i class="fas fa-trash-alt"></i>
-                                </button>
-                            </td>
-                        `;
-                        stationList.appendChild(row);
-                    });
-                    attachEventListeners(); // Re-attach event listeners after rendering
-                } else {
-                    stationList.innerHTML = `<tr><td colspan="11">No stations found in ${currentTable.replace('_', ' ')}.</td></tr>`;
-                }
-            })
+        const generation = ++loadGeneration;
+        const table = currentTable;
+        let shown = 0;
+
+        const loadPage = (afterId) => {
+            const pageQuery = `limit=${STATIONS_PAGE_SIZE}` + (afterId == null ? '' : `&after_id=${afterId}`);
+            // Fetch from the currently selected table
+            return fetch(`/api/get_stations?table=${table}&${pageQuery}`)
+                .then(response => {
+                    if (!response.ok) {
+                        return response.json().then(err => { throw new Error(err.error || 'Failed to fetch stations'); });
+                    }
+                    return response.json();
+                })
+                .then(data => {
+                    if (generation !== loadGeneration) {
+                        return; // Another table (or a reload) was requested meanwhile
+                    }
+                    if (afterId == null) {
+                        stationList.innerHTML = ''; // Clear existing list
+                    }
+                    (data.stations || []).forEach(renderStationRow);
+                    shown += (data.stations || []).length;
+                    if (data.nextAfterId != null) {
+                        return loadPage(data.nextAfterId);
+                    }
+                    if (shown === 0) {
+                        stationList.innerHTML = `<tr><td colspan="11">No stations found in ${table.replace('_', ' ')}.</td></tr>`;
+                    }
+                });
+        };
+
+        loadPage(null)
             .catch(error => {
                 console.error('Error loading stations:', error);
                 showMessage(`Error loading stations: ${error.message}`, 'danger', formMessage);
@@ -110,11 +132,12 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     };
     
-    const attachEventListeners = () => {
-        document.querySelectorAll('.update-btn').forEach(button => {
+    // Listeners for the buttons of one rendered row (rows arrive page by page)
+    const attachEventListeners = (row) => {
+        row.querySelectorAll('.update-btn').forEach(button => {
             button.addEventListener('click', openUpdateModal);
         });
-        document.querySelectorAll('.delete-btn').forEach(button => {
+        row.querySelectorAll('.delete-btn').forEach(button => {
             button.addEventListener('click', handleDelete);
         });
     };
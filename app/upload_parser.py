@@ -0,0 +1,147 @@
+from io import BytesIO
+import math
+import openpyxl
+import pandas as pd
+
+# The first three label rows are renamed to the keys the frontend expects
+RENAMED_LABELS = ["Station Name", "Static", "Onboard Slots"]
+LABELS_START_ROW = 2 # 0-based: row 0 is the title ("... <station count>"), row 1 is skipped
+
+def _cell_value(value):
+    """Cell value as pd.read_excel would return it: integral floats become ints."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _trimmed(row) -> tuple:
+    """Row without its trailing empty cells."""
+    row = tuple(row)
+    end = len(row)
+    while end and row[end - 1] is None:
+        end -= 1
+    return row[:end]
+
+def station_records_from_rows(rows) -> list[dict]:
+    """
+    Builds one record per station column from the sheet rows, the way the transposed
+    DataFrame used to: column A holds the labels (from row 2 on), every further column
+    is a station. Rows are consumed one at a time, so only the records are kept in memory.
+    Empty cells become None; completely empty rows are skipped.
+    """
+    records: list[dict] = []
+    labels = {} # label -> None, in row order (a dict keeps the first position of repeated labels)
+    declared_count = None
+    for row_idx, row in enumerate(rows):
+        row = _trimmed(row)
+        # Every column that has a value anywhere in the sheet is a station, as with read_excel
+        while len(records) < len(row) - 1:
+            records.append({})
+
+        if row_idx == 0 and row:
+            try:
+                declared_count = int(str(row[0]).strip().split()[-1])
+            except (ValueError, IndexError):
+                print(f"⚠️ Couldn't extract number from '{row[0]}', using the column count.")
+            continue
+        if row_idx < LABELS_START_ROW:
+            continue
+
+        label_offset = row_idx - LABELS_START_ROW
+        if label_offset < len(RENAMED_LABELS):
+            label = RENAMED_LABELS[label_offset] # renamed by position, even when the row is empty
+        elif row:
+            label = row[0]
+        else:
+            continue
+        labels[label] = None
+        for station_idx, value in enumerate(row[1:]):
+            records[station_idx][label] = _cell_value(value)
+
+    # Stations that have no value in some row still get the key, like the DataFrame's NaN
+    records = [{label: record.get(label) for label in labels} for record in records]
+
+    print(f"🔢 Parsed {len(records)} stations (title declares {declared_count if declared_count is not None else 'no count'}).")
+    return records
+
+def parse_station_upload(stream, filename: str) -> list[dict]:
+    """
+    Parses an uploaded station sheet straight from the request stream, nothing is saved
+    to disk. .xlsx is read row by row with openpyxl's read-only mode; legacy .xls (which
+    openpyxl cannot read) is loaded in memory with pandas.
+    """
+    if filename.lower().endswith(".xlsx"):
+        wb = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0] # pd.read_excel reads the first sheet
+            return station_records_from_rows(ws.iter_rows(values_only=True))
+        finally:
+            wb.close()
+
+    df = pd.read_excel(BytesIO(stream.read()), header=None)
+    df = df.astype(object).where(df.notna(), None)
+    return station_records_from_rows(df.itertuples(index=False, name=None))
+
+# allocate_slots input key -> accepted sheet labels, compared without case, spaces or punctuation.
+# Covers the renamed first three labels, the frontend's key names and the matrix header labels.
+UPLOAD_FIELD_ALIASES = {
+    "name": ("stationname", "name"),
+    "Static": ("static", "optimumstaticparam", "optimumnoofsimultaneousexclusivestaticprofiletransfer"),
+    "onboardSlots": ("onboardslots", "peaknosofonboardkavachunitsinstnunitjurisdiction"),
+    "StationCode": ("stationcode",),
+    "KavachID": ("kavachid", "stationarykavachid", "skacid"),
+    "Latitude": ("latitude", "lat", "stationaryunittowerlatitude"),
+    "Longitude": ("longitude", "lon", "stationaryunittowerlongitude"),
+    "SafeRadius": ("saferadius", "saferadiuskm", "radius")
+}
+DEFAULT_SAFE_RADIUS_KM = 12.0
+
+def _normalized_label(label) -> str:
+    return "".join(ch for ch in str(label).lower() if ch.isalnum())
+
+def _numeric(value, cast):
+    """
+    Numbers and numeric strings are converted; anything else is passed on for allocate_slots
+    to reject. Values that cannot be converted faithfully (inf/nan, or a fractional number for
+    an int field, which int() would silently truncate) are passed on as text, so
+    allocate_slots reports them on that station instead of the upload failing or guessing.
+    """
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return value
+    try:
+        number = float(value.strip()) if isinstance(value, str) else value
+        if not math.isfinite(number) or (cast is int and not float(number).is_integer()):
+            return str(value)
+        return cast(number)
+    except (ValueError, OverflowError):
+        return str(value)
+
+def planning_stations_from_upload(records: list[dict]) -> list[dict]:
+    """
+    Maps parsed upload records (see parse_station_upload) to the planning station dicts
+    allocate_slots expects, the same keys the map page posts to /allocate_slots_endpoint.
+    Missing codes/IDs become "", a missing safe radius the default 12 km; a missing or
+    non-numeric coordinate is left for allocate_slots to report on that station.
+    """
+    if not records:
+        return []
+    label_of = {}
+    for label in records[0]:
+        normalized = _normalized_label(label)
+        for key, aliases in UPLOAD_FIELD_ALIASES.items():
+            if normalized in aliases and key not in label_of:
+                label_of[key] = label
+
+    def field(record, key, default=None):
+        value = record.get(label_of[key]) if key in label_of else None
+        return default if value is None else value
+
+    return [{
+        "name": field(record, "name"),
+        "StationCode": field(record, "StationCode", ""),
+        "KavachID": field(record, "KavachID", ""),
+        "Latitude": _numeric(field(record, "Latitude"), float),
+        "Longitude": _numeric(field(record, "Longitude"), float),
+        "SafeRadius": _numeric(field(record, "SafeRadius", DEFAULT_SAFE_RADIUS_KM), float),
+        "Static": _numeric(field(record, "Static"), int),
+        "onboardSlots": _numeric(field(record, "onboardSlots"), int)
+    } for record in records]
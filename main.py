@@ -1,3 +1,8 @@
+import multiprocessing
+# Must run before the app import: in a PyInstaller build the spawned allocation workers
+# re-run this executable, and this hands them over to multiprocessing instead of starting the app.
+multiprocessing.freeze_support()
+
 from app.routes import app
 import webbrowser
 from threading import Timer
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app package lives at the repository root and the shared helpers next to this file
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(TESTS_DIR), TESTS_DIR]
+
+from app import database
+
+# app.routes runs db_init when it is imported: point the pool at a throwaway file first,
+# so no test ever opens the approved_stations.db in the working directory.
+database.db_pool = database.ConnectionPool(os.path.join(tempfile.mkdtemp(), database.DATABASE_FILE_NAME))
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """
+    A fresh, initialised database in tmp_path for one test; generated workbooks go to
+    tmp_path too. Yields the Flask app, whose connections now come from that database.
+    """
+    from app import processing, routes
+
+    pool = database.ConnectionPool(str(tmp_path / database.DATABASE_FILE_NAME))
+    monkeypatch.setattr(database, "db_pool", pool)
+    monkeypatch.setattr(routes, "db_pool", pool)
+    monkeypatch.setattr(processing, "UPLOAD_FOLDER", str(tmp_path))
+    with routes.app.app_context():
+        database.db_init()
+    yield routes.app
@@ -0,0 +1,70 @@
+"""
+Regenerates tests/golden/*.json from the pre-refactor code, which the parity tests
+compare the current code against:
+
+    git worktree add /tmp/freq-auto-baseline e269fa9
+    python tests/make_golden.py /tmp/freq-auto-baseline
+
+Run it again whenever the fixed inputs in tests/parity.py change.
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+import openpyxl
+
+from parity import (GOLDEN_DIR_NAME, FixedDatetime, allocation_cases, approved_rows, db_planning_rows,
+                    insert_rows, map_cases, workbook_signature)
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), GOLDEN_DIR_NAME)
+
+def write_golden(name, data):
+    with open(os.path.join(GOLDEN_DIR, name), "w") as f:
+        json.dump(data, f, separators=(",", ":")) # Key order matters: it is the Details sheet column order
+        f.write("\n")
+    print(f"Wrote {GOLDEN_DIR_NAME}/{name}")
+
+def main(baseline_root):
+    sys.path.insert(0, os.path.abspath(baseline_root))
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir) # The baseline keeps its database in the working directory
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import processing
+        from app.database import get_db_connection
+        from app.routes import app
+
+    with app.app_context(), contextlib.redirect_stdout(io.StringIO()):
+        conn = get_db_connection()
+        insert_rows(conn, "approved_stations", approved_rows())
+        insert_rows(conn, "planning_stations", db_planning_rows())
+        # The baseline allocation engine reads the approved stations from the legacy table
+        conn.execute("CREATE TABLE IF NOT EXISTS stations AS SELECT * FROM approved_stations WHERE 0")
+        insert_rows(conn, "stations", approved_rows())
+        conn.commit()
+        allocations = [processing.allocate_slots(case['stations'], **case['kwargs']) for case in allocation_cases()]
+
+    client = app.test_client()
+    map_reports = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for frontend_stations in map_cases():
+            report = client.post('/api/update_map', json={'planning_stations': frontend_stations}).get_json()
+            map_reports.append({key: report[key] for key in ('interTypeConflicts', 'overlappingPairData', 'hasConflict')})
+
+    processing.datetime = FixedDatetime
+    processing.OUTPUT_FILE = os.path.join(work_dir, "baseline.xlsx")
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert processing.generate_excel(allocations[0]) == processing.OUTPUT_FILE
+    workbook = workbook_signature(openpyxl.load_workbook(processing.OUTPUT_FILE))
+
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    write_golden("allocation.json", allocations)
+    write_golden("update_map.json", map_reports)
+    write_golden("workbook.json", workbook)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    main(sys.argv[1])
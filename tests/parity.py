@@ -0,0 +1,129 @@
+"""
+Fixed inputs and comparison helpers shared by the parity tests and make_golden.py.
+Nothing here imports the app, so the golden files can be generated from any checkout.
+"""
+import math
+import random
+from datetime import datetime
+
+GOLDEN_DIR_NAME = "golden"
+
+class FixedDatetime(datetime):
+    """datetime whose now() is pinned, so workbook titles (date and hour) are reproducible."""
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2025, 1, 15, 10, 30)
+
+def approved_rows() -> list[dict]:
+    """Approved stations (approved_stations columns) spread over a ~2x2 degree area."""
+    rnd = random.Random(1)
+    rows = []
+    for k in range(30):
+        start = rnd.randint(2, 30)
+        rows.append({
+            'id': k + 1, 'name': f"A{k}", 'Station_Code': f"A{k}", 'SKac_ID': str(5000 + k),
+            'latitude': round(27.0 + rnd.uniform(0, 2), 6), 'longitude': round(77.0 + rnd.uniform(0, 2), 6),
+            'safe_radius_km': rnd.choice([8.0, 12.0, 20.0]), 'status': 'approved',
+            'allocated_frequency': rnd.choice([None, 1, 2, 3, 4, 5, 6, 7]),
+            'timeslot': rnd.choice([None, '', f"{start}-{start + rnd.randint(1, 14)}"]),
+            'Area_type': 'Rural'
+        })
+    return rows
+
+def db_planning_rows() -> list[dict]:
+    """Persisted planning stations (planning_stations columns) near the approved ones."""
+    rnd = random.Random(2)
+    return [{
+        'id': k + 1, 'name': f"P{k}", 'Station_Code': f"P{k}", 'SKac_ID': str(7000 + k),
+        'latitude': round(27.0 + rnd.uniform(0, 2), 6), 'longitude': round(77.0 + rnd.uniform(0, 2), 6),
+        'safe_radius_km': rnd.choice([8.0, 12.0, 20.0]), 'status': 'Allocated',
+        'allocated_frequency': rnd.choice([None, 1, 2, 3, 4, 5, 6, 7]),
+        'timeslot': None, 'Area_type': 'Allocated Planning'
+    } for k in range(12)]
+
+def insert_rows(conn, table, rows):
+    """Inserts station dicts (as from approved_rows/db_planning_rows) into `table`."""
+    columns = list(rows[0])
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [tuple(row[c] for c in columns) for row in rows]
+    )
+
+def allocation_cases() -> list[dict]:
+    """Planning station sets for allocate_slots, including invalid and oversized requests."""
+    cases = []
+    for seed, count, kwargs in ((10, 12, {}), (11, 25, {}), (12, 15, {'max_slots': 20}), (13, 10, {'max_frequencies': 2})):
+        rnd = random.Random(seed)
+        stations = [{
+            'name': f"S{k}", 'StationCode': f"S{k}", 'KavachID': str(100 + k),
+            'Static': rnd.choice([0, 1, 2, 4, 8, 2.5]), 'onboardSlots': rnd.choice([0, 3, 10, 20, 44]),
+            'Latitude': round(27.0 + rnd.uniform(0, 2), 6), 'Longitude': round(77.0 + rnd.uniform(0, 2), 6),
+            'SafeRadius': rnd.choice([5.0, 12.0, 30.0])
+        } for k in range(count)]
+        stations.append({'name': "Bad", 'StationCode': "B", 'KavachID': "9", 'Static': 1, 'onboardSlots': 2, 'Latitude': "x", 'Longitude': 77.5})
+        cases.append({'kwargs': kwargs, 'stations': stations})
+    return cases
+
+def map_cases() -> list[list[dict]]:
+    """Frontend planning station lists for /api/update_map, some reusing persisted planning ids."""
+    stored = approved_rows() + db_planning_rows()
+    cases = []
+    for seed in range(4):
+        rnd = random.Random(100 + seed)
+        stations = []
+        for k in range(rnd.randint(5, 25)):
+            base = rnd.choice(stored)
+            stations.append({
+                'id': f"db_planning_{rnd.randint(1, 12)}" if rnd.random() < 0.2 else f"fe{k}",
+                'name': f"F{k}",
+                'lat': base['latitude'] + rnd.uniform(-0.3, 0.3), 'lon': base['longitude'] + rnd.uniform(-0.3, 0.3),
+                'rad': rnd.choice([None, 8, 12, 20]), 'frequency': rnd.choice([None, 1, 2, 3, 4, 5, 6, 7])
+            })
+        cases.append(stations)
+    return cases
+
+def _rgb(color):
+    value = color.rgb if color is not None and isinstance(color.rgb, str) else None
+    return value[-6:].upper() if value else None
+
+def cell_signature(cell, details_sheet: bool = False) -> list:
+    """Value and the visible styling of an openpyxl cell; details cells are compared by value only."""
+    value = cell.value
+    if value == "" or (isinstance(value, float) and math.isnan(value)):
+        value = None
+    if details_sheet:
+        return [value]
+    font, alignment, border = cell.font, cell.alignment, cell.border
+    font_color = _rgb(font.color)
+    return [
+        value, bool(font.b), font.u or None, None if font_color == '000000' else font_color,
+        _rgb(cell.fill.fgColor) if cell.fill.fill_type == 'solid' else None,
+        alignment.horizontal, alignment.vertical, int(alignment.textRotation or 0), bool(alignment.wrap_text),
+        border.left.style, border.right.style, border.top.style, border.bottom.style
+    ]
+
+def workbook_signature(workbook) -> dict:
+    """Per sheet: the cell signatures row by row and the merged ranges."""
+    sheets = {}
+    for ws in workbook.worksheets:
+        details_sheet = ws.title == "Allocation Details"
+        cells = [[cell_signature(ws.cell(row, col), details_sheet) for col in range(1, ws.max_column + 1)]
+                 for row in range(1, ws.max_row + 1)]
+        sheets[ws.title] = {'cells': cells, 'merged': sorted(str(r) for r in ws.merged_cells.ranges)}
+    return sheets
+
+def assert_close(actual, expected, path="result"):
+    """Deep equality where floats may differ by rounding (the haversine is vectorised now)."""
+    if isinstance(expected, float) and isinstance(actual, (int, float)) and not isinstance(actual, bool):
+        assert math.isclose(actual, expected, rel_tol=1e-9, abs_tol=1e-9), f"{path}: {actual!r} != {expected!r}"
+    elif isinstance(expected, dict):
+        assert isinstance(actual, dict) and actual.keys() == expected.keys(), f"{path}: keys differ"
+        for key in expected:
+            assert_close(actual[key], expected[key], f"{path}[{key!r}]")
+    elif isinstance(expected, list):
+        assert isinstance(actual, list) and len(actual) == len(expected), f"{path}: length differs"
+        for index, (a, e) in enumerate(zip(actual, expected)):
+            assert_close(a, e, f"{path}[{index}]")
+    else:
+        assert actual == expected, f"{path}: {actual!r} != {expected!r}"
@@ -0,0 +1,37 @@
+import sqlite3
+import time
+
+from app import routes
+
+PLANNING_STATIONS = [{
+    'name': f"S{k}", 'StationCode': f"S{k}", 'KavachID': str(100 + k), 'Static': 2, 'onboardSlots': 4,
+    'Latitude': 27.0 + k * 0.01, 'Longitude': 78.0, 'SafeRadius': 12.0
+} for k in range(3)]
+
+def finished_job_status(client, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f"/api/allocation_jobs/{job_id}").get_json()
+        if status['status'] in ("finished", "failed"):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish within {timeout}s")
+
+def test_job_status_reports_persistence(temp_db):
+    client = temp_db.test_client()
+    job_id = client.post("/api/allocation_jobs", json=PLANNING_STATIONS).get_json()['jobId']
+    status = finished_job_status(client, job_id)
+    assert status['status'] == "finished"
+    assert status['persistence'] == {'saved': True, 'inserted': 3, 'updated': 0, 'skipped': 0}
+
+def test_job_status_reports_failed_save(temp_db, monkeypatch):
+    def failing_save(allocated_planning_results):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(routes, "save_allocated_planning_stations", failing_save)
+
+    client = temp_db.test_client()
+    job_id = client.post("/api/allocation_jobs", json=PLANNING_STATIONS).get_json()['jobId']
+    status = finished_job_status(client, job_id)
+    assert status['status'] == "finished" # The workbook was still generated
+    assert status['fileUrl']
+    assert status['persistence'] == {'saved': False, 'error': "database is locked"}
@@ -0,0 +1,51 @@
+from app import database
+from app.database import get_db_connection
+
+def test_pool_connections_are_tuned_and_reused(temp_db):
+    with temp_db.app_context():
+        first = get_db_connection()
+        assert first.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert first.execute("PRAGMA synchronous").fetchone()[0] == 1 # NORMAL
+        assert get_db_connection() is first # One connection per app context
+    with temp_db.app_context():
+        assert get_db_connection() is first # Handed back at teardown and reused
+
+    stats = database.db_pool.stats()
+    assert stats['in_use'] == 0 and stats['idle'] == 1
+    assert stats['reused'] >= 1
+
+def test_pool_rolls_back_and_bounds_idle_connections(tmp_path):
+    pool = database.ConnectionPool(str(tmp_path / "pool.db"), max_idle=2)
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.commit()
+    conn.execute("INSERT INTO t VALUES (1)") # Left uncommitted
+    pool.release(conn)
+    assert pool.acquire().execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+
+    connections = [pool.acquire() for _ in range(3)]
+    for conn in connections:
+        pool.release(conn)
+    assert pool.stats()['idle'] == 2
+    assert pool.stats()['closed'] == 1
+
+def test_wal_readers_are_not_blocked_by_a_writer(temp_db):
+    pool = database.db_pool
+    writer, reader = pool.acquire(), pool.acquire()
+    try:
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("INSERT INTO approved_stations (name, latitude, longitude) VALUES ('A', 27.0, 78.0)")
+        # The uncommitted row is invisible, and reading doesn't wait for the write lock
+        assert reader.execute("SELECT COUNT(*) FROM approved_stations").fetchone()[0] == 0
+        writer.commit()
+        assert reader.execute("SELECT COUNT(*) FROM approved_stations").fetchone()[0] == 1
+    finally:
+        pool.release(writer)
+        pool.release(reader)
+
+def test_pool_forgets_connections_inherited_across_fork(tmp_path):
+    pool = database.ConnectionPool(str(tmp_path / "pool.db"))
+    pool.release(pool.acquire())
+    pool._pid = -1 # As seen from a forked child
+    assert pool.stats()['idle'] == 0
+    assert pool.acquire() is not None
@@ -0,0 +1,38 @@
+import os
+
+import openpyxl
+import pytest
+
+from app import processing
+
+def results(station):
+    return [{'Station': station, 'Frequency': 1, 'Static': 2, 'Stationary Kavach Slots Allocated': "P2, P3",
+             'Num Stationary Allocated': 2, 'Num Onboard Allocated': 0}]
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(processing, "UPLOAD_FOLDER", str(tmp_path))
+    return tmp_path
+
+def test_workbook_is_content_addressed(upload_folder):
+    first = processing.generate_excel(results("A"))
+    assert os.path.basename(first).startswith(processing.GENERATED_EXCEL_PREFIX)
+    assert processing.generate_excel(results("A")) == first
+    assert processing.generate_excel(results("B")) != first
+    assert sorted(os.listdir(upload_folder)) == sorted(os.path.basename(p) for p in (first, processing.generate_excel(results("B"))))
+
+def test_uncolored_fallback_is_content_addressed_and_pruned(upload_folder, monkeypatch):
+    monkeypatch.setattr(processing, "render_workbook", lambda *args, **kwargs: False)
+    assert processing.generate_excel(results("A")) is None
+    assert processing.generate_excel(results("B")) is None
+
+    # One fallback per result set, cache-named, no temp files left behind
+    fallbacks = sorted(os.listdir(upload_folder))
+    assert len(fallbacks) == 2
+    assert all(name.startswith(processing.GENERATED_EXCEL_PREFIX) and name.endswith(".xlsx") for name in fallbacks)
+    stations = {openpyxl.load_workbook(upload_folder / name).active["A2"].value for name in fallbacks}
+    assert stations == {"A", "B"}
+
+    monkeypatch.setattr(processing, "EXCEL_CACHE_MAX_FILES", 1)
+    processing.prune_generated_excel_files()
+    assert len(os.listdir(upload_folder)) == 1
@@ -0,0 +1,53 @@
+from app.database import get_db_connection
+
+def add_stations(app, count, start=0):
+    with app.app_context():
+        conn = get_db_connection()
+        conn.executemany(
+            "INSERT INTO approved_stations (name, latitude, longitude, status, allocated_frequency) VALUES (?, ?, ?, ?, ?)",
+            [(f"S{k:03d}", 27.0 + k * 0.01, 78.0, 'approved', k % 7 + 1) for k in range(start, start + count)]
+        )
+        conn.commit()
+
+def test_keyset_pagination_walks_every_row_once(temp_db):
+    add_stations(temp_db, 25)
+    client = temp_db.test_client()
+    names, after_id, pages = [], None, 0
+    while True:
+        query = "/api/get_stations?limit=10&fields=id,name" + ("" if after_id is None else f"&after_id={after_id}")
+        payload = client.get(query).get_json()
+        pages += 1
+        assert all(set(station) == {'id', 'name'} for station in payload['stations'])
+        names += [station['name'] for station in payload['stations']]
+        after_id = payload['nextAfterId']
+        if after_id is None:
+            break
+    assert pages == 3
+    assert names == [f"S{k:03d}" for k in range(25)]
+
+def test_pagination_combines_with_filters(temp_db):
+    add_stations(temp_db, 25)
+    payload = temp_db.test_client().get("/api/get_stations?frequency=1&limit=2").get_json()
+    assert [station['name'] for station in payload['stations']] == ["S000", "S007"]
+    assert payload['nextAfterId'] == payload['stations'][-1]['id']
+
+def test_invalid_page_parameters_are_rejected(temp_db):
+    client = temp_db.test_client()
+    assert client.get("/api/get_stations?limit=0").status_code == 400
+    assert client.get("/api/get_stations?after_id=x").status_code == 400
+
+def test_unchanged_stations_answer_304(temp_db):
+    add_stations(temp_db, 3)
+    client = temp_db.test_client()
+    first = client.get("/api/get_stations")
+    etag = first.headers['ETag']
+    assert etag
+
+    unchanged = client.get("/api/get_stations", headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+    assert unchanged.data == b""
+
+    add_stations(temp_db, 1, start=3) # Any change gives a new ETag and a full response
+    changed = client.get("/api/get_stations", headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert len(changed.get_json()['stations']) == 4
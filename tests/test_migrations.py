@@ -0,0 +1,52 @@
+from app import database
+from app.database import LEGACY_STATION_COLUMNS, MIGRATIONS, get_db_connection, run_migrations
+
+def station(name, skac_id, latitude=27.0):
+    return (name, name, skac_id, latitude, 78.0, 12.0, 'approved', 1, None, None,
+            None, None, None, None, None, None, '2-14', 'Rural')
+
+def insert(conn, table, rows):
+    columns = ", ".join(LEGACY_STATION_COLUMNS)
+    conn.executemany(f"INSERT INTO {table} ({columns}) VALUES ({', '.join('?' * len(LEGACY_STATION_COLUMNS))})", rows)
+
+def tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+def rerun_legacy_merge(conn, legacy_rows, approved_rows=()):
+    """Recreates the pre-split 'stations' table and runs migration 2 again."""
+    conn.execute(f"CREATE TABLE stations (id INTEGER PRIMARY KEY AUTOINCREMENT, {', '.join(LEGACY_STATION_COLUMNS)})")
+    insert(conn, "stations", legacy_rows)
+    insert(conn, "approved_stations", list(approved_rows))
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    run_migrations(conn)
+
+def test_fresh_database_is_fully_migrated(temp_db):
+    with temp_db.app_context():
+        conn = get_db_connection()
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == MIGRATIONS[-1][0]
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        assert {"idx_approved_stations_freq_geo", "idx_planning_stations_status"} <= indexes
+
+def test_legacy_table_is_dropped_when_every_row_was_merged(temp_db):
+    with temp_db.app_context():
+        conn = get_db_connection()
+        # B is already approved with identical values, A is copied over
+        rerun_legacy_merge(conn, [station("A", "1"), station("B", "2")], approved_rows=[station("B", "2")])
+        assert "stations" not in tables(conn) and "stations_legacy" not in tables(conn)
+        assert [row[0] for row in conn.execute("SELECT name FROM approved_stations ORDER BY name")] == ["A", "B"]
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == MIGRATIONS[-1][0]
+
+def test_legacy_table_is_kept_when_rows_differ(temp_db):
+    with temp_db.app_context():
+        conn = get_db_connection()
+        # Same name as an approved station but another SKac_ID / position: not merged
+        rerun_legacy_merge(conn, [station("A", "1"), station("B", "9", latitude=28.0)], approved_rows=[station("B", "2")])
+        assert "stations" not in tables(conn)
+        assert tuple(conn.execute("SELECT name, SKac_ID FROM stations_legacy WHERE name = 'B'").fetchone()) == ("B", "9")
+        assert tuple(conn.execute("SELECT SKac_ID, latitude FROM approved_stations WHERE name = 'B'").fetchone()) == ("2", 27.0)
+
+        # Applied migrations are not repeated on the next start
+        database.db_init()
+        assert "stations_legacy" in tables(conn)
+        assert conn.execute("SELECT COUNT(*) FROM approved_stations").fetchone()[0] == 2
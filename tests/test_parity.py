@@ -0,0 +1,73 @@
+"""
+Parity with the pre-refactor code: the allocation engine, the /api/update_map conflict
+report and the allocation workbook must give the same results as the baseline did on
+the fixed station sets in parity.py (golden files written by make_golden.py).
+"""
+import json
+import os
+
+import openpyxl
+import pytest
+
+from app import processing
+from app.conflicts import ConflictGraph, find_map_conflicts
+from app.database import get_db_connection
+from parity import (GOLDEN_DIR_NAME, FixedDatetime, allocation_cases, approved_rows, assert_close,
+                    db_planning_rows, insert_rows, map_cases, workbook_signature)
+
+def load_golden(name):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), GOLDEN_DIR_NAME, name)) as f:
+        return json.load(f)
+
+def as_json(value):
+    """The value as the golden file stores it (tuples become lists)."""
+    return json.loads(json.dumps(value))
+
+ALLOCATIONS = load_golden("allocation.json")
+MAP_REPORTS = load_golden("update_map.json")
+
+@pytest.mark.parametrize("case_index", range(len(allocation_cases())))
+def test_allocation_matches_baseline(case_index):
+    case = allocation_cases()[case_index]
+    snapshot = processing.build_approved_snapshot(approved_rows())
+    results = processing.allocate_slots_with_snapshot(case['stations'], snapshot, **case['kwargs'])
+    assert_close(as_json(results), ALLOCATIONS[case_index])
+
+def map_report(inter_type_conflicts):
+    """The conflict fields of /api/update_map, built as update_map builds them."""
+    return as_json({
+        'interTypeConflicts': inter_type_conflicts,
+        'overlappingPairData': [],
+        'hasConflict': bool(inter_type_conflicts)
+    })
+
+@pytest.mark.parametrize("case_index", range(len(map_cases())))
+def test_update_map_conflicts_match_baseline(case_index):
+    conflicts = find_map_conflicts(approved_rows(), db_planning_rows(), map_cases()[case_index])
+    assert_close(map_report(conflicts), MAP_REPORTS[case_index])
+
+def test_update_map_route_matches_baseline(temp_db):
+    with temp_db.app_context():
+        conn = get_db_connection()
+        insert_rows(conn, "approved_stations", approved_rows())
+        insert_rows(conn, "planning_stations", db_planning_rows())
+        conn.commit()
+    client = temp_db.test_client()
+    for frontend_stations, expected in zip(map_cases(), MAP_REPORTS):
+        report = client.post('/api/update_map', json={'planning_stations': frontend_stations}).get_json()
+        assert_close({key: report[key] for key in expected}, expected)
+
+def test_cached_conflict_graph_matches_baseline():
+    # One graph across all cases, twice: cached edges must not leak between map refreshes
+    graph = ConflictGraph()
+    for _ in range(2):
+        for frontend_stations, expected in zip(map_cases(), MAP_REPORTS):
+            conflicts = graph.find_conflicts(approved_rows(), db_planning_rows(), frontend_stations)
+            assert_close(map_report(conflicts), expected)
+
+@pytest.mark.parametrize("backend", processing.EXCEL_BACKENDS)
+def test_workbook_matches_baseline(backend, monkeypatch):
+    monkeypatch.setattr(processing, "datetime", FixedDatetime)
+    workbook_buffer = processing.generate_excel(ALLOCATIONS[0], backend=backend, in_memory=True)
+    assert workbook_buffer is not None
+    assert as_json(workbook_signature(openpyxl.load_workbook(workbook_buffer))) == load_golden("workbook.json")
@@ -0,0 +1,64 @@
+import pytest
+
+from app.database import get_db_connection
+
+def add_operation(name, skac_id, **fields):
+    return {
+        'op': 'add', 'name': name, 'Station_Code': name, 'SKac_ID': skac_id, 'latitude': 27.0, 'longitude': 78.0,
+        'safe_radius_km': 12, 'status': 'approved', 'timeslot': '2-14', 'Area_type': 'Rural', **fields
+    }
+
+def station_names(app):
+    with app.app_context():
+        return [row['name'] for row in get_db_connection().execute("SELECT name FROM approved_stations ORDER BY id")]
+
+@pytest.mark.parametrize("atomic", ["false", "true", 0, 1, None, []])
+def test_atomic_must_be_a_boolean(temp_db, atomic):
+    response = temp_db.test_client().post("/api/stations_batch", json={'operations': [add_operation("A", "1")], 'atomic': atomic})
+    assert response.status_code == 400
+    assert station_names(temp_db) == []
+
+def run_batch(app, operations, **options):
+    response = app.test_client().post("/api/stations_batch", json={'operations': operations, **options})
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_failed_operation_is_rolled_back_alone(temp_db):
+    batch = run_batch(temp_db, [
+        add_operation("A", "1"),
+        add_operation("A", "2"), # Duplicate name
+        add_operation("C", "3", latitude=[27.0]), # Rejected before reaching the database
+        {'op': 'update', 'id': 99, 'status': 'x'}, # No such station
+        add_operation("B", "4")
+    ])
+    assert batch['committed'] and not batch['success']
+    assert [result['success'] for result in batch['results']] == [True, False, False, False, True]
+    assert batch['results'][1]['message'].startswith("Duplicate name or SKac_ID")
+    assert station_names(temp_db) == ["A", "B"]
+
+def test_database_error_inside_an_operation_is_reported_per_item(temp_db):
+    with temp_db.app_context():
+        conn = get_db_connection()
+        # Fails when the UPDATE runs (OperationalError, not a constraint violation)
+        conn.execute("CREATE TRIGGER block_status BEFORE UPDATE OF status ON approved_stations BEGIN SELECT no_such_function(); END")
+        conn.commit()
+    batch = run_batch(temp_db, [
+        add_operation("A", "1"),
+        {'op': 'update', 'id': 1, 'status': 'retired'},
+        {'op': 'update', 'id': 1, 'Area_type': 'Urban'}
+    ])
+    assert [result['success'] for result in batch['results']] == [True, False, True]
+    assert batch['results'][1]['message'].startswith("Database error")
+    with temp_db.app_context():
+        row = get_db_connection().execute("SELECT status, Area_type FROM approved_stations WHERE id = 1").fetchone()
+        assert tuple(row) == ("approved", "Urban")
+
+def test_atomic_batch_rolls_back_everything_on_failure(temp_db):
+    batch = run_batch(temp_db, [add_operation("A", "1"), add_operation("A", "2")], atomic=True)
+    assert not batch['committed']
+    assert batch['results'][0]['success'] # Applied under its savepoint, then undone with the batch
+    assert station_names(temp_db) == []
+
+    batch = run_batch(temp_db, [add_operation("A", "1"), add_operation("B", "2")], atomic=True)
+    assert batch['committed'] and batch['success']
+    assert station_names(temp_db) == ["A", "B"]